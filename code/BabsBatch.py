@@ -0,0 +1,185 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file renders BABS plots from the command line, without Qt.
+#    It reads a list of plot configurations from a JSON (or, if PyYAML
+#    is installed, YAML) file and draws each one to an image file with
+#    the Agg backend, spreading the plots over a pool of processes.
+#
+#    The datasets are loaded once in the parent process before the
+#    pool is started. The worker processes are forked from it and
+#    share the loaded data instead of reading it again.
+#
+#    Each configuration is a dictionary of PlotOptions attributes
+#    (see PlotOptions.fromdict) plus the name of the output file:
+#
+#       [{"output": "weekly.png", "dT": "7D", "division": "Customer Type"},
+#        {"output": "hourly.png", "typeid": 1, "binid": 3,
+#         "filters": {"Region": ["San Jose"]},
+#         "daterange": ["2014-01-01", "2014-03-31"]}]
+#
+#    Usage, from the code directory:
+#       python BabsBatch.py plots.json --outdir figures --processes 4
+#
+#    OUTLINE
+#       main       - parse the command line and render all plots
+#       preload    - load the datasets shared by the worker processes
+#       readconfigs- read the list of plot configurations from a file
+#       renderplot - calculate and draw one plot to an image file,
+#                       reporting an error instead of stopping the batch
+#
+########################################################################
+
+# Import modules required by these functions
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+import BabsFunctions
+import BabsClasses
+import BabsPlot
+import BabsRebalancing
+
+# YAML configuration files are optional
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+########################################################################
+
+# Size (inches) and resolution of the rendered figures
+FIGSIZE = (12, 7)
+DPI = 100
+
+
+def readconfigs(filein):
+    """
+    Returns the list of plot configurations (dictionaries) in the
+    JSON or YAML file filein. YAML is used for files ending in .yaml
+    or .yml and requires PyYAML.
+    """
+
+    with open(filein) as fid:
+        if os.path.splitext(filein)[1].lower() in ['.yaml','.yml']:
+            if yaml is None:
+                raise ImportError('PyYAML is required to read ' + filein)
+            configs = yaml.safe_load(fid)
+        else:
+            configs = json.load(fid)
+
+    if isinstance(configs, dict):
+        configs = [configs]
+    return configs
+
+
+def preload(jobs):
+    """
+    Loads the datasets needed by the plots in jobs into
+    BabsFunctions.STORE, so that forked worker processes share them.
+    """
+
+    names = ['trip','tripcube']
+    if any( NewOptions.overtype!=[] for NewOptions,fileout in jobs ):
+        names.append('weather')
+
+    # Each date range of the plots is loaded once
+    for daterange in set( NewOptions.daterange for NewOptions,fileout in jobs ):
+        for name in names:
+            BabsFunctions.STORE.fetch( BabsFunctions.basekey(name,daterange),
+                                       BabsFunctions.loaddata, name, daterange )
+
+        # Binned trip counts used for timeseries
+        cube = BabsFunctions.STORE.fetch( BabsFunctions.basekey('tripcube',daterange),
+                                          BabsFunctions.loaddata, 'tripcube', daterange )
+        BabsFunctions.STORE.fetch( BabsFunctions.basekey('trippyramid',daterange),
+                                   BabsFunctions.buildpyramid, cube )
+
+    # Availability plots read the cached rebalancing data. It is
+    #    ingested here, before the workers are forked, so that they
+    #    do not each build the same cache files at once.
+    if any( NewOptions.typeid==2 for NewOptions,fileout in jobs ):
+        BabsFunctions.STORE.fetch( ('base','rebalancingindex'), BabsRebalancing.loadindex,
+                                   BabsFunctions.csvfile('rebalancing') )
+
+
+def renderplot(job):
+    """
+    Calculates the plot described by job = (NewOptions, fileout) and
+    draws it to the image file fileout. Returns (fileout, error): error
+    is None if the plot was written, and otherwise describes why it
+    was not, so one bad configuration does not stop the other plots.
+    """
+
+    NewOptions, fileout = job
+
+    try:
+        tempdf, lines = BabsFunctions.plotdata(NewOptions)
+
+        # Draw on a figure of its own (attached to an Agg canvas), without
+        #    pyplot or Qt
+        figure = Figure( figsize=FIGSIZE, dpi=DPI )
+        FigureCanvas(figure)
+        barplot = BabsPlot.BarPlot(figure)
+        barplot.draw(NewOptions, tempdf, lines)
+        figure.savefig(fileout)
+    except Exception as error:
+        return fileout, '%s: %s' % (type(error).__name__, error)
+
+    return fileout, None
+
+
+def main():
+
+    parser = argparse.ArgumentParser( description='Render BABS plots without the GUI.' )
+    parser.add_argument( 'configs', help='JSON or YAML file with a list of plot configurations' )
+    parser.add_argument( '--outdir', default='.', help='directory for the image files' )
+    parser.add_argument( '--processes', type=int, default=multiprocessing.cpu_count(),
+                         help='number of worker processes (default: one per core)' )
+    args = parser.parse_args()
+
+    # Options and output file of each plot
+    jobs = []
+    for counter,config in enumerate(readconfigs(args.configs)):
+        config = dict(config)
+        fileout = config.pop( 'output', 'plot%03d.png' % counter )
+        NewOptions = BabsClasses.PlotOptions().fromdict(config)
+        jobs.append( (NewOptions, os.path.join(args.outdir,fileout)) )
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    # Load the data once, then render the plots in forked processes
+    preload(jobs)
+    if args.processes<=1:
+        results = [renderplot(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(args.processes)
+        try:
+            results = pool.map(renderplot, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Report every plot; exit with an error status if any plot failed
+    failed = [ (fileout,error) for fileout,error in results if error is not None ]
+    for fileout,error in results:
+        if error is None:
+            print fileout
+    for fileout,error in failed:
+        print 'Failed to render %s (%s)' % (fileout, error)
+    if failed!=[]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
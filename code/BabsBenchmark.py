@@ -0,0 +1,343 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file measures how long the stages of making a plot take and
+#    how much memory they use: loading each dataset, building the
+#    bitmap index, filtering (with and without it), typefraction,
+#    weatherbins, and the calculation of the bars for a matrix of plot
+#    options (typeid, barid, binid, division), from scratch and after
+#    toggling one filter checkbox. The trip
+#    data is subsampled to several sizes to show how each stage scales.
+#
+#    Results are written as JSON, one record per stage, options, and
+#    size. Two result files can be compared to see whether a change
+#    made the stages faster or slower.
+#
+#    Usage, from the code directory:
+#       python BabsBenchmark.py --output before.json
+#       python BabsBenchmark.py --output after.json --sizes 0.1,1.0
+#       python BabsBenchmark.py --compare before.json after.json
+#
+#    OUTLINE
+#       Measure    - times a stage and samples its peak memory
+#       compare    - print the change in time between two result files
+#       main       - parse the command line and run the benchmark
+#       optionmatrix - plot options covering every branch of calcbars
+#       resetstore - forget everything derived from the base datasets
+#       rss        - resident memory of this process
+#       run        - run all stages at all sizes
+#       subsample  - random subset of the trip data
+#
+########################################################################
+
+# Import modules required by these functions
+import gc
+import copy
+import json
+import time
+import resource
+import argparse
+import platform
+import threading
+import itertools
+import numpy as np
+import pandas as pd
+import BabsFunctions
+import BabsClasses
+
+########################################################################
+
+# Interval (seconds) at which memory is sampled during a stage
+SAMPLEINTERVAL = 0.002
+
+# Filters applied in the filterdata stage
+FILTERS = [{'Customer Type':['Customer']},
+           {'Region':['San Jose','Palo Alto']},
+           {'Day of Week':['5','6']},
+           {'Hour of Day':[str(val) for val in range(0,6)]},
+           {'Customer Type':['Subscriber'], 'Day of Week':['0'], 'Region':['San Francisco']},
+           {'Precipitation':{'min':'T'}, 'Day of Week':['5','6']},
+           {'Temperature (Max)':{'min':'60','max':'75'}, 'Events':['Rain','Fog-Rain']},
+           {'Station':['2','3','4'], 'Hour of Day':[str(val) for val in range(0,6)]}]
+
+# Divisions used in the option matrix
+DIVISIONS = ['None','Customer Type','Day of Week','Hour of Day','Region']
+
+
+def rss():
+    """
+    Returns the resident memory of this process in bytes. Uses
+    /proc/self/statm where available, otherwise the peak resident
+    memory reported by getrusage.
+    """
+
+    try:
+        with open('/proc/self/statm') as fid:
+            return int(fid.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Define class to measure one stage
+class Measure:
+    """
+    Context manager that measures the wall time of a stage and samples
+    the resident memory in a background thread to find its peak.
+
+    ATTRIBUTES (after the with block)
+       seconds - wall time of the stage
+       peak    - peak resident memory above the memory at the start (bytes)
+    """
+
+    def __init__(self):
+        self.seconds = None
+        self.peak = None
+
+    def __enter__(self):
+        gc.collect()
+        self.start = rss()
+        self.highest = self.start
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample)
+        self.sampler.daemon = True
+        self.sampler.start()
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.time() - self.t0
+        self.running = False
+        self.sampler.join()
+        self.highest = max(self.highest, rss())
+        self.peak = self.highest - self.start
+        return False
+
+    def sample(self):
+        while self.running:
+            self.highest = max(self.highest, rss())
+            time.sleep(SAMPLEINTERVAL)
+
+
+def resetstore(base):
+    """
+    Empties BabsFunctions.STORE and puts back only the base datasets
+    in the dictionary base (name: dataframe), so derived frames are
+    recalculated by the next stage.
+    """
+
+    BabsFunctions.STORE.clear()
+    for name,data in base.items():
+        BabsFunctions.STORE.put( ('base',name), data )
+
+
+def subsample(data, fraction, seed=0):
+    """Returns a random fraction of the rows of data, in their original order."""
+
+    if fraction>=1:
+        return data
+    nrows = int(round(len(data)*fraction))
+    rows = np.sort( np.random.RandomState(seed).choice(len(data), nrows, replace=False) )
+    return data.iloc[rows]
+
+
+def optionmatrix():
+    """
+    Returns a list of (description, PlotOptions) covering the
+    combinations of typeid, barid, binid, and division shown by the GUI.
+    """
+
+    options = []
+    for typeid,barid,division in itertools.product([0,1], [0,1], DIVISIONS):
+        binids = [0] if typeid==0 else [1,2,3,4]
+        for binid in binids:
+            # The GUI does not divide bars by the field they are binned by
+            if (binid,division) in [(2,'Day of Week'),(3,'Hour of Day'),(4,'Region')]:
+                continue
+            NewOptions = BabsClasses.PlotOptions()
+            NewOptions.typeid = typeid
+            NewOptions.barid = barid
+            NewOptions.binid = binid
+            NewOptions.dT = '1D'
+            NewOptions.setdivision(division)
+            params = {'typeid':typeid, 'barid':barid, 'binid':binid,
+                      'division':division, 'dT':NewOptions.dT}
+            options.append( (params, NewOptions) )
+    return options
+
+
+def run(sizes, repeat=1, report=None):
+    """
+    Runs every stage for each fraction of the trip data in sizes and
+    returns a list of result records. Each stage is run repeat times
+    and the fastest run is kept.
+    """
+
+    results = []
+
+    def measure(stage, params, size, function, *args):
+        best = None
+        error = None
+        for counter in range(repeat):
+            try:
+                with Measure() as thismeasure:
+                    function(*args)
+            except Exception as thiserror:
+                error = '%s: %s' % (type(thiserror).__name__, thiserror)
+                break
+            if best is None or thismeasure.seconds<best.seconds:
+                best = thismeasure
+        record = {'stage':stage, 'params':params, 'size':size,
+                  'seconds': None if best is None else best.seconds,
+                  'peakbytes': None if best is None else best.peak,
+                  'error':error}
+        results.append(record)
+        if report is not None:
+            report(record)
+
+    # Loading each dataset from the cache (or csv, the first time)
+    for name in ['station','weather','trip','tripcube']:
+        BabsFunctions.STORE.clear()
+        measure( 'loaddata', {'name':name}, 1.0, BabsFunctions.loaddata, name )
+
+    BabsFunctions.STORE.clear()
+    trip = BabsFunctions.loaddata('trip')
+    weather = BabsFunctions.loaddata('weather')
+
+    for size in sizes:
+        data = subsample(trip, size)
+        measure( 'buildcube', {}, size, BabsFunctions.buildcube, data )
+        base = {'trip':data, 'weather':weather,
+                'tripcube':BabsFunctions.buildcube(data)}
+
+        # Filtering through getdata, without kept filtered frames
+        measure( 'bitmapindex', {}, size, BabsFunctions.bitmapindex, data )
+        index = BabsFunctions.bitmapindex(data)
+        for filters in FILTERS:
+            NewOptions = BabsClasses.PlotOptions()
+            NewOptions.filters = filters
+            resetstore(base)
+            measure( 'filterdata', {'filters':filters}, size,
+                     BabsFunctions.filterdata, data, NewOptions )
+            measure( 'filterbitmap', {'filters':filters}, size,
+                     BabsFunctions.filterdata, data, NewOptions, index )
+            resetstore(base)
+            measure( 'getdata', {'name':'trip','filters':filters}, size,
+                     BabsFunctions.getdata, 'trip', NewOptions )
+
+        # Fraction of rides of each customer type in 20 bins of daily rides
+        bytype = pd.DataFrame( dict( (name, np.asarray(data['Subscription Type']==name, dtype=int))
+                                     for name in BabsFunctions.CUSTOMERTYPES ),
+                               index=data.index ).resample('1D', how='sum').fillna(0)
+        bytype['ones'] = bytype.sum(axis=1)
+        divisions = np.histogram( bytype['ones'], bins=20 )[1]
+        measure( 'typefraction', {'bins':20}, size,
+                 BabsFunctions.typefraction, bytype, divisions )
+
+        # Bars of every option combination
+        for params,NewOptions in optionmatrix():
+            resetstore(base)
+            measure( 'calcbars', params, size, BabsFunctions.calcbars, NewOptions )
+
+        # Bars of the same options updated after unchecking one region
+        #    (see BabsFunctions.hourlybars). The hourly counts of the
+        #    toggled filters are discarded before each run.
+        def toggle(NewOptions, previous):
+            BabsFunctions.STORE.discard( ('hourly',NewOptions.daterange,NewOptions.filterkey()) )
+            return BabsFunctions.calcbars(NewOptions, previous)
+
+        for params,previous in optionmatrix():
+            if not BabsFunctions.hourlysupported(previous):
+                continue
+            NewOptions = copy.copy(previous)
+            NewOptions.filters = {'Region':['San Jose']}
+            resetstore(base)
+            BabsFunctions.calcbars(previous, previous)
+            measure( 'togglebars', params, size, toggle, NewOptions, previous )
+
+        # Every weather variable averaged into the bars of a daily
+        #    timeseries and of histograms by day of week, hour, and region
+        for typeid,binid in [(0,0),(1,2),(1,3),(1,4)]:
+            NewOptions = BabsClasses.PlotOptions()
+            NewOptions.typeid = typeid
+            NewOptions.binid = binid
+            NewOptions.dT = '1D'
+            NewOptions.setdivision('None')
+            resetstore(base)
+            tempdf = BabsFunctions.calcbars(NewOptions)
+            measure( 'weatherbins', {'typeid':typeid, 'binid':binid}, size,
+                     BabsFunctions.weatherbins, NewOptions, tempdf )
+
+    return results
+
+
+def compare(filebefore, fileafter):
+    """
+    Prints the time of each stage in two result files and the ratio
+    after/before. Ratios below 1 mean the stage became faster.
+    """
+
+    def keyof(record):
+        return (record['stage'], json.dumps(record['params'], sort_keys=True), record['size'])
+
+    with open(filebefore) as fid:
+        before = dict( (keyof(record),record) for record in json.load(fid)['results'] )
+    with open(fileafter) as fid:
+        after = json.load(fid)['results']
+
+    print '%-12s %-6s %10s %10s %7s  %s' % ('stage','size','before','after','ratio','params')
+    for record in after:
+        old = before.get(keyof(record))
+        if old is None or old['seconds'] is None or record['seconds'] is None:
+            continue
+        ratio = record['seconds']/max(old['seconds'],1e-9)
+        print '%-12s %-6s %10.4f %10.4f %7.2f  %s' % (record['stage'], record['size'],
+                                                      old['seconds'], record['seconds'],
+                                                      ratio, json.dumps(record['params'], sort_keys=True))
+
+
+def main():
+
+    parser = argparse.ArgumentParser( description='Benchmark the stages of making BABS plots.' )
+    parser.add_argument( '--output', default='benchmark.json', help='file for the results (JSON)' )
+    parser.add_argument( '--sizes', default='0.1,0.5,1.0',
+                         help='comma separated fractions of the trip data to use' )
+    parser.add_argument( '--repeat', type=int, default=3, help='runs of each stage; the fastest is kept' )
+    parser.add_argument( '--compare', nargs=2, metavar=('BEFORE','AFTER'),
+                         help='compare two result files instead of running' )
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+
+    def report(record):
+        if record['error'] is not None:
+            print '%-12s %-5s failed: %s  %s' % (record['stage'], record['size'], record['error'],
+                                                  json.dumps(record['params'], sort_keys=True))
+        else:
+            print '%-12s %-5s %9.4f s %9.1f MB  %s' % (record['stage'], record['size'], record['seconds'],
+                                                     record['peakbytes']/1e6,
+                                                     json.dumps(record['params'], sort_keys=True))
+
+    sizes = [float(val) for val in args.sizes.split(',')]
+    results = run(sizes, args.repeat, report)
+
+    meta = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'sizes': sizes,
+            'repeat': args.repeat}
+    with open(args.output, 'w') as fid:
+        json.dump( {'meta':meta, 'results':results}, fid, indent=1 )
+    print 'Results written to ' + args.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,477 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file contains functions to store BABS data in a versioned,
+#    columnar on-disk cache. Each dataset is saved in its own
+#    directory as one raw binary file per column plus a manifest
+#    (manifest.json) describing the columns, the schema version, and
+#    the csv files the dataset was built from. Unlike pickles, the
+#    files do not depend on the installed version of pandas and any
+#    single column can be read without reading the others.
+#
+#    Datasets indexed by time (trips, the trip cube) can be split into
+#    one cached dataset per month ("trip/2014-02", ...) plus a table of
+#    the months and their first and last times ("trip/partitions").
+#    A query for a time range reads only the months that overlap it.
+#
+#    OUTLINE
+#       sourceinfo  - size, modification time, and hash of a csv file
+#       isvalid     - check a manifest against its csv files
+#       readmanifest- read the manifest of a cached dataset
+#       readcolumn  - read one column of a cached dataset
+#       readcache   - read a cached dataset into a pandas dataframe
+#       readarrays  - read a cached dataset as a dictionary of numpy arrays
+#       writecache  - write a pandas dataframe to the cache
+#       startcache  - start writing a dataset in chunks
+#       appendcache - append a chunk of rows to a dataset being written
+#       finishcache - finish writing a dataset in chunks
+#       writepartitions- write a dataset as one cached dataset per month
+#       readpartitions - read the months of a dataset that overlap a time range
+#
+########################################################################
+
+# Import modules required by these functions
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+########################################################################
+
+# Version of the on-disk layout. Increment this number whenever the
+#    layout or the contents of a cached dataset change so that
+#    old caches are rebuilt from csv.
+CACHEVERSION = 12
+
+# Directory holding the cached datasets of all releases
+CACHEDIR = '../data/cache/'
+
+
+def sourceinfo(filein, hashit=True):
+    """
+    Returns a dictionary with the size, modification time and
+    (optionally) the sha1 hash of the file filein.
+    """
+
+    info = {'path': filein,
+            'size': os.path.getsize(filein),
+            'mtime': os.path.getmtime(filein)}
+
+    # Hash the file in blocks so large files are not held in memory
+    if hashit:
+        sha1 = hashlib.sha1()
+        with open(filein, 'rb') as fid:
+            for block in iter(lambda: fid.read(1 << 20), b''):
+                sha1.update(block)
+        info['sha1'] = sha1.hexdigest()
+
+    return info
+
+
+def isvalid(manifest, sources):
+    """
+    Checks that the cached dataset described by manifest was built
+    with the current schema version from the files in sources.
+
+    A source whose size changed invalidates the cache. A source whose
+    size is unchanged but whose modification time changed is hashed;
+    if the hash still matches, the cache is valid and the new
+    modification time is recorded in the manifest.
+    """
+
+    if manifest is None or manifest.get('version')!=CACHEVERSION:
+        return False
+
+    cached = dict( (info['path'],info) for info in manifest['sources'] )
+    if sorted(cached.keys())!=sorted(sources):
+        return False
+
+    touched = False
+    for filein in sources:
+        if not os.path.exists(filein):
+            return False
+        current = sourceinfo(filein, hashit=False)
+        if current['size']!=cached[filein]['size']:
+            return False
+        if current['mtime']!=cached[filein]['mtime']:
+            if sourceinfo(filein)['sha1']!=cached[filein]['sha1']:
+                return False
+            cached[filein]['mtime'] = current['mtime']
+            touched = True
+
+    # Remember the new modification times so we only hash once
+    if touched:
+        writemanifest(manifest)
+
+    return True
+
+
+def datasetdir(name, cachedir=CACHEDIR):
+    """Returns the directory holding the cached dataset name."""
+    return os.path.join(cachedir, name)
+
+
+def readmanifest(name, cachedir=CACHEDIR):
+    """
+    Returns the manifest of the cached dataset name,
+    or None if the dataset has not been cached.
+    """
+
+    filein = os.path.join(datasetdir(name,cachedir), 'manifest.json')
+    try:
+        with open(filein) as fid:
+            manifest = json.load(fid)
+    except (IOError, ValueError):
+        return None
+    manifest['dir'] = datasetdir(name,cachedir)
+    return manifest
+
+
+def writemanifest(manifest):
+    """Writes manifest to the directory of its dataset."""
+
+    info = dict( (key,value) for key,value in manifest.items() if key!='dir' )
+    fileout = os.path.join(manifest['dir'], 'manifest.json')
+    with open(fileout+'.tmp', 'w') as fid:
+        json.dump(info, fid, indent=1)
+    os.rename(fileout+'.tmp', fileout)
+
+
+def _readarray(manifest, entry, mmap):
+    """Reads the raw values of one column (or the index) from disk."""
+
+    filein = os.path.join(manifest['dir'], entry['file'])
+    if mmap:
+        if manifest['nrows']==0:
+            return np.zeros(0, dtype=entry['dtype'])
+        return np.memmap(filein, dtype=entry['dtype'], mode='r',
+                         shape=(manifest['nrows'],))
+    return np.fromfile(filein, dtype=entry['dtype'])
+
+
+def _toseries(manifest, entry, mmap):
+    """Converts the raw values of a column into pandas values."""
+
+    values = _readarray(manifest, entry, mmap)
+    if entry['kind']=='datetime':
+        values = values.view('M8[ns]')
+    elif entry['kind']=='category':
+        values = pd.Categorical.from_codes(values, entry['categories'])
+    return values
+
+
+def _readindex(manifest, mmap):
+    """Reads the index of a cached dataset."""
+
+    entry = manifest['index']
+    if entry is None:
+        return None
+    values = _toseries(manifest, entry, mmap)
+    if entry['kind']=='datetime':
+        return pd.DatetimeIndex(values, name=entry['name'])
+    return pd.Index(values, name=entry['name'])
+
+
+def readcolumn(name, column, sources, cachedir=CACHEDIR, mmap=False):
+    """
+    Reads a single column from the cached dataset name.
+    Returns a pandas Series with the dataset index,
+    or None if the cache is missing or out of date.
+    """
+
+    manifest = readmanifest(name, cachedir)
+    if not isvalid(manifest, sources):
+        return None
+
+    for entry in manifest['columns']:
+        if entry['name']==column:
+            return pd.Series(_toseries(manifest, entry, mmap),
+                             index=_readindex(manifest, mmap), name=column)
+
+    raise KeyError(column)
+
+
+def readcache(name, sources, columns=None, cachedir=CACHEDIR, mmap=False):
+    """
+    Reads the cached dataset name into a pandas dataframe.
+
+    INPUT
+       name     - name of the dataset {"rebalancing"|"trip"|"weather"|"station"|...}
+       sources  - list of csv files from which the dataset was built.
+                  The cache is ignored if any of them changed.
+       columns  - list of columns to read. Default is all columns.
+       mmap     - if True, memory map the column files instead of reading them.
+
+    Returns None if the cache is missing or out of date.
+    """
+
+    manifest = readmanifest(name, cachedir)
+    if not isvalid(manifest, sources):
+        return None
+
+    entries = manifest['columns']
+    if columns is not None:
+        entries = [entry for entry in entries if entry['name'] in columns]
+
+    if manifest['index'] is None:
+        data = pd.DataFrame( index=np.arange(manifest['nrows']) )
+    else:
+        data = pd.DataFrame( index=_readindex(manifest, mmap) )
+    for entry in entries:
+        data[entry['name']] = _toseries(manifest, entry, mmap)
+
+    return data
+
+
+def readarrays(name, sources, columns=None, cachedir=CACHEDIR, mmap=True):
+    """
+    Reads the cached dataset name as a dictionary of numpy arrays, one
+    per column (categorical columns as their integer codes). Unlike
+    readcache, memory mapped columns stay memory mapped: only the parts
+    of the files that are used are read from disk.
+
+    Returns None if the cache is missing or out of date.
+    """
+
+    manifest = readmanifest(name, cachedir)
+    if not isvalid(manifest, sources):
+        return None
+
+    arrays = {}
+    for entry in manifest['columns']:
+        if columns is None or entry['name'] in columns:
+            values = _readarray(manifest, entry, mmap)
+            if entry['kind']=='datetime':
+                values = values.view('M8[ns]')
+            arrays[entry['name']] = values
+
+    return arrays
+
+
+def _native(value):
+    """Converts a numpy scalar to the equivalent python value for json."""
+    return value.item() if hasattr(value,'item') else value
+
+
+def _describe(values, name, filename):
+    """
+    Describes how to store a pandas column (or index) on disk.
+    Returns the manifest entry and the raw numpy array to write.
+    """
+
+    entry = {'name': name, 'file': filename}
+    if str(values.dtype)=='category' or values.dtype==object:
+        values = pd.Categorical(values)
+        entry['kind'] = 'category'
+        entry['categories'] = [_native(val) for val in values.categories]
+        raw = np.asarray(values.codes).astype(np.promote_types(values.codes.dtype,'int16'))
+    elif str(values.dtype).startswith('datetime64'):
+        entry['kind'] = 'datetime'
+        raw = np.asarray(values, dtype='M8[ns]').view('i8')
+    else:
+        entry['kind'] = 'numeric'
+        raw = np.asarray(values)
+    entry['dtype'] = raw.dtype.str
+    return entry, raw
+
+
+def _encode(values, entry):
+    """
+    Converts another chunk of a column to the raw format described
+    by its manifest entry. Values not yet in the categories of a
+    categorical column are added to them.
+    """
+
+    if entry['kind']=='category':
+        values = pd.Categorical(values)
+        known = set(entry['categories'])
+        entry['categories'] += [_native(val) for val in values.categories
+                                if _native(val) not in known]
+        codes = pd.Index(entry['categories']).get_indexer(np.asarray(values))
+        if len(entry['categories'])>np.iinfo(entry['dtype']).max:
+            raise ValueError('Too many categories in column %s' % entry['name'])
+        return codes.astype(entry['dtype'])
+    if entry['kind']=='datetime':
+        return np.asarray(values, dtype='M8[ns]').view('i8')
+    return np.asarray(values).astype(entry['dtype'])
+
+
+def startcache(name, sources, cachedir=CACHEDIR):
+    """
+    Starts writing dataset name to the cache. Data is added in chunks
+    with appendcache and the dataset becomes readable after finishcache.
+    Returns the manifest of the dataset being written.
+
+    The dataset is written into a temporary directory and moved into
+    place at the end, so an interrupted write never leaves a
+    half-written dataset.
+
+    INPUT
+       name     - name of the dataset
+       sources  - list of csv files from which the data is built
+    """
+
+    outdir = datasetdir(name, cachedir)
+    tmpdir = outdir + '.tmp'
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+
+    manifest = {'version': CACHEVERSION,
+                'sources': [sourceinfo(filein) for filein in sources],
+                'nrows': 0,
+                'index': None,
+                'columns': [],
+                'dir': tmpdir,
+                'target': outdir}
+
+    return manifest
+
+
+def appendcache(manifest, data):
+    """
+    Appends the rows of the pandas dataframe data to the dataset being
+    written (see startcache). The first chunk determines the columns
+    and their types; later chunks are converted to the same types.
+    """
+
+    # Pair each column (and the index, if it has been set) with its entry
+    first = manifest['nrows']==0 and manifest['columns']==[]
+    if first:
+        if data.index.name is not None:
+            manifest['index'], raw = _describe(data.index, data.index.name, 'index.bin')
+        for counter,column in enumerate(data.columns):
+            manifest['columns'].append( _describe(data[column], column,
+                                                  '%03d.bin' % counter)[0] )
+    pairs = [(entry, data[entry['name']]) for entry in manifest['columns']]
+    if manifest['index'] is not None:
+        pairs.append( (manifest['index'], data.index) )
+
+    # Append the raw values of each column to its file
+    for entry,values in pairs:
+        with open(os.path.join(manifest['dir'], entry['file']), 'ab') as fid:
+            _encode(values, entry).tofile(fid)
+    manifest['nrows'] += len(data)
+
+
+def finishcache(manifest):
+    """Writes the manifest and moves the finished dataset into place."""
+
+    outdir = manifest.pop('target')
+    writemanifest(manifest)
+
+    if os.path.exists(outdir):
+        shutil.rmtree(outdir)
+    os.rename(manifest['dir'], outdir)
+    manifest['dir'] = outdir
+
+
+def writecache(name, data, sources, cachedir=CACHEDIR):
+    """
+    Writes the pandas dataframe data to the cache as dataset name.
+    Object (string) columns are stored as categorical codes and
+    datetimes as 64-bit integers.
+
+    INPUT
+       name     - name of the dataset
+       data     - pandas dataframe to store
+       sources  - list of csv files from which data was built
+    """
+
+    manifest = startcache(name, sources, cachedir)
+    appendcache(manifest, data)
+    finishcache(manifest)
+
+
+def writepartitions(name, data, sources, cachedir=CACHEDIR):
+    """
+    Writes the pandas dataframe data, indexed by time, to the cache as
+    one dataset per month (name/YYYY-MM) and a table of the months
+    (name/partitions). Rows are sorted by time. Text and categorical
+    columns get the same categories in every month, so months read
+    together are concatenated without converting them.
+
+    Only the table of months records the csv files in sources; it is
+    written last, so the months are used only once all are written.
+    """
+
+    # Sort rows by time and give every month the same categories
+    order = np.argsort( data.index.values, kind='mergesort' )
+    columns = {}
+    for column in data.columns:
+        values = data[column].values
+        if str(data[column].dtype)=='category' or data[column].dtype==object:
+            values = pd.Categorical( values )
+            values = pd.Categorical.from_codes( np.asarray(values.codes)[order], values.categories )
+        else:
+            values = values[order]
+        columns[column] = values
+    data = pd.DataFrame( columns, index=data.index[order], columns=data.columns )
+
+    # First row of each month
+    months = data.index.values.astype('M8[M]')
+    firsts = np.append( 0, np.flatnonzero(months[1:]!=months[:-1])+1 ) if len(data)>0 else []
+    lasts = np.append( firsts[1:], len(data) ) if len(data)>0 else []
+
+    # An empty dataset with the same columns, returned when no month overlaps a query
+    writecache(name+'/schema', data.iloc[:0], [], cachedir)
+
+    table = {'partition':[], 'start':[], 'stop':[], 'nrows':[]}
+    for first,last in zip(firsts,lasts):
+        month = str(months[first])
+        writecache(name+'/'+month, data.iloc[first:last], [], cachedir)
+        table['partition'].append(month)
+        table['start'].append(data.index[first])
+        table['stop'].append(data.index[last-1])
+        table['nrows'].append(last-first)
+
+    table = pd.DataFrame( table, columns=['partition','start','stop','nrows'] )
+    table['start'] = pd.to_datetime( table['start'] )
+    table['stop'] = pd.to_datetime( table['stop'] )
+    writecache(name+'/partitions', table, sources, cachedir)
+
+
+def readpartitions(name, sources, start=None, stop=None, cachedir=CACHEDIR):
+    """
+    Reads the rows of dataset name (see writepartitions) with
+    start <= time < stop into a pandas dataframe sorted by time.
+    Only the months that overlap the range are read. start and stop
+    are pandas Timestamps, or None for an open range.
+
+    Returns None if the cache is missing or out of date.
+    """
+
+    table = readcache(name+'/partitions', sources, cachedir=cachedir)
+    if table is None:
+        return None
+
+    # Months that overlap the range
+    keep = np.ones( len(table), dtype=bool )
+    if start is not None:
+        keep &= (table['stop']>=start).values
+    if stop is not None:
+        keep &= (table['start']<stop).values
+
+    frames = []
+    for month in table['partition'][keep]:
+        frames.append( readcache(name+'/'+str(month), [], cachedir=cachedir) )
+    if frames==[]:
+        frames.append( readcache(name+'/schema', [], cachedir=cachedir) )
+    if any( frame is None for frame in frames ):
+        return None
+    data = frames[0] if len(frames)==1 else pd.concat(frames)
+
+    # Rows are sorted by time, so the range is found by binary search
+    first = 0 if start is None else data.index.searchsorted(start)
+    last = len(data) if stop is None else data.index.searchsorted(stop)
+    if first>0 or last<len(data):
+        data = data.iloc[first:last]
+
+    return data
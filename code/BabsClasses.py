@@ -13,11 +13,20 @@
 #       PlotOptions - holds information from widgets to determine
 #                     what to show in the plot window.
 #       GridParams  - holds information about the grid layout of the GUI
+#       DataStore   - holds datasets in memory between plot refreshes
+#       Cancelled   - raised when a plot request has been superseded
+#       StageLog    - records the time and size of each stage of a refresh
+#       BitmapIndex - packed bitsets of the rows with each value of a field
 #
 ########################################################################
 
 # Import modules required by these functions
 import pandas as pd
+import numpy as np
+import collections
+import threading
+import json
+import time
 import pdb
 
 ########################################################################
@@ -66,6 +75,9 @@ class GridParams:
         self.divisiongroup_row0 = 7
         self.overgroup_row0 = 12
         self.filtergroup_row0 = 17
+        self.stationgroup_row0 = 4
+        self.weathergroup_row0 = 29
+        self.dategroup_row0 = 40
 
 # Define class to hold parameters that determine what to plot in the main widget.
 class PlotOptions:
@@ -75,7 +87,7 @@ class PlotOptions:
     def __init__(self):
 
         # Integer indicating the type of information to show
-        #   {0 'timeseries'|1 'histogram'}
+        #   {0 'timeseries'|1 'histogram'|2 'availability'}
         self.typeid = 0
 
         # Integer indicating the value to plot
@@ -110,14 +122,91 @@ class PlotOptions:
 
         # Filter options
         #    {date range, time of day, day of week, region, weather, station ID}
+        # Categorical filters list the values to leave out, e.g.
+        #    {'Region':['San Jose']} or {'Station':['2','3']}. Weather range filters give the
+        #    limits to keep, e.g. {'Precipitation':{'min':'T'}}, and the
+        #    time of day filter the window to keep,
+        #    e.g. {'Time of Day':{'min':'07:00','max':'09:30'}}.
         self.filters = {}
 
+        # Station ID number whose bike availability is shown (typeid 2)
+        self.station = None
+
+        # First and last day to show, e.g. ('2014-01-01','2014-03-31').
+        #    None shows every day of every release.
+        self.daterange = None
+
         # Populate plot options with the selections in the GUI window
         #    named MainWindow.
         # This overides the default options selected above
         #self.populate(MainWindow)
 
 
+    # Methods to identify the data needed for these options
+    def filterkey(self):
+        """Returns a hashable description of the filter options."""
+        return tuple( sorted( (name,tuple(sorted(values.items() if isinstance(values,dict)
+                                                  else values)))
+                              for name,values in self.filters.items() ) )
+
+    def datakey(self):
+        """Returns a hashable description of the data shown in the bars."""
+        return (self.typeid, self.barid, self.binid, self.dT,
+                self.division, tuple(self.division_types), self.filterkey(),
+                self.station, self.daterange)
+
+
+    # Method to set the division of the bars and its types
+    def setdivision(self,division):
+        """Divide the bars by division and set the matching division types."""
+
+        self.division = division
+        self.division_types = []
+        if self.division=='Customer Type':
+            self.division_types=['Subscriber','Customer']
+        elif self.division=='Hour of Day':
+            self.division_types = [str(val) for val in range(24)]
+        elif self.division=='Day of Week':
+            self.division_types = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']
+        elif self.division=='Region':
+            self.division_types = ['San Francisco','San Jose','Mountain View','Redwood City','Palo Alto']
+
+
+    # Method to fill options from a dictionary, e.g. read from a file
+    def fromdict(self,config):
+        """Set plot options from the dictionary config, without a GUI.
+
+           Keys are the names of the attributes (typeid, barid, binid, dT,
+           division, overtype, filters, station, daterange). Missing keys keep their
+           default values; division defaults to 'None'. Unknown keys raise
+           a KeyError so typos in a configuration file are not ignored."""
+
+        names = ['typeid','barid','binid','dT','division','overtype','filters','station',
+                 'daterange']
+        for key in config:
+            if key not in names:
+                raise KeyError('Unknown plot option: ' + str(key))
+
+        for key in ['typeid','barid','binid']:
+            setattr( self, key, int(config.get(key,getattr(self,key))) )
+        self.dT = str( config.get('dT',self.dT) )
+        self.setdivision( str(config.get('division','None')) )
+        self.overtype = [str(name) for name in config.get('overtype',[])]
+        self.filters = {}
+        for name,values in config.get('filters',{}).items():
+            if isinstance(values,dict):
+                self.filters[str(name)] = dict( (str(key),str(val)) for key,val in values.items()
+                                                if val is not None )
+            else:
+                self.filters[str(name)] = [str(val) for val in values]
+        if config.get('station') is not None:
+            self.station = int(config['station'])
+        if config.get('daterange') is not None:
+            self.daterange = tuple( None if val is None else str(val)
+                                    for val in config['daterange'] )
+        return self
+
+
     # Method to fill options from currently selected widgets in the gui
     def populate(self,MainWindow):
         """Populate plot options using the selections in the GUI window.
@@ -139,17 +228,13 @@ class PlotOptions:
         unit = str(MainWindow.timeGroup.currentText())[0]
         self.dT = str(number)+unit
 
+        # 3. From drop down list of stations (for availability plots)
+        if MainWindow.stationids!=[]:
+            self.station = MainWindow.stationids[MainWindow.stationGroup.currentIndex()]
+
         # 2. From radio buttons indicating by which variable we should
         #    divide the bars.
-        self.division = str(MainWindow.divisionGroup.checkedButton().objectName())
-        if self.division=='Customer Type':
-            self.division_types=['Subscriber','Customer']
-        elif self.division=='Hour of Day':
-            self.division_types = [str(val) for val in range(24)]
-        elif self.division=='Day of Week':
-            self.division_types = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']
-        elif self.division=='Region':
-            self.division_types = ['San Francisco','San Jose','Mountain View','Redwood City','Palo Alto']
+        self.setdivision( str(MainWindow.divisionGroup.checkedButton().objectName()) )
 
         # 3. From check buttons indicating what to overplot
         self.overtype = []
@@ -159,12 +244,13 @@ class PlotOptions:
 
         # 4. From filter check boxes indicating what to trim from data
         #    Store filter information in dictionary in which the keys are
-        #       'Customer Type', 'Region', 'Day of Week', 'Hour of Day'
+        #       'Customer Type', 'Region', 'Day of Week', 'Hour of Day', 'Events'
         self.filters = {}
         filtergroups = [MainWindow.filterGroup_customer,
                         MainWindow.filterGroup_region,
                         MainWindow.filterGroup_dayofweek,
-                        MainWindow.filterGroup_hourofday]
+                        MainWindow.filterGroup_hourofday,
+                        MainWindow.filterGroup_events]
         for group in filtergroups:
             groupname = str(group.objectName())
             unchecked = []
@@ -177,3 +263,332 @@ class PlotOptions:
             if unchecked!=[]:
                 self.filters[groupname] = unchecked
 
+        # 5. From text entries giving the limits of weather variables
+        #    Store as {'min':value, 'max':value}; empty entries are left out
+        for name,(minText,maxText) in MainWindow.weatherRanges.items():
+            limits = {}
+            if str(minText.text()).strip()!='':
+                limits['min'] = str(minText.text()).strip()
+            if str(maxText.text()).strip()!='':
+                limits['max'] = str(maxText.text()).strip()
+            if limits!={}:
+                self.filters[name] = limits
+
+        # 6. From the date range and time of day entries
+        self.daterange = None
+        if MainWindow.dateCheck.isChecked():
+            self.daterange = ( str(MainWindow.startDate.date().toString('yyyy-MM-dd')),
+                               str(MainWindow.endDate.date().toString('yyyy-MM-dd')) )
+        window = {}
+        if str(MainWindow.timeStart.text()).strip()!='':
+            window['min'] = str(MainWindow.timeStart.text()).strip()
+        if str(MainWindow.timeEnd.text()).strip()!='':
+            window['max'] = str(MainWindow.timeEnd.text()).strip()
+        if window!={}:
+            self.filters['Time of Day'] = window
+
+
+
+
+# Define class to hold datasets in memory between plot refreshes
+class DataStore:
+    """
+    Class to hold datasets and frames derived from them in memory.
+
+    Items are stored under hashable keys, for example ('base','trip')
+    for the trip table or ('filtered','trip',filterkey) for a filtered
+    view. When the items use more than budget bytes, the least recently
+    used items are discarded until the store fits in the budget again.
+    """
+
+    def __init__(self, budget=1024**3):
+
+        # Memory budget in bytes. Default 1 GB.
+        self.budget = budget
+
+        # Stored items, ordered from least to most recently used
+        self.items = collections.OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+        # Lock so the store can be used from the plotting thread
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """Returns the item stored under key, or None if it is not stored."""
+        with self.lock:
+            if key not in self.items:
+                return None
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        """Stores value under key and evicts items to respect the budget."""
+        with self.lock:
+            self.discard(key)
+            self.items[key] = value
+            self.sizes[key] = datasize(value)
+            self.nbytes += self.sizes[key]
+            self.evict()
+
+    def fetch(self, key, function, *args):
+        """
+        Returns the item stored under key. If it is not stored,
+        calls function(*args), stores the result, and returns it.
+        """
+        value = self.get(key)
+        if value is None:
+            value = function(*args)
+            self.put(key, value)
+        return value
+
+    def resize(self, key):
+        """
+        Updates the size of the item stored under key after it grew in
+        place, and evicts items to respect the budget.
+        """
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= self.sizes[key]
+                self.sizes[key] = datasize(self.items[key])
+                self.nbytes += self.sizes[key]
+                self.evict()
+
+    def discard(self, key):
+        """Removes the item stored under key, if any."""
+        with self.lock:
+            if key in self.items:
+                del self.items[key]
+                self.nbytes -= self.sizes.pop(key)
+
+    def evict(self):
+        """Discards least recently used items until the store fits in the budget.
+        The most recently used item is always kept."""
+        with self.lock:
+            while self.nbytes>self.budget and len(self.items)>1:
+                self.discard( next(iter(self.items)) )
+
+    def clear(self):
+        """Removes all items from the store."""
+        with self.lock:
+            self.items.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+
+# Define exception raised when a plot request has been superseded
+class Cancelled(Exception):
+    """Raised to stop calculating a plot that is no longer wanted."""
+    pass
+
+
+# Define class to record how long each stage of a plot refresh takes
+class StageLog:
+    """
+    Class to record the stages of each plot refresh: how long they
+    took, how many rows went in and came out, and how many bytes the
+    result of the stage holds.
+
+    Stages are timed with a with block:
+
+       with PROFILER.stage('filterdata', rowsin=len(data)) as record:
+           result = filterdata(data, NewOptions)
+           record.output(result)
+
+    Each record is tagged with the refresh it belongs to, set with
+    setrefresh in each thread that works on the refresh (the GUI and
+    the plotting thread). Stages inside other stages are recorded with
+    a larger depth. The newest maxrecords records are kept in memory;
+    if logfile is set, each record is also appended to it as one line
+    of JSON.
+    """
+
+    def __init__(self, maxrecords=10000, logfile=None):
+
+        # Most recent records, oldest first
+        self.records = collections.deque(maxlen=maxrecords)
+
+        # File to which each record is appended (JSON lines), or None
+        self.logfile = logfile
+
+        # Refresh number and nesting depth of the current thread
+        self.local = threading.local()
+
+        # Lock so records can be added from the plotting thread
+        self.lock = threading.Lock()
+
+    def setrefresh(self, refresh):
+        """Sets the refresh to which stages timed in this thread belong."""
+        self.local.refresh = refresh
+
+    def stage(self, name, rowsin=None):
+        """Returns a Stage that records stage name when its with block exits."""
+        return Stage(self, name, rowsin)
+
+    def add(self, record):
+        """Stores a finished record and appends it to the log file."""
+        with self.lock:
+            self.records.append(record)
+            if self.logfile is not None:
+                with open(self.logfile, 'a') as fid:
+                    fid.write( json.dumps(record, sort_keys=True) + '\n' )
+
+    def refreshrecords(self, refresh):
+        """Returns the records of one refresh, in the order the stages started."""
+        with self.lock:
+            records = [record for record in self.records if record['refresh']==refresh]
+        return sorted( records, key=lambda record: record['start'] )
+
+    def summary(self, refresh):
+        """Returns a table (string) of the stages of one refresh."""
+
+        lines = ['%-28s %10s %10s %10s %10s' % ('stage','ms','rows in','rows out','MB')]
+        for record in self.refreshrecords(refresh):
+            name = '  '*record['depth'] + record['stage']
+            if record['error'] is not None:
+                name += ' (' + record['error'] + ')'
+            lines.append( '%-28s %10.1f %10s %10s %10s' % ( name, 1000*record['seconds'],
+                          '' if record['rowsin'] is None else record['rowsin'],
+                          '' if record['rowsout'] is None else record['rowsout'],
+                          '' if record['bytes'] is None else '%.2f' % (record['bytes']/1e6) ) )
+        return '\n'.join(lines)
+
+    def export(self, fileout):
+        """Writes all records held in memory to fileout, one line of JSON each."""
+        with self.lock:
+            records = list(self.records)
+        with open(fileout, 'w') as fid:
+            for record in records:
+                fid.write( json.dumps(record, sort_keys=True) + '\n' )
+
+
+# Define class to time one stage of a plot refresh
+class Stage:
+    """
+    Context manager returned by StageLog.stage. Call output(result)
+    inside the with block to record the rows and bytes of the result.
+    A stage that raises an exception is recorded with the name of
+    the exception.
+    """
+
+    def __init__(self, log, name, rowsin=None):
+        self.log = log
+        self.record = {'stage': name,
+                       'refresh': getattr(log.local, 'refresh', None),
+                       'thread': threading.current_thread().name,
+                       'depth': getattr(log.local, 'depth', 0),
+                       'rowsin': rowsin,
+                       'rowsout': None,
+                       'bytes': None,
+                       'error': None}
+
+    def output(self, result, rows=None):
+        """Records the number of rows (default len(result)) and bytes of result."""
+        if rows is None and hasattr(result, '__len__'):
+            rows = len(result)
+        self.record['rowsout'] = rows
+        self.record['bytes'] = datasize(result)
+        return result
+
+    def __enter__(self):
+        self.log.local.depth = self.record['depth'] + 1
+        self.record['start'] = time.time()
+        return self
+
+    def __exit__(self, errortype, error, traceback):
+        self.record['seconds'] = time.time() - self.record['start']
+        self.log.local.depth = self.record['depth']
+        if errortype is not None:
+            self.record['error'] = errortype.__name__
+        self.log.add(self.record)
+        return False
+
+
+# Define class to hold a bitmap index of the rows of a dataset
+class BitmapIndex:
+    """
+    Class to hold a bitmap index of the rows of a dataset. For each
+    value of each indexed field there is a packed bitset (one bit per
+    row, 8 rows per byte) that is set for the rows with that value.
+    A filter is resolved with bitwise operations on the packed bytes,
+    which are 8 times fewer than the rows, and is turned into row
+    positions once at the end.
+
+    Rows with a missing value (code -1) are in none of the bitsets of
+    their field. Fields are added one at a time (see add), so only the
+    fields that are filtered on need to be indexed.
+    """
+
+    def __init__(self, nrows):
+
+        # Number of rows of the dataset and of packed bytes per bitset
+        self.nrows = nrows
+        self.nwords = (nrows+7)//8
+
+        # Bitsets of each field (2-D array, one row per code) and the
+        #    function that converts a value of the field into its code
+        self.bitmaps = {}
+        self.tocode = {}
+        self.nbytes = 0
+
+    def __len__(self):
+        return self.nrows
+
+    def __contains__(self, field):
+        return field in self.bitmaps
+
+    def add(self, field, codes, ncodes, tocode):
+        """
+        Indexes field, given the integer code (0 ... ncodes-1, -1 if
+        missing) of each row and a function that converts a value of
+        the field into its code.
+        """
+        codes = np.asarray(codes)
+        bitmaps = np.empty( (ncodes, self.nwords), dtype=np.uint8 )
+        for code in range(ncodes):
+            bitmaps[code] = np.packbits( codes==code )
+        self.bitmaps[field] = bitmaps
+        self.tocode[field] = tocode
+        self.nbytes += bitmaps.nbytes
+
+    def anyof(self, field, values):
+        """
+        Returns the packed bitset of the rows whose field has any of
+        values (bitwise OR of their bitsets), or None if no row can
+        have them. Values without a bitset (e.g. hour 24, or a station
+        not in the dataset) are ignored.
+        """
+        ncodes = len(self.bitmaps[field])
+        codes = [ code for code in (self.tocode[field](value) for value in values)
+                  if 0<=code<ncodes ]
+        if codes==[]:
+            return None
+        return np.bitwise_or.reduce( self.bitmaps[field][codes], axis=0 )
+
+    def everything(self):
+        """Returns a packed bitset with every row set."""
+        bits = np.empty( self.nwords, dtype=np.uint8 )
+        bits.fill(255)
+        if self.nrows%8:
+            bits[-1] = (255 << (8-self.nrows%8)) & 255
+        return bits
+
+    def positions(self, bits):
+        """Returns the positions of the rows set in the packed bitset bits."""
+        return np.flatnonzero( np.unpackbits(bits)[:self.nrows] )
+
+
+def datasize(value):
+    """Returns the approximate number of bytes used by a stored item."""
+
+    if isinstance(value, pd.DataFrame):
+        return ( sum(datasize(value.iloc[:,ii]) for ii in range(value.shape[1])) +
+                 datasize(value.index) )
+    if isinstance(value, (pd.Series, pd.Index)):
+        return getattr(value.values, 'nbytes', 0)
+    if isinstance(value, (tuple, list)):
+        return sum(datasize(item) for item in value)
+    if isinstance(value, dict):
+        return sum(datasize(item) for item in value.values())
+    return getattr(value, 'nbytes', 0)
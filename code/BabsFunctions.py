@@ -10,11 +10,57 @@
 #    analysis of BABS data.
 #
 #    OUTLINE
+#       addcalendar- add columns of day of week, hour, and date ordinal
+#                       to the ride and weather data.
 #       addregion  - add a column indicating the region of each ride
 #                       to the ride data.
+#       addweather - add the weather of the day and region of each ride
+#       bounds     - lower and upper limit of a weather range filter
+#       availabilitydata- bikes and docks available at the selected
+#                       station, binned to the time step of the plot
+#       bardata    - returns the values to show in the bars of the plot
+#       basekey    - key of a dataset (limited to a date range) in STORE
+#       binhourly  - sum rows of the trip cube into hourly arrays
+#       bitmapindex- bitmap index of the categorical filters of a dataset
+#       buildcube  - aggregate trips into the trip cube
+#       buildpyramid- hourly and daily counts of rides from the trip cube
+#       calcbars   - calculates the values to show in the bars of the plot
+#       codesof    - integer codes of the field used by a filter
+#       cubebars   - calculates the values in the bars from the trip cube
+#       cubefilters- whether the filters can be evaluated on the trip cube
+#       cubesupported- whether the bars can be calculated from the trip cube
+#       datebounds - first and last time of a date range
+#       deltacounts- hourly counts updated by the rides of toggled filter values
+#       dateslice  - rows of a dataset sorted by time within a date range
+#       divisioncodes- position of each ride in the list of division types
 #       filterdata - filter rides from the dataset based on options
 #                       set in the GUI.
-#       getdata    - imports data from .pkl file or csv to pandas dataframe
+#       filterindex- positions of the rides kept by the filters
+#       filterchange- the filter values toggled between two plots
+#       filtermask - boolean mask of the rides kept by the filters
+#       getbitmap  - bitmap index of a dataset, kept in STORE
+#       getdata    - imports data from the cache or csv to pandas dataframe
+#       hourlybars - bars from hourly counts, updated incrementally
+#       hourlycounts- hourly counts of the rides passing the filters
+#       hourlysupported- whether the bars can be summed from hourly counts
+#       hourlytotals- rides along the x-axis summed from hourly counts
+#       ingest     - prepares a dataset read from csv for the cache
+#       loaddata   - reads a dataset from the on-disk cache or csv
+#       overdata   - weather averaged into the bins of the plot
+#       plotdata   - calculates everything needed to draw the plot
+#       pyramidcounts- rides per time step, summed from the trip pyramid
+#       pyramidkept- counts of the trip pyramid passing the filters
+#       pyramidlevel- level of the trip pyramid that answers a time step
+#       rangedata  - a dataset limited to a date range
+#       readall    - reads a dataset from the csv files of every release
+#       readcsv    - reads a dataset from one csv file
+#       regionbars - regions with rides, in alphabetical order
+#       stationavailability- bikes and docks available at one station
+#       stephours  - number of hours in the time step of the plot
+#       stepcounts - rides per time step, summed from pyramid counts
+#       timed      - call a function as one stage of the plot refresh
+#       timewindow - minutes of the day kept by a time of day filter
+#       weatherbins- every weather variable averaged into the bars of the plot
 #       typefraction- calculates the fraction of events that fall into
 #                       a set of bins. For dividing histogram bars
 #                       by categorical variables.
@@ -25,109 +71,1239 @@
 import pandas as pd
 import numpy as np
 import pdb
+import copy
+import BabsCache
+import BabsClasses
+import BabsRebalancing
+import BabsReleases
 
 ########################################################################
 
+# Datasets stored as one cached dataset per month (see BabsCache),
+#    so a date range reads only the months it overlaps
+PARTITIONED = ['trip','tripcube']
+
+# Regions (landmarks) served by BABS, and the zip code of the weather
+#    station in each region
+REGIONS = ['San Francisco','San Jose','Mountain View','Redwood City','Palo Alto']
+ZIPREGIONS = {94107:'San Francisco',94063:'Redwood City',
+              94301:'Palo Alto',94041:'Mountain View',95113:'San Jose'}
+
+# Ordinal (date.toordinal()) of 1 January 1970
+EPOCHORDINAL = 719163
+
+# Column of the weather data shown by each overplot option
+WEATHERCOLUMNS = {'Temperature (Min)':'Min_TemperatureF',
+                  'Temperature (Mean)':'Mean_Temperature_F',
+                  'Temperature (Max)':'Max_Temperature_F',
+                  'Precipitation':'Precipitation_In ',
+                  'Wind Speed (Mean)':'Mean_Wind_Speed_MPH ',
+                  'Wind Speed (Max)':'Max_Gust_Speed_MPH'}
+
+# Precipitation (inches) of a trace of rain ('T' in the weather data)
+PRECIPTRACE = 0.01
+
+# Weather events reported in the Events column of the weather data.
+#    Days without an event are 'None'.
+EVENTS = ['None','Fog','Rain','Fog-Rain','Rain-Thunderstorm','Thunderstorm']
+
+# Customer types in the Subscription Type column
+CUSTOMERTYPES = ['Subscriber','Customer']
+
+# Filters that can be evaluated on the trip pyramid, and on the trip cube
+#    (which also carries the weather of each hour and station)
+#    A time of day filter is kept in both only if it starts and ends on
+#    whole hours (see cubefilters).
+PYRAMIDFILTERS = ['Customer Type','Region','Day of Week','Hour of Day','Time of Day']
+CUBEFILTERS = PYRAMIDFILTERS + ['Station','Events'] + sorted(WEATHERCOLUMNS.keys())
+
+# Column holding the values of each categorical filter
+FILTERCOLUMNS = {'Customer Type':'Subscription Type', 'Region':'region', 'Events':'Events',
+                 'Station':'Start Terminal'}
+
+# Categorical filters resolved with a bitmap index (see bitmapindex)
+BITMAPFILTERS = ['Customer Type','Region','Day of Week','Hour of Day','Station','Events']
+
+# Levels of the trip pyramid and the length of their time bins in hours
+PYRAMIDLEVELS = [('H',1), ('D',24)]
+
+# Datasets and frames derived from them, kept in memory between plot
+#    refreshes. Set STORE.budget to change the memory budget (bytes).
+STORE = BabsClasses.DataStore()
+
+# Time, rows, and bytes of each stage of the plot refreshes. Set
+#    PROFILER.logfile to also append every stage to a log file.
+PROFILER = BabsClasses.StageLog()
+
+########################################################################
+
+
+def addcalendar(data,name):
+    """
+    Add compact calendar columns computed from the DatetimeIndex:
+       dayofweek   - int8, Monday=0 ... Sunday=6
+       hour        - int8, hour of day (trip data only; weather is daily)
+       minuteofday - int16, minutes since midnight (trip data only)
+       dateordinal - int32, proleptic Gregorian ordinal of the date
+    Filtering and grouping code uses these columns instead of
+    decomposing the DatetimeIndex on every plot refresh.
+    """
+
+    data['dayofweek'] = np.asarray( data.index.dayofweek, dtype='int8' )
+    if name=="trip":
+        data['hour'] = np.asarray( data.index.hour, dtype='int8' )
+        data['minuteofday'] = ( data['hour'].values.astype('int16')*60 +
+                                np.asarray(data.index.minute, dtype='int16') )
+
+    # Days since 1 January 1970, shifted to date.toordinal() values
+    days = data.index.values.astype('M8[D]').astype('int64')
+    data['dateordinal'] = ( days + EPOCHORDINAL ).astype('int32')
+
+    # Return data to calling function
+    return data
+
+
+def addweather(data):
+    """
+    Add the weather of the day and region of each row (the columns
+    in WEATHERCOLUMNS as float32, and the categorical Events) to the
+    trip data or trip cube. The weather is joined once, when the data
+    is ingested, so weather of rides can be filtered and grouped like
+    any other column. Rows without weather for their day and region
+    get NaN.
+    """
+
+    weather = loaddata('weather')
+
+    # Key of each row: its day and region (-1 if the region is unknown)
+    def keysof(frame):
+        codes = np.asarray( pd.Categorical(frame['region'],categories=REGIONS).codes,
+                            dtype='int64' )
+        return np.where( codes>=0, frame['dateordinal'].values.astype('int64')*len(REGIONS) + codes, -1 )
+
+    # Join: position of each row's day and region in the weather data.
+    #    Rows without weather get position -1, which picks the
+    #    trailing NaN.
+    weatherkeys = keysof(weather)
+    known = weatherkeys>=0
+    positions = pd.Index( weatherkeys[known] ).get_indexer( keysof(data) )
+    for column in sorted( set(WEATHERCOLUMNS.values()) ):
+        values = np.asarray( weather[column].values[known], dtype='float32' )
+        data[column] = np.append( values, np.float32(np.nan) )[positions]
+    events = pd.Categorical( weather['Events'] )
+    codes = np.append( np.asarray(events.codes)[known], -1 )[positions]
+    data['Events'] = pd.Categorical.from_codes( codes, events.categories )
+
+    # Return data to calling function
+    return data
+
 
 def addregion(data,name):
     """
-    Add column indicating the region to the pandas dataframe
+    Add column indicating the region to the pandas dataframe.
+    The region is looked up in one vectorized join (station ID to
+    landmark for trips, zip code to city for weather) and stored
+    as a categorical column.
     """
 
     # If processing trip information, do the following
     if name=="trip":
 
-        # Get Station ID information from file
-        try:
-            filein = '../data/201402-babs-open-data/station.pkl'
-            stationdata = pd.read_pickle(filein)
-        
-        # If that doesn't work, read the data from csv
-        except:
-        
-            # Get filename to read
-            filein = '../data/201402-babs-open-data/201402_station_data.csv'
-            
-            # Read file using pandas read_csv
-            stationdata = pd.read_csv( filein, na_values="?",
-                                       parse_dates={'date':['installation']} )
-        
-        # Add column of region information to a pandas dataframe
-        data['region'] = ['None']*len(data)
-        stations = stationdata['station_id'].unique()
-        for station in stations:
-            try:
-                data['region'][data['Start Terminal']==station] = stationdata['landmark'][stationdata['station_id']==station].iloc[0]
-            except:
-                print "No stations in the dataset ", station
+        # Get Station ID information from the cache or csv
+        stationdata = loaddata('station')
+
+        # Region code of each station; -1 if the landmark is unknown
+        stationcodes = pd.Categorical( stationdata['landmark'],
+                                       categories=REGIONS ).codes
+        stations = pd.Index( stationdata['station_id'] )
+        keys = data['Start Terminal'].values
 
     # If processing weather information
     if name=="weather":
         data = data.rename( columns={'zip': 'region'} )
-        zipdict = {94107:'San Francisco',94063:'Redwood City',
-                   94301:'Palo Alto',94041:'Mountain View',95113:'San Jose'}
-        for key,value in zipdict.iteritems():
-            data['region'][data['region']==key] = value
+        stations = pd.Index( list(ZIPREGIONS.keys()) )
+        stationcodes = [REGIONS.index(ZIPREGIONS[key]) for key in stations]
+        keys = data['region'].values
 
+    # Join: position of each ride's station (or zip code) in the lookup
+    #    table, then the region code at that position. Unknown keys
+    #    get position -1, which picks the trailing -1 (missing) code.
+    positions = stations.get_indexer( keys )
+    codes = np.append( np.asarray(stationcodes,dtype='int8'), -1 )[positions]
+    data['region'] = pd.Categorical.from_codes( codes, REGIONS )
 
     # Return data to calling function
     return data
     
 
+def plotdata(NewOptions,cancelled=None,previous=None):
+    """
+    Calculates everything needed to draw the plot described by
+    NewOptions: the values in the bars and the lines to overplot.
+    Returns (tempdf, lines); see bardata and overdata.
+
+    cancelled is an optional function that returns True once this
+    request has been superseded by a newer one. It is checked between
+    stages, and BabsClasses.Cancelled is raised if it returns True.
 
-def filterdata(data,NewOptions):
+    previous holds the options of the plot shown before, if any. When
+    only filter checkboxes changed, the bars are updated from it
+    instead of being recalculated (see hourlybars).
     """
-    Filters data from Pandas dataframe (data) based on 
-    filtering options read from widgets in NewOptions.
+
+    def checkpoint():
+        if cancelled is not None and cancelled():
+            raise BabsClasses.Cancelled()
+
+    checkpoint()
+    tempdf = timed( 'bardata', bardata, NewOptions, previous )
+    checkpoint()
+    lines = timed( 'overdata', overdata, NewOptions, tempdf, checkpoint )
+
+    # Return data to calling program
+    return tempdf, lines
+
+
+def overdata(NewOptions,tempdf,checkpoint=None):
     """
+    Returns a list of (name, series) pairs, one for each weather variable
+    in NewOptions.overtype, averaged into the bins of the main plot
+    (tempdf) and shifted to the center of each bin.
+    """
+
+    lines = []
+    if NewOptions.overtype==[] or NewOptions.typeid==2:
+        return lines
+
+    # Every weather variable averaged into the bars of the plot, computed
+    #    once for these options and kept in memory. Checking another
+    #    weather box only picks another column.
+    key = ('weatherbins', NewOptions.typeid, NewOptions.barid, NewOptions.binid,
+           NewOptions.dT, NewOptions.filterkey(), NewOptions.daterange)
+    binned = STORE.fetch( key, timed, 'weatherbins', weatherbins, NewOptions, tempdf )
+    if binned is None or len(binned)==0:
+        return lines
 
-    # Trim Data based on options in the NewOptions.filters list
-    for filtername,filtervals in NewOptions.filters.iteritems():
-
-        # For a categorical filter:
-        #    1. add a column of zeros to the dataframe
-        #    2. place 1 in every row that matches the criteria to filter out
-        #    3. trim dataframe; keep columns with a 0 in them
-        #    4. Remove column of ones from the dataframe
-        #
-        # For a min/max value filter:
-        #    1. trim dataframe based on values.
-        #         ex. data = data[(data.index.hour>=min) & (data.index.hour<=max)]
-
-        # Customer Type: categorical filter
-        if filtername=='Customer Type':
-            data['ones'] = np.zeros(len(data))
-            for ctype in filtervals:
-                data['ones'][data['Subscription Type']==ctype] = 1
-            data = data[data['ones']==0]
-            data.drop('ones',axis=1,inplace=True)
-
-        # Region: categorical filter
-        if filtername=='Region':
-            data['ones'] = np.zeros(len(data))
-            for region in filtervals:
-                data['ones'][data['region']==region] = 1
-            data = data[data['ones']==0]
-            data.drop('ones',axis=1,inplace=True)
-
-        # Day of Week: categorical filter
+    for name in NewOptions.overtype:
+        if checkpoint is not None:
+            checkpoint()
+
+        # Shift the values to the center of each bar
+        thisdata = binned[WEATHERCOLUMNS[name]].copy()
+        if len(thisdata)<2 or NewOptions.binid==4:
+            pass
+        elif NewOptions.typeid==0: 
+            thisdata.index = thisdata.index + (thisdata.index[1]-thisdata.index[0])//2
+        else:
+            thisdata.index = thisdata.index + 0.5*(thisdata.index[1]-thisdata.index[0])
+        lines.append( (name,thisdata) )
+
+    # Return lines to calling program
+    return lines
+
+
+def weatherbins(NewOptions,tempdf):
+    """
+    Returns a pandas dataframe with the mean of every weather variable
+    (the columns in WEATHERCOLUMNS) in each bar of the main plot, indexed
+    like tempdf. Returns None for histograms binned by number of rides.
+
+    Timeseries: the days of weather (of the regions kept by the filters)
+       that fall in each time step, all variables in one pass.
+    Histograms by day of week, hour of day, or region: the weather of
+       the filtered rides in each bar, joined to the rides at ingest
+       (see addweather). Counted from the trip cube, weighted by the
+       number of rides, when the filters allow it.
+    """
+
+    columns = sorted( set(WEATHERCOLUMNS.values()) )
+
+    # Timeseries: position of each day of weather among the time steps
+    if NewOptions.typeid==0:
+        weather = getdata('weather', NewOptions)
+        edges = tempdf.index.values
+        if len(edges)==0:
+            return pd.DataFrame( index=tempdf.index, columns=columns, dtype=float )
+        stop = np.datetime64( tempdf.index[-1] + pd.tseries.frequencies.to_offset(NewOptions.dT) )
+        times = weather.index.values
+        keys = np.searchsorted( edges, times, side='right' ) - 1
+        keep = (keys>=0) & (times<stop)
+        weights = np.ones( len(weather) )
+        frame = weather
+
+    # Histograms by day of week, hour of day, or region
+    elif NewOptions.binid in [2,3,4]:
+        if cubefilters(NewOptions):
+            frame = getdata('tripcube', NewOptions)
+            weights = frame['count'].values.astype(float)
+        else:
+            frame = getdata('trip', NewOptions)
+            weights = np.ones( len(frame) )
+        field = {2:'dayofweek', 3:'hour', 4:'region'}[NewOptions.binid]
+        if field=='region':
+            keys = np.asarray( pd.Categorical(frame['region'],categories=REGIONS).codes )
+            labels = pd.Index( REGIONS )
+        else:
+            keys = np.asarray( frame[field].values, dtype='int64' )
+            labels = pd.Index( range({'dayofweek':7,'hour':24}[field]) )
+        keep = keys>=0
+
+    else:
+        return None
+
+    # Weighted mean of each variable in each bar, ignoring missing values
+    nbins = len(tempdf) if NewOptions.typeid==0 else len(labels)
+    binned = pd.DataFrame( index=tempdf.index if NewOptions.typeid==0 else labels )
+    for column in columns:
+        values = np.asarray( frame[column].values, dtype=float )
+        valid = keep & ~np.isnan(values)
+        total = np.bincount( keys[valid], weights=weights[valid]*values[valid], minlength=nbins )
+        count = np.bincount( keys[valid], weights=weights[valid], minlength=nbins )
+        binned[column] = np.where( count>0, total/np.where(count>0,count,1), np.nan )
+
+    # Timeseries steps without weather repeat the previous step. Histogram
+    #    bars are matched to the bars of the plot.
+    if NewOptions.typeid==0:
+        binned = binned.fillna(method='ffill')
+    else:
+        binned = binned.reindex( tempdf.index )
+
+    # Return dataframe to calling function
+    return binned
+
+
+def bardata(NewOptions,previous=None):
+    """
+    Returns a pandas dataframe with the values to show in the bars
+    of the main plot. Each column is one division of the bars.
+    Results are kept in memory so returning to a previous
+    selection does not recompute them. previous is passed to calcbars.
+    """
+    return STORE.fetch( ('bars',)+NewOptions.datakey(), timed, 'calcbars', calcbars,
+                        NewOptions, previous )
+
+
+def buildcube(data):
+    """
+    Aggregates trips into the trip cube: the number of rides ('count')
+    and the summed ride duration ('Duration') for each hour, start
+    station, and customer type. The cube is indexed by the start of
+    each hour and carries the same region and calendar columns as the
+    trip data, so it can be filtered with filterdata. Each plot that
+    counts rides is a sum over the cube, whose size does not grow with
+    the number of trips.
+    """
+
+    # Group trips by (hour, start station, customer type). Every ride is
+    #    counted, including rides without a duration.
+    hours = data.index.values.astype('M8[h]').astype('M8[ns]')
+    ctype = pd.Categorical( data['Subscription Type'], categories=CUSTOMERTYPES ).codes
+    grouped = data['Duration'].groupby( [hours, data['Start Terminal'].values,
+                                         np.asarray(ctype)] )
+    cube = pd.DataFrame( {'count':grouped.size().astype('int32'),
+                          'Duration':grouped.sum().fillna(0).astype('int64')} )
+    cube.index.names = ['Start Date','Start Terminal','ctype']
+    cube = cube.reset_index().set_index('Start Date')
+
+    # Add the same descriptive columns as the trip data
+    cube['Subscription Type'] = pd.Categorical.from_codes( cube['ctype'].values,
+                                                           CUSTOMERTYPES )
+    cube = cube.drop('ctype',axis=1)
+    cube = addregion(cube,'trip')
+    cube = addcalendar(cube,'trip')
+    cube = addweather(cube)
+
+    # Return cube to calling function
+    return cube
+
+
+def buildpyramid(cube):
+    """
+    Bins the trip cube into dense arrays of the number of rides ('count')
+    and summed ride duration ('Duration') for each time bin, region, and
+    customer type, at each level of PYRAMIDLEVELS (hourly and daily).
+    Arrays have shape (time bins, regions+1, customer types+1); the
+    last region and customer type hold rides with a missing value.
+    The first time bin of every level starts at midnight of the first
+    day of the cube ('start').
+    """
+
+    days = cube['dateordinal'].values.astype('int64')
+    if len(days)==0:
+        firstday = EPOCHORDINAL
+        ndays = 0
+    else:
+        firstday = days.min()
+        ndays = days.max()-firstday+1
+
+    pyramid = {'start': pd.Timestamp('1970-01-01') + pd.Timedelta(days=int(firstday-EPOCHORDINAL))}
+    for column in ['count','Duration']:
+        hourly = binhourly( cube, firstday, ndays, column )
+        pyramid[('H',column)] = hourly
+        pyramid[('D',column)] = hourly.reshape( (ndays,24)+hourly.shape[1:] ).sum(axis=1)
+
+    # Return pyramid to calling function
+    return pyramid
+
+
+def binhourly(cube,firstday,ndays,column='count'):
+    """
+    Sums column of the rows of the trip cube into a dense array of shape
+    (ndays*24 hours, regions+1, customer types+1), as the hourly level of
+    the trip pyramid. The first hour is midnight of day firstday (a
+    date ordinal); the last region and customer type hold rides with
+    a missing value.
+    """
+
+    # Position of each row of the cube in the hourly array. Code -1
+    #    (missing) is sent to the last position.
+    nregion = len(REGIONS)+1
+    ntype = len(CUSTOMERTYPES)+1
+    hours = (cube['dateordinal'].values.astype('int64')-firstday)*24 + cube['hour'].values
+    region = np.asarray( pd.Categorical(cube['region'],categories=REGIONS).codes ) % nregion
+    ctype = np.asarray( pd.Categorical(cube['Subscription Type'],
+                                       categories=CUSTOMERTYPES).codes ) % ntype
+    position = (hours*nregion + region)*ntype + ctype
+
+    hourly = np.bincount( position, weights=cube[column].values,
+                          minlength=ndays*24*nregion*ntype )
+    return hourly.astype('int64').reshape( (ndays*24,nregion,ntype) )
+
+
+def pyramidlevel(NewOptions):
+    """
+    Returns the level of the trip pyramid ('H' or 'D') and the number of
+    its bins in each time step NewOptions.dT, or None if dT is not a
+    whole number of hours or the filters are not kept in the pyramid
+    (weather). The daily level is used when dT is a whole
+    number of days and nothing depends on the hour of day.
+    """
+
+    # The pyramid is not divided by weather or by minutes
+    if any( name not in PYRAMIDFILTERS for name in NewOptions.filters ) or \
+       not cubefilters(NewOptions):
+        return None
+
+    hours = stephours(NewOptions)
+    if hours is None:
+        return None
+
+    byhour = ( 'Hour of Day' in NewOptions.filters or
+               'Time of Day' in NewOptions.filters or
+               NewOptions.division=='Hour of Day' )
+    for level,levelhours in PYRAMIDLEVELS[::-1]:
+        if hours % levelhours==0 and not (byhour and levelhours % 24==0):
+            return level, hours // levelhours
+
+
+def stephours(NewOptions):
+    """
+    Returns the number of hours in the time step NewOptions.dT, or
+    None if it is not a whole number of hours.
+    """
+
+    offset = pd.tseries.frequencies.to_offset(NewOptions.dT)
+    try:
+        seconds = offset.nanos // 10**9
+    except ValueError:
+        return None
+    if seconds<=0 or seconds % 3600!=0:
+        return None
+    return seconds // 3600
+
+
+def pyramidcounts(NewOptions):
+    """
+    Returns the number of rides in each time step NewOptions.dT as a
+    pandas series (total) and, if the bars are divided, a dataframe with
+    one column per division type (bytype; None otherwise). Equivalent to
+    resampling the filtered trip cube, but sums a few thousand pre-binned
+    counts of the trip pyramid. Time steps start at midnight of the
+    first day with rides, as in pandas resample.
+    """
+
+    level, step = pyramidlevel(NewOptions)
+    cube = STORE.fetch( basekey('tripcube',NewOptions.daterange),
+                        loaddata, 'tripcube', NewOptions.daterange )
+    pyramid = STORE.fetch( basekey('trippyramid',NewOptions.daterange), buildpyramid, cube )
+    kept = pyramidkept( NewOptions, pyramid, level )
+
+    # Return rides per time step to calling function
+    return stepcounts( NewOptions, kept, pyramid['start'], level, step )
+
+
+def pyramidkept(NewOptions,pyramid,level):
+    """
+    Returns the counts of level level of the trip pyramid with the
+    time bins, regions, and customer types removed by the filters in
+    NewOptions set to zero. The filters must be in PYRAMIDFILTERS.
+    """
+
+    counts = pyramid[(level,'count')]
+    perday = {'H':24, 'D':1}[level]
+
+    # Calendar fields of each time bin
+    ntime = counts.shape[0]
+    slots = np.arange(ntime)
+    dayofweek = (pyramid['start'].dayofweek + slots//perday) % 7
+    hour = slots % 24
+
+    # Keep the time bins, regions, and customer types passing the filters
+    keeptime = np.ones( ntime, dtype=bool )
+    keepregion = np.ones( counts.shape[1], dtype=bool )
+    keeptype = np.ones( counts.shape[2], dtype=bool )
+    for filtername,filtervals in NewOptions.filters.items():
         if filtername=='Day of Week':
-            data['ones'] = np.zeros(len(data))
-            for value in filtervals:
-                data['ones'][data.index.dayofweek==int(value)] = 1
-            data = data[data['ones']==0]
-            data.drop('ones',axis=1,inplace=True)
-
-        # Hour of Day: categorical filter
-        if filtername=='Hour of Day':
-            data['ones'] = np.zeros(len(data))
-            for value in filtervals:
-                data['ones'][data.index.hour==int(value)] = 1
-            data = data[data['ones']==0]
-            data.drop('ones',axis=1,inplace=True)
+            keeptime &= ~np.in1d( dayofweek, [int(val) for val in filtervals] )
+        elif filtername=='Hour of Day':
+            keeptime &= ~np.in1d( hour, [int(val) for val in filtervals] )
+        elif filtername=='Time of Day':
+            keeptime &= timewindow( filtervals, hour*60 )
+        elif filtername=='Region':
+            keepregion[ [REGIONS.index(val) for val in filtervals if val in REGIONS] ] = False
+        elif filtername=='Customer Type':
+            keeptype[ [CUSTOMERTYPES.index(val) for val in filtervals
+                       if val in CUSTOMERTYPES] ] = False
+    return counts * keeptime[:,None,None] * keepregion[None,:,None] * keeptype[None,None,:]
 
-    # Return data to calling function
-    return data
+
+def stepcounts(NewOptions,kept,start,level,step):
+    """
+    Returns the number of rides in each time step NewOptions.dT (total)
+    and of each division type (bytype, None if the bars are not divided)
+    summed from kept, counts at level level of the trip pyramid
+    (see pyramidkept and hourlycounts) whose first bin starts at start.
+    Each time step is step bins of the level.
+    """
+
+    perday = {'H':24, 'D':1}[level]
+
+    # Calendar fields of each time bin
+    ntime = kept.shape[0]
+    slots = np.arange(ntime)
+    dayofweek = (start.dayofweek + slots//perday) % 7
+    hour = slots % 24
+
+    # Time steps of step bins, counted from midnight of the first day
+    #    with rides. Only the steps from the first to the last ride are kept.
+    perbin = kept.sum(axis=2).sum(axis=1)
+    nonzero = np.flatnonzero(perbin)
+    if len(nonzero)==0:
+        total = pd.Series( [], index=pd.DatetimeIndex([]), dtype=float )
+        steps = np.zeros( 0, dtype='int64' )
+    else:
+        anchor = (nonzero[0]//perday)*perday
+        steps = (slots[anchor:]-anchor)//step
+        keptsteps = slice( (nonzero[0]-anchor)//step, (nonzero[-1]-anchor)//step + 1 )
+        binhours = dict(PYRAMIDLEVELS)[level]
+        first = start + pd.Timedelta( hours=binhours*(anchor+keptsteps.start*step) )
+        index = pd.date_range( first, periods=keptsteps.stop-keptsteps.start,
+                               freq='%dH' % (binhours*step) )
+        total = pd.Series( np.bincount(steps, weights=perbin[anchor:])[keptsteps],
+                           index=index )
+
+    # Rides of each division type in each time step
+    bytype = None
+    types = NewOptions.division_types
+    if NewOptions.division!='None':
+        if NewOptions.division=='Customer Type':
+            bycode = kept.sum(axis=1)
+            codes = [CUSTOMERTYPES.index(val) for val in types]
+        elif NewOptions.division=='Region':
+            bycode = kept.sum(axis=2)
+            codes = [REGIONS.index(val) for val in types]
+        else:
+            field = dayofweek if NewOptions.division=='Day of Week' else hour
+            bycode = np.zeros( (ntime,len(types)) )
+            bycode[slots,field] = perbin
+            codes = range(len(types))
+        bytype = pd.DataFrame( index=total.index )
+        for name,code in zip(types,codes):
+            if len(steps)==0:
+                bytype[name] = []
+            else:
+                bytype[name] = np.bincount( steps, weights=bycode[anchor:,code] )[keptsteps]
+
+    # Return rides per time step to calling function
+    return total, bytype
+
+
+def cubesupported(NewOptions):
+    """
+    Returns True if the bars requested in NewOptions can be calculated
+    from the trip cube: counts of rides, filtered only along
+    dimensions kept in the cube.
+    """
+    return NewOptions.barid==0 and cubefilters(NewOptions)
+
+
+def cubefilters(NewOptions):
+    """
+    Returns True if the filters in NewOptions can be evaluated on the
+    trip cube, whose rows cover whole hours: every filter is in
+    CUBEFILTERS, and a time of day filter starts and ends on whole hours.
+    """
+
+    if any( name not in CUBEFILTERS for name in NewOptions.filters ):
+        return False
+    if 'Time of Day' in NewOptions.filters:
+        minutes = np.arange(24*60)
+        kept = timewindow( NewOptions.filters['Time of Day'], minutes ).reshape( (24,60) )
+        return bool( (kept.all(axis=1) | ~kept.any(axis=1)).all() )
+    return True
+
+
+def cubebars(NewOptions,hourly=None):
+    """
+    Calculates the number of rides to show in the bars of the main plot
+    from the filtered trip cube. Equivalent to the calculation from
+    trips in calcbars, but sums the 'count' column of the cube.
+    If hourly, the hourly counts of the rides passing the filters
+    (see hourlycounts), is given, the bars are summed from it instead.
+    """
+
+    types = NewOptions.division_types
+
+    # Rides along the x-axis from the hourly counts
+    if hourly is not None:
+        total, bytype = hourlytotals(NewOptions, *hourly)
+
+    # Rides per time step come from the trip pyramid when the time step
+    #    is a whole number of its bins
+    elif (NewOptions.typeid==0 or NewOptions.binid==1) and \
+       pyramidlevel(NewOptions) is not None:
+        total, bytype = pyramidcounts(NewOptions)
+
+    else:
+        cube = getdata('tripcube',NewOptions)
+        counts = cube['count']
+
+        # Total number of rides along the x-axis
+        if NewOptions.typeid==0 or NewOptions.binid==1:
+            xkey = pd.Grouper(freq=NewOptions.dT)
+            total = counts.resample( NewOptions.dT, how='sum' ).fillna(0)
+        else:
+            xkey = cube[ {2:'dayofweek', 3:'hour', 4:'region'}[NewOptions.binid] ]
+            total = counts.groupby(xkey).sum().fillna(0)
+            if NewOptions.binid==4:
+                total = regionbars(total)
+
+        # Number of rides of each division type along the x-axis
+        if NewOptions.division!='None':
+            codes = divisioncodes(cube,NewOptions)
+            bytype = counts.groupby( [xkey,codes] ).sum().unstack()
+            bytype = bytype.reindex( index=total.index,
+                                     columns=range(len(types)) ).fillna(0)
+            bytype.columns = types
+
+    # Timeseries: one bar per time step
+    if NewOptions.typeid==0:
+        if NewOptions.division=='None':
+            tempdf = pd.DataFrame( total )
+            tempdf.columns = ['Number of Rides']
+        else:
+            tempdf = bytype
+
+    # Histogram binned by Number of Rides: split each bar by the
+    #    fraction of rides of each type
+    elif NewOptions.binid==1:
+        count, divisions = np.histogram(total, bins=20)
+        tempdf = pd.DataFrame(count, index=divisions[:-1]+(divisions[1]-divisions[0])/2.)
+        tempdf.index.name = 'Number of Rides'
+        tempdf.columns = ['Number of Rides']
+        if NewOptions.division!='None':
+            bytype['ones'] = total
+            thistypefrac = typefraction(bytype,divisions)
+            for name in types:
+                tempdf[name] = tempdf['Number of Rides'] * thistypefrac[name].values
+            tempdf.drop('Number of Rides',axis=1,inplace=True)
+
+    # Histogram binned by day of week, hour of day, or region.
+    #    Leave out division types without any rides.
+    else:
+        if NewOptions.division=='None':
+            tempdf = pd.DataFrame( total )
+            tempdf.columns = ['Number of Rides']
+        else:
+            tempdf = bytype.loc[ :, (bytype!=0).any().values ]
+        tempdf.index.name = 'Number of Rides'
+
+    # Return dataframe to calling program
+    return tempdf
+
+
+def hourlysupported(NewOptions):
+    """
+    Returns True if the bars requested in NewOptions can be summed from
+    hourly counts of rides (see hourlycounts): counts of rides from the
+    trip cube, in a timeseries or histogram whose time step is a whole
+    number of hours.
+    """
+
+    if not cubesupported(NewOptions) or NewOptions.typeid not in [0,1]:
+        return False
+    if NewOptions.typeid==1 and NewOptions.binid in [2,3,4]:
+        return True
+    return ( (NewOptions.typeid==0 or NewOptions.binid==1) and
+             stephours(NewOptions) is not None )
+
+
+def hourlycounts(NewOptions):
+    """
+    Returns (kept, start): the number of rides passing the filters in
+    NewOptions in each hour, region, and customer type, in an array
+    shaped like the hourly level of the trip pyramid, and the start
+    of its first hour. Filters kept in the pyramid are applied to
+    the pyramid; otherwise the filtered trip cube is binned.
+    """
+
+    cube = STORE.fetch( basekey('tripcube',NewOptions.daterange),
+                        loaddata, 'tripcube', NewOptions.daterange )
+    pyramid = STORE.fetch( basekey('trippyramid',NewOptions.daterange), buildpyramid, cube )
+    start = pyramid['start']
+
+    if all( name in PYRAMIDFILTERS for name in NewOptions.filters ):
+        kept = pyramidkept( NewOptions, pyramid, 'H' )
+    else:
+        ndays = pyramid[('H','count')].shape[0] // 24
+        kept = binhourly( getdata('tripcube',NewOptions), start.toordinal(), ndays )
+
+    return kept, start
+
+
+def hourlytotals(NewOptions,kept,start):
+    """
+    Returns the number of rides along the x-axis of the plot (total)
+    and of each division type (bytype, None if the bars are not
+    divided) summed from hourly counts kept whose first hour starts at
+    start (see hourlycounts). Equivalent to summing the filtered trip
+    cube in cubebars.
+    """
+
+    # Timeseries and histograms of the number of rides per time step
+    if NewOptions.typeid==0 or NewOptions.binid==1:
+        return stepcounts( NewOptions, kept, start, 'H', stephours(NewOptions) )
+
+    # Calendar fields of each hour, and position of each region and
+    #    customer type (-1 if missing)
+    slots = np.arange( kept.shape[0] )
+    dayofweek = ( (start.dayofweek + slots//24) % 7 )[:,None,None]
+    hour = ( slots % 24 )[:,None,None]
+    region = np.append( np.arange(len(REGIONS)), -1 )[None,:,None]
+
+    # Bin of each count along the x-axis. Days, hours, and regions
+    #    without rides are left out, as in cubebars.
+    if NewOptions.binid==2:
+        xcode, nx = dayofweek, 7
+    elif NewOptions.binid==3:
+        xcode, nx = hour, 24
+    else:
+        xcode, nx = region, len(REGIONS)
+    xcode = np.zeros( kept.shape, dtype='int64' ) + xcode
+    valid = xcode>=0
+    counts = np.bincount( xcode[valid], weights=kept[valid], minlength=nx )
+    xindex = np.flatnonzero( counts )
+    if NewOptions.binid==4:
+        xindex = sorted( xindex, key=lambda code: REGIONS[code] )
+        total = pd.Series( counts[xindex], index=pd.Index([REGIONS[code] for code in xindex]) )
+    else:
+        total = pd.Series( counts[xindex], index=xindex )
+
+    # Rides of each division type in each bin
+    bytype = None
+    types = NewOptions.division_types
+    if NewOptions.division!='None':
+        if NewOptions.division=='Customer Type':
+            lookup = [types.index(val) if val in types else -1 for val in CUSTOMERTYPES]
+            dcode = np.append( lookup, -1 )[None,None,:]
+        elif NewOptions.division=='Region':
+            lookup = [types.index(val) if val in types else -1 for val in REGIONS]
+            dcode = np.append( lookup, -1 )[None,:,None]
+        else:
+            dcode = dayofweek if NewOptions.division=='Day of Week' else hour
+        dcode = np.zeros( kept.shape, dtype='int64' ) + dcode
+        valid = (xcode>=0) & (dcode>=0)
+        bycode = np.bincount( xcode[valid]*len(types) + dcode[valid], weights=kept[valid],
+                              minlength=nx*len(types) ).reshape( (nx,len(types)) )
+        bytype = pd.DataFrame( bycode[xindex], index=total.index, columns=types )
+
+    return total, bytype
+
+
+def regionbars(total):
+    """
+    Returns the pandas series total, indexed by region, with only the
+    regions that have rides, in alphabetical order (the order of the
+    bars of region histograms).
+    """
+
+    total = total[ total.values!=0 ]
+    labels = np.asarray( total.index, dtype=object )
+    order = np.argsort( labels, kind='mergesort' )
+    return pd.Series( total.values[order], index=pd.Index(labels[order]), name=total.name )
+
+
+def filterchange(previous,NewOptions):
+    """
+    Returns (filtername, unchecked, rechecked) if the filters of
+    NewOptions differ from those of previous (the options of the plot
+    shown before) only in the values of one categorical filter in
+    BITMAPFILTERS: unchecked lists the values newly left out and
+    rechecked the values put back. Returns None otherwise, including
+    when a range filter (weather, time of day) changed its limits.
+    """
+
+    if previous is None or previous.daterange!=NewOptions.daterange:
+        return None
+
+    # Filters are compared as in PlotOptions.filterkey: the items of
+    #    range filters, the sorted values of categorical filters
+    before = dict( previous.filterkey() )
+    after = dict( NewOptions.filterkey() )
+    changed = [ name for name in set(before) | set(after)
+                if before.get(name,())!=after.get(name,()) ]
+    if len(changed)!=1 or changed[0] not in BITMAPFILTERS:
+        return None
+
+    filtername = changed[0]
+    before = set( previous.filters.get(filtername,[]) )
+    after = set( NewOptions.filters.get(filtername,[]) )
+    return filtername, sorted(after-before), sorted(before-after)
+
+
+def deltacounts(NewOptions,hourly,filtername,unchecked,rechecked):
+    """
+    Returns the hourly counts (see hourlycounts) of the rides passing
+    the filters in NewOptions, given the hourly counts of the previous
+    plot and the values of filtername that were unchecked and
+    rechecked since (see filterchange). Only the rows of the trip cube
+    with those values that pass the other filters are binned: their
+    counts are subtracted (unchecked) or added back (rechecked).
+    """
+
+    kept, start = hourly
+    cube = STORE.fetch( basekey('tripcube',NewOptions.daterange),
+                        loaddata, 'tripcube', NewOptions.daterange )
+    index = getbitmap( 'tripcube', NewOptions.daterange, cube,
+                       list(NewOptions.filters)+[filtername] )
+
+    # Options with every filter except the toggled one
+    others = copy.copy(NewOptions)
+    others.filters = dict( (name,values) for name,values in NewOptions.filters.items()
+                           if name!=filtername )
+
+    for values,sign in [(unchecked,-1), (rechecked,1)]:
+        rows = index.anyof( filtername, values )
+        if rows is None:
+            continue
+        rows = filterindex( cube, others, index, within=rows )
+        kept = kept + sign*binhourly( cube.iloc[rows], start.toordinal(), kept.shape[0]//24 )
+
+    return kept, start
+
+
+def hourlybars(NewOptions,previous=None):
+    """
+    Calculates the bars of the main plot from the hourly counts of the
+    rides passing the filters in NewOptions (see hourlysupported).
+    The hourly counts are kept in memory. When they are not yet known
+    and the filters differ from those of previous (the options of the
+    plot shown before) by toggling values of one categorical filter,
+    they are updated from the hourly counts of previous with only the
+    rides of the toggled values (see deltacounts).
+    """
+
+    key = ('hourly',NewOptions.daterange,NewOptions.filterkey())
+    hourly = STORE.get(key)
+    if hourly is None:
+        change = filterchange(previous,NewOptions)
+        if change is not None:
+            hourly = STORE.get( ('hourly',previous.daterange,previous.filterkey()) )
+        if hourly is not None:
+            hourly = timed( 'deltacounts', deltacounts, NewOptions, hourly, *change )
+        else:
+            hourly = timed( 'hourlycounts', hourlycounts, NewOptions )
+        STORE.put(key, hourly)
+
+    return cubebars(NewOptions, hourly)
+
+
+def calcbars(NewOptions,previous=None):
+    """
+    Calculates the values to show in the bars of the main plot
+    from the trip data selected by NewOptions. previous, the options
+    of the plot shown before (if any), lets the bars be updated
+    incrementally when only filter checkboxes changed (see hourlybars).
+    """
+
+    # Availability of a station comes from the rebalancing data
+    if NewOptions.typeid==2:
+        return timed( 'availabilitydata', availabilitydata, NewOptions )
+
+    # Answer from the trip cube whenever the options allow it
+    if previous is not None and hourlysupported(NewOptions):
+        return timed( 'hourlybars', hourlybars, NewOptions, previous )
+    if cubesupported(NewOptions):
+        return timed( 'cubebars', cubebars, NewOptions )
+
+    # Main Type: Timeseries 
+    if NewOptions.typeid==0:
+        
+        # Main Group: Number of Rides
+        if NewOptions.barid==0:
+            basedata = getdata('trip',NewOptions)
+
+            # Create Pandas data frame to hold all information
+            tempdf = pd.DataFrame( basedata['Trip ID'].resample( NewOptions.dT, how='count' ).fillna(0) )
+            tempdf.columns = ['Number of Rides']
+
+            # Calculate values for each sub-division of the data set
+            #    with one group-by over (time bin, division type)
+            if NewOptions.division!='None':
+                types = NewOptions.division_types
+                codes = divisioncodes(basedata,NewOptions)
+                counts = basedata['Trip ID'].groupby( [pd.Grouper(freq=NewOptions.dT),
+                                                       codes] ).count().unstack()
+                counts = counts.reindex( index=tempdf.index,
+                                         columns=range(len(types)) ).fillna(0)
+                for ii in range(len(types)):
+                    tempdf[types[ii]] = counts[ii]
+
+            # Drop original item in the pandas dataframe
+            if NewOptions.division!='None':
+                tempdf.drop('Number of Rides',axis=1,inplace=True)
+
+
+        # Main Group: Duration of rides
+        if NewOptions.barid==1:
+            basedata = getdata('trip',NewOptions)
+            tempdf = basedata[['Duration']]
+            tempdf = tempdf.resample( NewOptions.dT, how=np.median ).fillna(0)
+            tempdf.columns = ['Duration of Ride']
+
+            # Calculate values for each sub-division of the data set
+            if NewOptions.division=='Customer Type':
+                barcolors = []
+                # Add Number of Subscribers to the data frame
+                types = ['Subscriber','Customer']
+                for ii in range(len(types)):
+                    column = basedata[['Duration']]
+                    column.loc[basedata['Subscription Type']==types[ii]] = 1
+                    column = column.resample( NewOptions.dT, how=np.median ).fillna(0)
+                    tempdf[types[ii]] = column[0]
+
+                # Drop total Number from the Data Frame
+                tempdf.drop('Duration of Rides',axis=1,inplace=True)
+
+            #elif NewOptions.division=='Another Division':
+
+                    # do similar things
+
+
+    # Main Type: Histogram
+    elif NewOptions.typeid==1:
+
+        # Number of Rides
+        if NewOptions.barid==0:
+
+            # Get column of number of rides in the basedata
+            basedata = getdata('trip', NewOptions)
+
+            # Group the basedata into divisions indicated by the bin ID
+            if NewOptions.binid==1:
+                nrides = basedata['Trip ID'].resample( NewOptions.dT, how='count' ).fillna(0)
+                count, divisions = np.histogram(nrides, bins=20)  # Put histogram into dataframe
+                tempdf = pd.DataFrame(count, index=divisions[:-1]+(divisions[1]-divisions[0])/2.)
+            if NewOptions.binid==2:
+                tempdf = pd.DataFrame(basedata['Trip ID'].groupby(basedata['dayofweek']).count())
+            if NewOptions.binid==3:
+                tempdf = pd.DataFrame(basedata['Trip ID'].groupby(basedata['hour']).count())
+            if NewOptions.binid==4:
+                tempdf = pd.DataFrame(regionbars(basedata['Trip ID'].groupby(basedata['region']).count()))
+            tempdf.index.name = 'Number of Rides'
+            tempdf.columns = ['Number of Rides']
+
+            # Divide bars for plotting, if indicated
+            if NewOptions.division!='None':
+                types = NewOptions.division_types
+
+                # Number of Rides bins: count the rides of every type in
+                #    each time step, then split each histogram bar by the
+                #    fraction of rides of each type in one pass.
+                if NewOptions.binid==1:
+                    codes = divisioncodes(basedata,NewOptions)
+                    column = basedata['Trip ID'].groupby( [pd.Grouper(freq=NewOptions.dT),
+                                                           codes] ).count().unstack()
+                    column = column.reindex( index=nrides.index,
+                                             columns=range(len(types)) ).fillna(0)
+                    column.columns = types
+                    column['ones'] = nrides
+                    thistypefrac = typefraction(column,divisions)
+                    for name in types:
+                        tempdf[name] = tempdf['Number of Rides'] * thistypefrac[name].values
+
+                # Day of week, hour of day, or region bins: count the
+                #    rides of each type in each bin
+                else:
+                    for ii in range(len(types)):
+                        column = get_column(basedata,ii,NewOptions)
+                        thistypefrac = column.groupby(column.index).count()
+
+                        # Add the value for this type to the dataframe
+                        if not column.empty:
+                            tempdf[types[ii]] = thistypefrac
+
+                # Drop original item in the pandas dataframe
+                if NewOptions.division!='None':
+                    tempdf.drop('Number of Rides',axis=1,inplace=True)
+
+    # Return dataframe to calling program
+    return tempdf
+
+
+def codesof(data,filtername):
+    """
+    Returns the integer codes of the field that filter filtername
+    acts on, the number of possible codes, and a function that converts
+    a value from NewOptions.filters into its code. Returns None if
+    data does not have the field (e.g. customer type in weather data).
+    """
+
+    # Customer Type, Region, Station, and Events: codes of the
+    #    categorical columns. Values are converted to the type of the
+    #    column (e.g. station IDs given as strings).
+    if filtername in FILTERCOLUMNS:
+        column = FILTERCOLUMNS[filtername]
+        if column not in data:
+            return None
+        values = pd.Categorical( data[column] )
+        categories = pd.Index( values.categories )
+        return ( np.asarray(values.codes), len(categories),
+                 lambda value: categories.get_indexer( pd.Index([value]).astype(categories.dtype) )[0] )
+
+    # Day of Week and Hour of Day: calendar fields of each row,
+    #    precomputed when the data was ingested (see addcalendar)
+    if filtername=='Day of Week' and 'dayofweek' in data:
+        return data['dayofweek'].values, 7, int
+    if filtername=='Hour of Day' and 'hour' in data:
+        return data['hour'].values, 24, int
+
+    return None
+
+
+def divisioncodes(data,NewOptions):
+    """
+    Returns an integer array with the position in NewOptions.division_types
+    of the division type of each row of data (-1 if none matches).
+    """
+
+    types = NewOptions.division_types
+    if NewOptions.division=='Customer Type':
+        codes = pd.Categorical( data['Subscription Type'], categories=types ).codes
+    elif NewOptions.division=='Day of Week':
+        codes = data['dayofweek'].values
+    elif NewOptions.division=='Hour of Day':
+        codes = data['hour'].values
+    elif NewOptions.division=='Region':
+        codes = pd.Categorical( data['region'], categories=types ).codes
+    else:
+        codes = np.zeros( len(data) )
+
+    return np.asarray( codes, dtype='int64' )
+
+
+def bounds(filtervals):
+    """
+    Returns the lower and upper limit (floats, None if not set) of a
+    weather range filter {'min':value, 'max':value}. A value of 'T'
+    (trace) is the precipitation of a trace of rain, as in the
+    weather data.
+    """
+
+    def tofloat(value):
+        if value is None or str(value).strip()=='':
+            return None
+        if str(value).strip().upper()=='T':
+            return PRECIPTRACE
+        return float(value)
+
+    return tofloat(filtervals.get('min')), tofloat(filtervals.get('max'))
+
+
+def filtermask(data,NewOptions,skip=()):
+    """
+    Returns a boolean array that is True for each row of data kept by
+    the filtering options in NewOptions. All filters are combined into
+    this one mask, so the data is scanned once per filter group no
+    matter how many values are unchecked. Filters named in skip are
+    left out (they are resolved elsewhere, see filterindex).
+
+    Weather range filters (a name in WEATHERCOLUMNS mapped to
+    {'min':value, 'max':value}) keep the rows whose weather, joined to
+    the rides at ingest, is within the limits (inclusive). Rows
+    without weather are dropped by a range filter. The time of day
+    filter keeps the rides that start within its window (see
+    timewindow). The date range is not a filter here: datasets are
+    limited to it when they are read (see getdata).
+    """
+
+    keep = np.ones( len(data), dtype=bool )
+    for filtername,filtervals in NewOptions.filters.items():
+        if filtername in skip:
+            continue
+
+        # Time of day: minutes since midnight of each ride
+        if filtername=='Time of Day':
+            if 'minuteofday' in data:
+                keep &= timewindow( filtervals, data['minuteofday'].values )
+            continue
+
+        # Weather range filter: compare the weather column with its limits.
+        #    The limits are converted to the type of the column (float32
+        #    in the trip data, see addweather), so a limit equal to a
+        #    stored value (e.g. a trace of rain) keeps that value.
+        if filtername in WEATHERCOLUMNS:
+            column = WEATHERCOLUMNS[filtername]
+            if column not in data:
+                continue
+            values = np.asarray( data[column].values )
+            if values.dtype.kind!='f':
+                values = values.astype(float)
+            lower, upper = bounds(filtervals)
+            with np.errstate(invalid='ignore'):
+                keep &= ~np.isnan(values)
+                if lower is not None:
+                    keep &= values>=values.dtype.type(lower)
+                if upper is not None:
+                    keep &= values<=values.dtype.type(upper)
+            continue
+
+        # Integer code of each row for this filter group
+        codeinfo = codesof(data,filtername)
+        if codeinfo is None:
+            continue
+        codes, ncodes, tocode = codeinfo
+
+        # Lookup table that is True for each code to filter out. The
+        #    extra trailing entry catches missing values (code -1).
+        dropped = np.zeros( ncodes+1, dtype=bool )
+        for value in filtervals:
+            code = tocode(value)
+            if 0<=code<ncodes:
+                dropped[code] = True
+        keep &= ~dropped[codes]
+
+    return keep
+
+
+def timewindow(filtervals,minutes):
+    """
+    Returns a boolean array that is True for the minutes of the day
+    (an array of minutes since midnight) inside the time of day filter
+    {'min':'HH:MM', 'max':'HH:MM'}. The window includes its start and
+    excludes its end; a missing start is midnight and a missing end the
+    end of the day. A window whose end is before its start wraps around
+    midnight (e.g. 22:00 to 02:00).
+    """
+
+    def tominute(value, default):
+        if value is None or str(value).strip()=='':
+            return default
+        parts = str(value).strip().split(':')
+        return int(parts[0])*60 + (int(parts[1]) if len(parts)>1 else 0)
+
+    first = tominute( filtervals.get('min'), 0 )
+    last = tominute( filtervals.get('max'), 24*60 )
+    minutes = np.asarray( minutes )
+    if first<=last:
+        return (minutes>=first) & (minutes<last)
+    return (minutes>=first) | (minutes<last)
+
+
+def bitmapindex(data,filternames=BITMAPFILTERS,index=None):
+    """
+    Returns the bitmap index (BabsClasses.BitmapIndex) of data with
+    the categorical filters among filternames that are in BITMAPFILTERS
+    and that data has. Each field is built in one pass over the codes
+    of each value. If index is given, the fields it does not have yet
+    are added to it.
+    """
+
+    if index is None:
+        index = BabsClasses.BitmapIndex( len(data) )
+    for filtername in filternames:
+        if filtername in BITMAPFILTERS and filtername not in index:
+            codeinfo = codesof(data,filtername)
+            if codeinfo is not None:
+                index.add( filtername, *codeinfo )
+    return index
+
+
+def getbitmap(name,daterange,data,filternames):
+    """
+    Returns the bitmap index of data, dataset name limited to daterange,
+    with the fields of the filters filternames (see bitmapindex). The
+    index is kept in STORE, and each field is built the first time
+    it is filtered on.
+    """
+
+    key = ('bitmap',)+basekey(name,daterange)[1:]
+    index = STORE.fetch( key, BabsClasses.BitmapIndex, len(data) )
+    if any( filtername in BITMAPFILTERS and filtername not in index
+            for filtername in filternames ):
+        timed( 'bitmapindex:'+name, bitmapindex, data, filternames, index )
+        STORE.resize(key)
+    return index
+
+
+def filterindex(data,NewOptions,index=None,within=None):
+    """
+    Returns the positions of the rows of data kept by
+    the filtering options in NewOptions. within, a packed
+    bitset of the bitmap index, limits the rows to those set in it.
+
+    With the bitmap index of data (see bitmapindex), the categorical
+    filters are resolved with bitwise operations on its packed
+    bitsets: the rows with any unchecked value of a filter are
+    OR-ed together, and their complement is AND-ed across filters.
+    The other filters (weather ranges, time of day) are evaluated
+    with filtermask and combined with the same AND.
+    """
+
+    if index is None:
+        return np.flatnonzero( filtermask(data,NewOptions) )
+
+    # Categorical filters: bitwise operations on the packed bitsets
+    keep = index.everything() if within is None else within.copy()
+    for filtername,filtervals in NewOptions.filters.items():
+        if filtername in index:
+            dropped = index.anyof( filtername, filtervals )
+            if dropped is not None:
+                keep &= ~dropped
+
+    # Other filters: scan the columns they act on
+    if any( filtername not in index for filtername in NewOptions.filters ):
+        keep &= np.packbits( filtermask(data,NewOptions,skip=index.bitmaps) )
+
+    return index.positions(keep)
+
+
+def filterdata(data,NewOptions,index=None):
+    """
+    Filters data from Pandas dataframe (data) based on 
+    filtering options read from widgets in NewOptions.
+    Returns data itself if no rows are filtered out;
+    otherwise the kept rows are copied once. The bitmap
+    index of data, if given, resolves the categorical
+    filters (see filterindex).
+    """
+
+    # Combine all filters into one set of rows and take them once
+    with PROFILER.stage('filterdata', rowsin=len(data)) as record:
+        rows = filterindex(data,NewOptions,index)
+        if len(rows)==len(data):
+            return record.output(data)
+        return record.output(data.iloc[rows])
 
 
 def getdata(name,NewOptions):
@@ -138,89 +1314,349 @@ def getdata(name,NewOptions):
     appropriate.
 
     INPUT - 
-       name       - {"rebalancing"|"trip"|"weather"|"station"}
+       name       - {"rebalancing"|"trip"|"weather"|"station"|"tripcube"}
        NewOptions - PlotOptions class object from BabsClasses
                     that contains information on what data to trim.
     """
 
 
     # Make sure that "name" is an exceptable value.
-    if name not in ["rebalancing","trip","station","weather"]:
+    if name not in ["rebalancing","trip","station","weather","tripcube"]:
         print "Name passed to readcsv is not of an acceptable value."
         print "Name = " + name
-        print "Name should be in {'rebalancing'|'trip'|'weather'|'station'}"
+        print "Name should be in {'rebalancing'|'trip'|'weather'|'station'|'tripcube'}"
         print ""
         print "Returning to calling program with None"
         return None
 
 
-    # Try to restore pickle. Otherwise, readcsv
-    try:
-        filein = '../data/201402-babs-open-data/' + name + '.pkl'
-        data = pd.read_pickle(filein)
+    # Get the dataset with region information, limited to the date
+    #    range of the plot. It is read from disk only the first time;
+    #    afterwards it comes from memory.
+    data = STORE.fetch( basekey(name,NewOptions.daterange), timed, 'loaddata:'+name,
+                        rangedata, name, NewOptions.daterange )
 
-    # If that doesn't work, read the data from csv
-    except:
+    # Filter data based on input options. The bitmap index of each
+    #    filter is built the first time the dataset is filtered on
+    #    it; the index and the filtered views are kept in memory too.
+    #    The rebalancing data (memory mapped arrays) is not filtered.
+    if NewOptions.filters!={} and name!="rebalancing":
+        index = getbitmap( name, NewOptions.daterange, data, NewOptions.filters )
+        data = STORE.fetch( ('filtered',name,NewOptions.daterange,NewOptions.filterkey()),
+                            filterdata, data, NewOptions, index )
 
-        # Get filename to read
-        filein = '../data/201402-babs-open-data/201402_' + name + '_data.csv'
-        
-        # Read file using pandas read_csv
-        if name=="rebalancing":
-            data = pd.read_csv( filein, na_values="?",
-                                parse_dates={'datetime':['time']} )
-        elif name=="trip":
-            data = pd.read_csv( filein, na_values="?",
-                                parse_dates=['Start Date','End Date'])
-            data = data.set_index('Start Date')
-        elif name=="station":
-            data = pd.read_csv( filein, na_values="?",
-                                parse_dates={'date':['installation']} )
-        elif name=="weather":
-            data = pd.read_csv( filein, na_values="?",
-                                parse_dates={'date':['Date']} )
-            data = data.set_index('date')
-            data[data['Precipitation_In ']=='T'] = 0.01
-            data['Precipitation_In '] = data['Precipitation_In '].astype(float)
-
-        # Save dataframe as pickle
-        fileout = '../data/201402-babs-open-data/' + name + '.pkl'
-        data.to_pickle(fileout)
+    # Return dataframe to calling program
+    return data
+
+
+def rangedata(name,daterange=None):
+    """
+    Returns dataset name limited to daterange. If the whole dataset is
+    already in memory, its rows in the range are found by binary search
+    on the sorted times and returned as a slice, without reading the
+    disk or scanning the rows. Otherwise, only the range is read
+    (see loaddata).
+    """
+
+    if daterange is not None and name in ["trip","tripcube","weather"]:
+        data = STORE.get( basekey(name) )
+        if data is not None:
+            return dateslice(data,daterange)
+    return loaddata(name,daterange)
+
+
+def dateslice(data,daterange):
+    """
+    Returns the rows of data, sorted by its DatetimeIndex, from the
+    first to the last day of daterange (see datebounds). The rows are
+    found by binary search and returned as a slice of data.
+    """
+
+    start, stop = datebounds(daterange)
+    first = 0 if start is None else data.index.searchsorted(start)
+    last = len(data) if stop is None else data.index.searchsorted(stop)
+    if first==0 and last==len(data):
+        return data
+    return data.iloc[first:last]
+
+
+def basekey(name,daterange=None):
+    """
+    Returns the key in STORE of dataset name limited to daterange
+    (see PlotOptions.daterange). The whole dataset is ('base',name).
+    """
+    if daterange is None:
+        return ('base',name)
+    return ('base',name,tuple(daterange))
+
+
+def datebounds(daterange):
+    """
+    Returns the first time and the time after the last day of
+    daterange = (first day, last day) as pandas Timestamps.
+    Returns (None, None) if daterange is None; either day may be
+    None for a range without a start or end.
+    """
+
+    if daterange is None:
+        return None, None
+    start, end = daterange
+    if start is not None:
+        start = pd.Timestamp(start).normalize()
+    if end is not None:
+        end = pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+    return start, end
+
+
+def csvfile(name):
+    """
+    Returns the csv file holding dataset name in the newest release
+    that has it, or None if no release has it.
+    """
+    files = BabsReleases.releasefiles(name)
+    if files==[]:
+        return None
+    return files[-1]
+
+
+def sourcefiles(name):
+    """
+    Returns the csv files from which dataset name is built: its csv
+    file in every release. Trip data depends on the station data
+    through its regions and on the weather data joined to it.
+    The trip cube is built from the trip data.
+    """
+    if name in ["trip","tripcube"]:
+        return ( BabsReleases.releasefiles('trip') + BabsReleases.releasefiles('station') +
+                 BabsReleases.releasefiles('weather') )
+    return BabsReleases.releasefiles(name)
+
+
+def readall(name):
+    """
+    Reads dataset name from the csv files of every release into one
+    pandas dataframe. Trips, stations, and days of weather found in
+    several releases are kept once, from the newest release, so every
+    station ID refers to its latest name, location, and landmark, and
+    to the date it was first installed. Columns are renamed to the
+    names of the 201402 release (see BabsReleases.columnnames).
+    """
+
+    files = BabsReleases.releasefiles(name)
+    if files==[]:
+        raise IOError('No csv file of the ' + name + ' data in ' + BabsReleases.DATAROOT)
+    frames = [readcsv(name,filein) for filein in files]
+    data = frames[0] if len(frames)==1 else pd.concat(frames)
+
+    # Keep the newest record of each trip, station, or day and zip code
+    if name=="trip":
+        data = BabsReleases.newest( data, [data['Trip ID'].values] )
+    elif name=="station":
+        # A station keeps the date it was first installed
+        installed = data.groupby('station_id')['date'].min()
+        data = BabsReleases.newest( data, [data['station_id'].values] )
+        data = data.reset_index(drop=True)
+        data['date'] = installed.reindex( data['station_id'].values ).values
+    elif name=="weather":
+        data = BabsReleases.newest( data, [data.index.values, data['zip'].values] )
+
+        # Sort days of weather by date, so date ranges are found by binary search
+        data = data.iloc[ np.argsort(data.index.values, kind='mergesort') ]
+
+    # Return dataframe to calling program
+    return data
+
+
+def readcsv(name,filein=None):
+    """
+    Reads dataset name from csv into a pandas dataframe.
+    Sets indices and generates pandas datetime objects where appropriate.
+    filein defaults to the csv file of the newest release.
+    """
+
+    # Get filename to read
+    if filein is None:
+        filein = csvfile(name)
+
+    # Columns of the file, renamed to the names of the 201402 release
+    names = BabsReleases.columnnames( name, filein, pd.read_csv(filein, nrows=0).columns )
+
+    # Read file using pandas read_csv.
+    #    Rebalancing data is streamed in chunks (see BabsRebalancing).
+    if name=="rebalancing":
+        data = BabsRebalancing.convert( pd.read_csv( filein, na_values="?",
+                                                     header=0, names=names ) )
+    elif name=="trip":
+        data = pd.read_csv( filein, na_values="?", header=0, names=names,
+                            parse_dates=['Start Date','End Date'])
+        data = data.set_index('Start Date')
+    elif name=="station":
+        data = pd.read_csv( filein, na_values="?", header=0, names=names,
+                            parse_dates={'date':['installation']} )
+    elif name=="weather":
+        data = pd.read_csv( filein, na_values="?", header=0, names=names,
+                            parse_dates={'date':['Date']} )
+        data = data.set_index('date')
+        data.loc[data['Precipitation_In ']=='T','Precipitation_In '] = PRECIPTRACE
+        data['Precipitation_In '] = data['Precipitation_In '].astype(float)
+
+        # Days without an event are 'None'; spelling varies between releases
+        events = data['Events'].fillna('None').astype(str).str.strip().str.title()
+        data['Events'] = events.where( events!='', 'None' )
+
+    # Return dataframe to calling program
+    return data
+
+
+def ingest(data,name):
+    """
+    Prepares dataset name after reading it from csv.
+    Everything done here is saved in the on-disk cache, so it is
+    computed once per dataset instead of once per plot refresh.
+    """
 
     # Add region indicator to the weather and trip data
     if (name=="trip") | (name=="weather"):
-        data = addregion(data,name)
+        with PROFILER.stage('addregion', rowsin=len(data)) as record:
+            data = record.output( addregion(data,name) )
+
+    # Add calendar fields to the weather and trip data
+    if (name=="trip") | (name=="weather"):
+        with PROFILER.stage('addcalendar', rowsin=len(data)) as record:
+            data = record.output( addcalendar(data,name) )
+
+    # Add the weather of the day and region of each ride
+    if name=="trip":
+        with PROFILER.stage('addweather', rowsin=len(data)) as record:
+            data = record.output( addweather(data) )
+
+    # Return dataframe to calling program
+    return data
+
+
+def loaddata(name,daterange=None):
+    """
+    Reads dataset name from the on-disk cache (see BabsCache).
+    If the cache is missing or the csv files changed since the cache
+    was written, reads the csv files of every release, prepares the
+    data (see ingest), and rebuilds the cache.
+
+    INPUT - 
+       name       - {"rebalancing"|"trip"|"weather"|"station"|"tripcube"}
+       daterange  - (first day, last day) of the rows to read, or None
+                    for all rows. Trips and the trip cube are stored by
+                    month, and only the months in the range are read.
+    """
+
+    # Rebalancing data is streamed into the cache and memory mapped
+    if name=="rebalancing":
+        return BabsRebalancing.loaddata( csvfile(name) )
+
+    start, stop = datebounds(daterange)
+    sources = sourcefiles(name)
+
+    # Trips and the trip cube: read the months that overlap the date
+    #    range. Otherwise, read csv (or, for the trip cube, build it
+    #    from the trip data) and store it by month.
+    if name in PARTITIONED:
+        data = BabsCache.readpartitions(name, sources, start, stop)
+        if data is None:
+            if name=="tripcube":
+                built = buildcube( loaddata('trip') )
+            else:
+                built = ingest( timed('readall:'+name, readall, name), name )
+            BabsCache.writepartitions(name, built, sources)
+            data = BabsCache.readpartitions(name, sources, start, stop)
+        return data
 
-    # Filter data based on input options
-    data = filterdata( data, NewOptions )
+    # Try to restore the cached dataset. Otherwise, read csv
+    data = BabsCache.readcache(name, sources)
+    if data is None:
+        data = ingest( timed('readall:'+name, readall, name), name )
+
+        # Save dataframe to the cache
+        BabsCache.writecache(name, data, sources)
+
+    # Keep the days of weather in the date range
+    if name=="weather" and daterange is not None:
+        data = dateslice(data,daterange)
 
     # Return dataframe to calling program
     return data
 
 
+def availabilitydata(NewOptions):
+    """
+    Returns a pandas dataframe of the min, mean, and max bikes and docks
+    available at station NewOptions.station in each time step dT.
+    Read from the rollup levels of the rebalancing data when possible
+    (see BabsRebalancing.availability).
+    """
+    start, stop = datebounds(NewOptions.daterange)
+    if stop is not None:
+        stop = stop - pd.Timedelta(seconds=1)
+    return BabsRebalancing.availability( csvfile('rebalancing'),
+                                         NewOptions.station, NewOptions.dT, start, stop )
+
+
+def stationavailability(station_id,start=None,end=None):
+    """
+    Returns the bikes and docks available at one station between the
+    times start and end as a dictionary of views of the memory mapped
+    rebalancing data (see BabsRebalancing.stationslice).
+    """
+
+    data = BabsRebalancing.loaddata( csvfile('rebalancing') )
+    index = STORE.fetch( ('base','rebalancingindex'),
+                         BabsRebalancing.loadindex, csvfile('rebalancing') )
+    return BabsRebalancing.stationslice( data, index, station_id, start, end )
+
+
+def timed(name,function,*args):
+    """
+    Calls function(*args) as stage name of the current plot refresh
+    and returns its result. The time, rows, and bytes of the
+    result are recorded in PROFILER.
+    """
+    with PROFILER.stage(name) as record:
+        return record.output( function(*args) )
+
+
 def typefraction(column,divisions):
     """
     Calculates the fraction of events that fall in each
-    bin. Successful events are counted in the column 'zeros'.
-    Total events are denoted by a 1 in the column 'ones'.
-    Divisions contain the edges of each bin.
+    bin. Total events are given in the column 'ones', which is also
+    the value that is binned. Every other column counts the successful
+    events of one type (for example 'zeros', or one column per division
+    type), so all types are handled in a single pass.
+    Divisions contain the edges of each bin. The first bin includes
+    both of its edges; the others include only their right edge.
+
+    Returns a dataframe with one row per bin and one column per type,
+    holding sum(type) / sum('ones') over the events in each bin
+    (0 for bins without events).
 
     This function is used to assist in sub-dividing
     histogram bars by different categorical variables."""
 
-    # Calculate the fraction of events in the "column" dataframe
-    #    as defined by sum('zeros') / sum('ones')
-    thistypefrac = []
-    for dd in range(len(divisions)-1):
-        if dd==0:
-            thisinfo = column[(column['ones']>=divisions[dd]) & 
-                              (column['ones']<=divisions[dd+1])]
-        else:
-            thisinfo = column[(column['ones']>divisions[dd])  & 
-                              (column['ones']<=divisions[dd+1])]
-        if len(thisinfo)==0: thistypefrac.append(0)
-        else:
-            thistypefrac.append( thisinfo['zeros'].sum()/thisinfo['ones'].sum() )
+    # Bin number of each event. digitize with right=True gives
+    #    divisions[i-1] < value <= divisions[i]; values equal to the
+    #    first edge are folded into the first bin.
+    nbins = len(divisions)-1
+    values = np.asarray( column['ones'], dtype=float )
+    binid = np.digitize( values, divisions, right=True ) - 1
+    binid[values==divisions[0]] = 0
+    inrange = (binid>=0) & (binid<nbins)
+    binid = binid[inrange]
+
+    # Sum the total and successful events in each bin
+    total = np.bincount( binid, weights=values[inrange], minlength=nbins )
+    types = [name for name in column.columns if name!='ones']
+    thistypefrac = pd.DataFrame( index=range(nbins), columns=types, dtype=float )
+    for name in types:
+        success = np.bincount( binid, minlength=nbins,
+                               weights=np.asarray(column[name],dtype=float)[inrange] )
+        thistypefrac[name] = np.where( total>0, success/np.where(total>0,total,1), 0. )
 
     # Return fraction of occurances to calling program
     return thistypefrac
@@ -237,72 +1673,23 @@ types[ii] and the division name."""
     if PlotOptions.division=='Customer Type':
         selection = basedata['Subscription Type']==types[ii]
     elif PlotOptions.division=='Day of Week':
-        selection = basedata.index.dayofweek==ii
+        selection = basedata['dayofweek']==ii
     elif PlotOptions.division=='Hour of Day':
-        selection = basedata.index.hour==ii
+        selection = basedata['hour']==ii
     elif PlotOptions.division=='Region':
         selection = basedata['region']==types[ii]
 
     column = basedata[selection]['Trip ID']
 
-    # If grouping data by region, make sure we have region information
-    # by putting region in the column index
+    # If grouping data by day of week, hour of day, or region, make sure
+    # we have that information by putting it in the column index
+    if PlotOptions.binid==2:
+        column.index = basedata[selection]['dayofweek']
+    if PlotOptions.binid==3:
+        column.index = basedata[selection]['hour']
     if PlotOptions.binid==4:
         column.index = basedata[selection]['region']
 
 
     # Return column of data to calling program
     return column
-
-
-def bin_weather( data, tempdf, PlotOptions ):
-    """
-Average selected weather data into bins corresponding to the x-axis of 
-the main plot."""
-
-    # If plotting timeseries
-    if PlotOptions.typeid==0:
-
-        # Resample data to frequency of the main plot
-        
-        newdata = data.resample( PlotOptions.dT, how=np.mean, fill_method='ffill' )
-
-        # Add timeseries offset to newly created data so that it matches
-        # the bar graph being plotted
-        timedelta = tempdf.index[0] - newdata.index[0]
-        newdata.index = newdata.index + timedelta
-
-    # If plotting histogram
-    elif PlotOptions.typeid==1:
-
-        # Plot number of rides
-        if PlotOptions.barid==0:
-
-            # Bin by Number of rides
-            if PlotOptions.binid==1:
-                tempdata = data.resample( PlotOptions.dT, how=np.mean, fill_method='ffill' )
-                divisions = tempdf.index - 0.5*(tempdf.index[1]-tempdf.index[0])
-                divisions.append( divisions[-1]+(tempdf.index[1]-tempdf.index[0]) )
-
-                # Calculate average weather for each bin
-                count, divisions = np.histogram( tempdata, bins=divisions )
-                weather, divisions = np.histogram( tempdata, bins=divisions,
-                                                       weights=tempdata[column] )
-                newdata = pd.DataFrame( weather / count, columns=tempdata.columns,
-                                        index=tempdata.index )
-
-            # Bin by day of week
-            elif PlotOptions.binid==2:
-                newdata = pd.DataFrame( data.groupby(data.index.dayofweek).mean() )
-
-            # Bin by hour of day
-            elif PlotOptions.barid==3:
-                newdata = pd.DataFrame( data.groupby(data.index.hour).mean() )
-            
-            # Bin by region
-            elif PlotOptions.barid==4:
-                newdata = pd.DataFrame( data.groupby(data.region).mean() )
-            
-
-    # Return new dataframe to calling function
-    return newdata
@@ -0,0 +1,510 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file contains the class that draws the BABS bar plot and
+#    its weather overplots on a matplotlib figure. It does not depend
+#    on Qt, so the same drawing code is used by the GUI and any
+#    script that renders figures.
+#
+#    Long series are decimated to about one bar (or one min/max pair
+#    of line points) per pixel of the axes before they are drawn, and
+#    decimated again over the visible range when the plot is zoomed,
+#    so drawing time depends on the size of the plot, not the length
+#    of the series.
+#
+#    OUTLINE
+#       BarPlot    - draws the bars and overplot lines, reusing the
+#                       matplotlib artists between refreshes. Also
+#                       draws the bike availability of a station.
+#       barcolors  - colors of the bars for each division type
+#       barpositions - left edges of the bars along the x-axis
+#       barwidth   - width of the bars
+#       xaxiskey   - options that set what the x-axis shows
+#       labelled   - whether the bins are labels (e.g. regions)
+#       minmaxline - decimate a line, keeping the min and max of each group
+#       peakbars   - decimate bars, keeping the tallest bar of each group
+#       xvalues    - positions of the data along the x-axis
+#
+########################################################################
+
+# Import modules required by these functions
+import matplotlib.cm as cm
+import matplotlib.dates as mdates
+import numpy as np
+import pandas as pd
+
+########################################################################
+
+# Color and legend label of each variable of the availability plot
+AVAILABILITY = [('bikes','#1f77b4','Bikes Available'),
+                ('docks','#ff7f0e','Docks Available')]
+
+# Color of the overplot line of each weather variable
+LINECOLORS = {'Temperature (Min)':'#00bfff',
+              'Temperature (Mean)':'#3cb371',
+              'Temperature (Max)':'#ff0000',
+              'Precipitation':'#888888',
+              'Wind Speed (Mean)':'#da70d6',
+              'Wind Speed (Max)':'#9400d3'}
+
+
+def barcolors(NewOptions):
+    """Returns the colors of the bars for each division type."""
+
+    types = NewOptions.division_types
+    if NewOptions.division=='None':
+        return ['b']
+    elif NewOptions.division=='Customer Type':
+        return cm.rainbow( np.linspace(0,1,len(types)) )
+    elif NewOptions.division=='Day of Week':
+        return cm.rainbow( np.linspace(0,1,len(types)) )
+    elif NewOptions.division=='Hour of Day':
+        return cm.hsv( np.linspace(0,1,len(types)) )
+    elif NewOptions.division=='Region':
+        return cm.jet( np.linspace(0,1,len(types)) )
+    return ['b']
+
+
+def labelled(index):
+    """
+    Returns True if the bins in index are labels (e.g. region names)
+    rather than times or numbers.
+    """
+    return not isinstance(index, pd.DatetimeIndex) and index.dtype.kind not in 'iuf'
+
+
+def barpositions(index):
+    """
+    Returns the left edges of the bars of the bins in index along the
+    x-axis: the bins themselves for times and numbers, and 0, 1, 2, ...
+    for labels, which are shown as tick labels.
+    """
+    if labelled(index):
+        return np.arange( len(index) )
+    return index
+
+
+def barwidth(NewOptions,tempdf):
+    """Returns the width of the bars (in days for timeseries)."""
+
+    if len(tempdf.index)<2:
+        return 1.0
+
+    # Regularly spaced time series
+    if NewOptions.typeid==0:
+        return (tempdf.index[1]-tempdf.index[0]).total_seconds()/86400.
+
+    # Histogram
+    diffs = np.diff( np.asarray(barpositions(tempdf.index), dtype=float) )
+    return 1.0*(min(diffs))
+
+
+def xaxiskey(NewOptions):
+    """
+    Returns the options that set what the x-axis shows. A zoom is kept
+    only while they stay the same.
+    """
+    return (NewOptions.typeid, NewOptions.binid, NewOptions.dT, NewOptions.daterange)
+
+
+def xvalues(index):
+    """
+    Returns the positions of index along the x-axis as floats (matplotlib
+    date numbers for times), or None if index is not numeric.
+    """
+
+    if isinstance(index, pd.DatetimeIndex):
+        return mdates.date2num( index.to_pydatetime() )
+    if index.dtype.kind in 'iuf':
+        return np.asarray( index, dtype=float )
+    return None
+
+
+def peakbars(tempdf,npoints):
+    """
+    Decimates the bars in tempdf to at most npoints bars. Consecutive
+    bars are grouped and each group is drawn as one wide bar with the
+    heights of its tallest stack, so peaks stay visible.
+    """
+
+    nbars = len(tempdf.index)
+    if npoints<1 or nbars<=npoints:
+        return tempdf
+
+    # Position of the tallest stack in each group of size bars
+    size = int( np.ceil(nbars/float(npoints)) )
+    ngroups = int( np.ceil(nbars/float(size)) )
+    totals = np.full( ngroups*size, -np.inf )
+    totals[:nbars] = np.nan_to_num( np.asarray(tempdf.values,dtype=float).sum(axis=1) )
+    peaks = totals.reshape( (ngroups,size) ).argmax(axis=1) + np.arange(ngroups)*size
+
+    # Each group starts at its first bar
+    shown = tempdf.iloc[peaks].copy()
+    shown.index = tempdf.index[::size]
+    return shown
+
+
+def minmaxline(series,npoints):
+    """
+    Decimates the line series to about npoints groups of points, keeping
+    the smallest and largest value of each group in their original order.
+    """
+
+    npts = len(series)
+    if npoints<1 or npts<=2*npoints:
+        return series
+
+    # Positions of the min and max of each group of size points
+    size = int( np.ceil(npts/float(npoints)) )
+    ngroups = int( np.ceil(npts/float(size)) )
+    values = np.asarray( series.values, dtype=float )
+    low = np.full( ngroups*size, np.inf )
+    low[:npts] = np.where( np.isnan(values), np.inf, values )
+    high = np.full( ngroups*size, -np.inf )
+    high[:npts] = np.where( np.isnan(values), -np.inf, values )
+    offsets = np.arange(ngroups)*size
+    rows = np.union1d( low.reshape( (ngroups,size) ).argmin(axis=1) + offsets,
+                       high.reshape( (ngroups,size) ).argmax(axis=1) + offsets )
+
+    return series.iloc[ rows[rows<npts] ]
+
+
+# Define class to draw the bar plot
+class BarPlot:
+    """
+    Draws the bar plot and the weather overplot lines on a matplotlib figure.
+
+    The bar containers and line artists are kept between refreshes. When
+    only the values change (same bins, same columns), the heights and
+    bottoms of the existing bars and the data of the existing lines are
+    updated in place. The bars are rebuilt only when the bin layout
+    changes. The caller draws the canvas once after calling draw().
+
+    The full series are kept, and what is drawn is decimated to the
+    width of the axes in pixels (see peakbars and minmaxline). When the
+    x-axis limits change (e.g. zooming with the navigation toolbar), the
+    visible part of the full series is decimated and drawn again.
+
+    METHODS
+       draw       - show new data on the plot
+       drawavailability - draw the availability of a station
+       drawbars   - update or rebuild the bars
+       drawlines  - update or rebuild the overplot lines
+       detail     - decimate the visible part of a series
+       npixels    - width of the axes in pixels
+       onzoom     - draw more detail when the x-axis limits change
+       reset      - clear the axes and forget the kept artists
+       setlabels  - set plot title and axis labels
+    """
+
+    def __init__(self,figure):
+
+        # Axis for the bars and (created when first needed) for the lines
+        self.figure = figure
+        self.ax = figure.add_subplot(111)
+        self.ax.hold(True)
+        self.ax2 = None
+
+        # Artists kept between refreshes, and the layout they were made for
+        self.bars = []
+        self.barlayout = None
+        self.lines = []
+        self.linelayout = None
+        self.overplotlegend = None
+
+        # Full (not decimated) data of the bars and lines, with their
+        #    positions along the x-axis
+        self.options = None
+        self.fulldata = None
+        self.fullx = None
+        self.fulllines = []
+        self.drawing = False
+        self.ax.callbacks.connect('xlim_changed', self.onzoom)
+
+
+    def draw(self,NewOptions,tempdf,lines):
+        """
+        Show new data on the plot.
+
+        INPUT
+           NewOptions - PlotOptions class object describing the plot
+           tempdf     - pandas dataframe of bar heights, one column per division
+           lines      - list of (name, series) weather lines to overplot
+        """
+
+        # Changing the limits while drawing does not call onzoom
+        self.drawing = True
+        try:
+            # A zoom applies only to the x-axis it was made on. When the
+            #    x-axis changes, the new data is shown whole.
+            if self.options is None or xaxiskey(self.options)!=xaxiskey(NewOptions):
+                self.ax.set_autoscalex_on(True)
+            self.options = NewOptions
+
+            if NewOptions.typeid==2:
+                self.fulldata = None
+                self.drawavailability(NewOptions,tempdf)
+            else:
+                self.fulldata = tempdf
+                self.fullx = xvalues(tempdf.index)
+                self.drawbars(NewOptions, self.detail(tempdf,self.fullx,peakbars))
+            self.drawlines(NewOptions,lines)
+            self.setlabels(NewOptions)
+        finally:
+            self.drawing = False
+
+
+    def npixels(self):
+        """Returns the width of the axes in pixels."""
+        return max( int(self.ax.get_window_extent().width), 1 )
+
+
+    def detail(self,data,x,reduce):
+        """
+        Returns the part of data (series or dataframe) inside the x-axis
+        limits, decimated to the width of the axes with reduce (peakbars
+        or minmaxline). x holds the positions of data along the x-axis;
+        if it is None, data is returned unchanged. The whole series is
+        used until the limits are set by zooming, and when none of it
+        is inside the limits.
+        """
+
+        if x is None:
+            return data
+        first, last = 0, len(x)
+        if not self.ax.get_autoscalex_on():
+            xmin, xmax = self.ax.get_xlim()
+            first = max( np.searchsorted(x,xmin,side='right')-1, 0 )
+            last = min( np.searchsorted(x,xmax,side='left')+1, len(x) )
+            if last<=first:
+                first, last = 0, len(x)
+        return reduce( data.iloc[first:last], self.npixels() )
+
+
+    def onzoom(self,ax):
+        """Draw the visible part of the full series again when zooming."""
+
+        if self.drawing or self.fulldata is None:
+            return
+        self.drawing = True
+        try:
+            self.drawbars( self.options, self.detail(self.fulldata,self.fullx,peakbars),
+                           clear=False )
+            for line,(name,thisdata,x) in zip(self.lines,self.fulllines):
+                shown = self.detail(thisdata,x,minmaxline)
+                line.set_data(shown.index,shown.values)
+        finally:
+            self.drawing = False
+
+
+    def reset(self):
+        """Clear the axes and forget the bars and lines drawn on them."""
+
+        self.ax.cla()
+        self.ax.hold(True)
+        self.ax.callbacks.connect('xlim_changed', self.onzoom)
+        self.bars = []
+        self.barlayout = None
+        if self.ax2 is not None:
+            self.figure.delaxes(self.ax2)
+            self.ax2 = None
+            self.lines = []
+            self.linelayout = None
+            self.overplotlegend = None
+
+
+    def drawavailability(self,NewOptions,tempdf):
+        """
+        Draw the mean bikes and docks available at a station in each
+        time step as lines, shading the range between min and max.
+        """
+
+        self.reset()
+        times = tempdf.index.to_pydatetime()
+        for prefix,color,label in AVAILABILITY:
+            self.ax.fill_between( times,
+                                  np.asarray(tempdf[prefix+'_min'], dtype=float),
+                                  np.asarray(tempdf[prefix+'_max'], dtype=float),
+                                  color=color, alpha=0.3, lw=0 )
+            self.ax.plot( times, np.asarray(tempdf[prefix+'_mean'], dtype=float),
+                          color=color, lw=2, label=label )
+        if len(times)>0:
+            self.ax.set_xlim( times[0], times[-1] )
+        self.plotlegend = self.ax.legend()
+        self.plotlegend.draggable()
+
+
+    def drawbars(self,NewOptions,tempdf,clear=True):
+        """
+        Update the bars in place, or rebuild them if the bins changed.
+        When zooming (clear=False), bars are rebuilt without clearing
+        the axes, so the limits and legend are kept.
+        """
+
+        # Bottom of each stack of bars
+        heights = np.asarray( tempdf.values, dtype=float )
+        bottoms = np.zeros( heights.shape )
+        if heights.shape[1]>1:
+            bottoms[:,1:] = np.cumsum( heights[:,:-1], axis=1 )
+
+        # The bars can be reused if the bins, columns, and colors are the same
+        width = barwidth(NewOptions,tempdf)
+        layout = ( tuple(tempdf.index), tuple(tempdf.columns), width,
+                   NewOptions.typeid, NewOptions.division )
+
+        if layout==self.barlayout:
+            for ii,container in enumerate(self.bars):
+                for rect,height,bottom in zip(container.patches, heights[:,ii], bottoms[:,ii]):
+                    rect.set_height(height)
+                    rect.set_y(bottom)
+            self.ax.relim()
+            self.ax.autoscale_view()
+            return
+
+        # Otherwise clear the axes (the x-axis may change from dates to
+        #    numbers) and create new bars. The lines are rebuilt too.
+        if clear:
+            self.reset()
+        else:
+            for container in self.bars:
+                container.remove()
+
+        colors = barcolors(NewOptions)
+        self.bars = []   # list of handles for each bar in barplot
+        for ii in range(len(tempdf.columns)):
+            thisbar = self.ax.bar( barpositions(tempdf.index), heights[:,ii], width,
+                                   bottom=bottoms[:,ii], color=colors[ii],
+                                   align='edge' )
+            self.bars.append(thisbar)
+
+        # Bins that are labels are named under the middle of their bars
+        if labelled(tempdf.index):
+            self.ax.set_xticks( np.arange(len(tempdf.index)) + 0.5*width )
+            self.ax.set_xticklabels( list(tempdf.index) )
+        self.barlayout = layout
+        self.ax.relim()
+        self.ax.autoscale_view()
+        if not clear:
+            return
+
+        # Make a legend for the figure (there are no bars to show in it
+        #    if there is no data)
+        if len(tempdf.index)==0:
+            return
+        self.plotlegend = self.ax.legend( [bar[0] for bar in self.bars],
+                                          [col for col in tempdf.columns] )
+        self.plotlegend.draggable()
+
+
+    def drawlines(self,NewOptions,lines):
+        """Update the overplot lines in place, or rebuild them if they changed."""
+
+        # Hide the second axis when nothing is overplotted
+        if lines==[]:
+            self.fulllines = []
+            if self.ax2 is not None:
+                self.ax2.set_visible(False)
+            return
+        if self.ax2 is None:
+            self.ax2 = self.ax.twinx()
+            self.ax2.hold(True)
+        self.ax2.set_visible(True)
+
+        # Scale the data of each line. Temperatures use a fixed range;
+        #    other variables are scaled to the range of the first line.
+        scaled = []
+        for name,thisdata in lines:
+            if name[0:11]=='Temperature':
+                baserange = 50.
+                basemin   = 25
+                basemax   = 95
+            else:
+                # If we have already plotted something, scale this plot to a range
+                if scaled!=[]:
+                    thisrange = thisdata.max()-thisdata.min()
+                    thisdata = thisdata-thisdata.min()
+                    thisdata = thisdata*(baserange/thisrange)
+                    thisdata = thisdata + basemin
+                # Otherwise don't scale the information
+                else:
+                    baserange = thisdata.max()-thisdata.min()
+                    basemin = thisdata.min()-0.2*baserange
+                    basemax = thisdata.max()+0.2*baserange
+            scaled.append( (name,thisdata) )
+        self.ax2.set_ylim([basemin,basemax])
+
+        # Keep the full lines and draw them decimated
+        self.fulllines = [ (name,thisdata,xvalues(thisdata.index))
+                           for name,thisdata in scaled ]
+        scaled = [ (name,self.detail(thisdata,x,minmaxline))
+                   for name,thisdata,x in self.fulllines ]
+
+        # Lines over bins that are labels pass through the middle of the bars
+        scaled = [ (name, pd.Series(thisdata.values, index=barpositions(thisdata.index)+0.5)
+                          if labelled(thisdata.index) else thisdata)
+                   for name,thisdata in scaled ]
+
+        # Reuse the lines if the same variables are plotted
+        layout = tuple( name for name,thisdata in scaled )
+        if layout==self.linelayout:
+            for line,(name,thisdata) in zip(self.lines,scaled):
+                line.set_data(thisdata.index,thisdata.values)
+            return
+
+        # Otherwise remove the old lines and create new ones
+        for line in self.lines:
+            line.remove()
+        if self.overplotlegend is not None:
+            self.overplotlegend.remove()
+        self.lines = []
+        for name,thisdata in scaled:
+            thisline, = self.ax2.plot( thisdata.index, thisdata.values,
+                                       color=LINECOLORS[name], lw=4, label=name )
+            self.lines.append(thisline)
+        self.linelayout = layout
+
+        # Create legend for this second axis
+        self.overplotlegend = self.ax2.legend(loc=2)
+
+
+    def setlabels(self,NewOptions):
+        """
+        Sets plot title, axis labels, and tick marks for the current plot.
+        """
+
+        # Set plot title = title0 + ' of ' + title1
+        title0 = ['Timeseries', 'Histogram', 'Availability']
+        title1 = ['Number of Rides', 'Ride Duration [minutes]', 'Ride Distance [km]']
+        title2 = ['Time (other)', 'Number of Rides', 'Day of Week',
+                  'Hour of Day', 'Region']
+        title = (title0[NewOptions.typeid] + ' of ' +
+                 title1[NewOptions.barid] + ' binned by ' +
+                 title2[NewOptions.binid])
+
+        # Set y-axis label
+        if NewOptions.typeid==1:
+            ylabel = 'Number of Occurances'
+        else:
+            ylabel = title1[NewOptions.barid]
+
+        # Set x-axis label
+        if NewOptions.typeid in [0,2]: xlabel='Date'
+        if NewOptions.typeid==1: xlabel=title2[NewOptions.binid]
+
+        # Availability of one station
+        if NewOptions.typeid==2:
+            title = ('Bikes and Docks Available at Station ' +
+                     str(NewOptions.station) + ' every ' + NewOptions.dT)
+            ylabel = 'Number Available'
+
+        # Place all labels on the plot
+        self.ax.set_title(title)
+        self.ax.set_ylabel(ylabel)
+        self.ax.set_xlabel(xlabel)
+        if self.ax2 is not None and NewOptions.overtype!=[]:
+            self.ax2.set_ylabel(NewOptions.overtype[0])
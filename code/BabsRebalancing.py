@@ -0,0 +1,529 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file contains functions to handle the BABS rebalancing data
+#    (bike and dock availability of every station, about 17 million
+#    rows per release). The csv is read in chunks and written straight
+#    into the on-disk cache (see BabsCache), so memory use is bounded
+#    by the chunk size, not the file size. The cached columns are
+#    memory mapped when read.
+#
+#    The cached rows are sorted by (station_id, time), and a small
+#    offset table gives the first and last row of each station, so the
+#    availability of one station over a time window is found with two
+#    binary searches; only the rows in the window are read from disk.
+#
+#    At ingest the availability is also rolled up into a pyramid of
+#    coarser levels (15 minutes, hourly, daily): the count of snapshots
+#    and the min, mean, and max of bikes and docks available per station
+#    and time bin. Plots with a long time step read the coarsest level
+#    that divides the time step instead of the minute-level rows.
+#
+#    OUTLINE
+#       availability - bikes and docks available at one station, binned
+#                       to a time step
+#       buildindex - build the per-station offset table
+#       buildrollups - build the rollup levels from the sorted data
+#       convert    - downcast one chunk of the csv to compact types
+#       countupto  - number of sorted rows up to a station and time
+#       downcast   - cast values to a smaller integer type, checking range
+#       ingest     - stream the csv into the on-disk cache
+#       issorted   - check that the rows are sorted by station and time
+#       levelfor   - coarsest rollup level that divides a time step
+#       loaddata   - memory mapped columns of the rebalancing data, read
+#                       from the cache or csv
+#       loadindex  - read the per-station offset table
+#       printprogress - default progress report of ingest
+#       rawstats   - rollup columns of the minute-level rows
+#       rollup     - roll rows up into coarser time bins
+#       sortbystation - sort the cached rows by station and time, in
+#                       sorted runs of one chunk that are then merged
+#       stationslice  - rows of one station within a time window
+#
+########################################################################
+
+# Import modules required by these functions
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+import BabsCache
+import BabsReleases
+
+########################################################################
+
+# Number of csv rows read at a time
+CHUNKSIZE = 1000000
+
+# Format of the time column in the csv, e.g. 2013/08/29 12:06:01
+TIMEFORMAT = '%Y/%m/%d %H:%M:%S'
+
+# Rollup levels: (cached dataset name, length of a time bin in seconds),
+#    finest first. Each length divides the next.
+LEVELS = [('rebalancing15min', 900),
+          ('rebalancinghourly', 3600),
+          ('rebalancingdaily', 86400)]
+
+# Variables rolled up: (prefix of the rollup columns, csv column)
+VARIABLES = [('bikes','bikes_available'),
+             ('docks','docks_available')]
+
+# Columns of the rollup levels, and of the binned availability
+STATCOLUMNS = [prefix+'_'+stat for prefix,column in VARIABLES
+                               for stat in ['min','mean','max']]
+ROLLUPCOLUMNS = ['station_id','datetime','count'] + STATCOLUMNS
+
+
+def printprogress(nrows, nbytes, totalbytes):
+    """Default progress report of ingest: rows read and percent of the file."""
+
+    percent = 100.*nbytes/max(totalbytes,1)
+    sys.stdout.write('\rReading rebalancing data: %d rows (%.0f%%)' % (nrows, percent))
+    if nbytes>=totalbytes:
+        sys.stdout.write('\n')
+    sys.stdout.flush()
+
+
+def downcast(values, dtype, column, low=None):
+    """
+    Returns the numpy array values cast to the integer type dtype.
+    Raises ValueError if any value is missing, below low (default: the
+    smallest value of dtype), or too large for dtype, instead of
+    letting it wrap around.
+    """
+
+    limits = np.iinfo(dtype)
+    low = limits.min if low is None else low
+    if len(values)>0:
+        if pd.isnull(values).any():
+            raise ValueError('Missing values in column %s' % column)
+        if values.min()<low or values.max()>limits.max:
+            raise ValueError( 'Values of column %s outside %d to %d: %s to %s'
+                              % (column, low, limits.max, values.min(), values.max()) )
+    return values.astype(dtype)
+
+
+def convert(chunk):
+    """
+    Converts one chunk of the rebalancing csv to compact types:
+       station_id      - int16
+       bikes_available - int8 (-1 if missing)
+       docks_available - int8 (-1 if missing)
+       datetime        - datetime64 (stored as int64 nanoseconds)
+    Raises ValueError if a value does not fit its type (see downcast).
+    """
+
+    data = pd.DataFrame( index=np.arange(len(chunk)) )
+    data['station_id'] = downcast( chunk['station_id'].values, 'int16', 'station_id' )
+    for column in ['bikes_available','docks_available']:
+        # Counts are never negative; -1 is kept for missing values
+        missing = chunk[column].isnull().values
+        counts = downcast( np.where(missing, 0, chunk[column].values), 'int8', column, low=0 )
+        counts[missing] = -1
+        data[column] = counts
+
+    # Parse times with the known format; fall back to guessing it
+    try:
+        times = pd.to_datetime( chunk['time'], format=TIMEFORMAT )
+    except ValueError:
+        times = pd.to_datetime( chunk['time'] )
+    data['datetime'] = times.values
+
+    return data
+
+
+def ingest(filein, sources, progress=printprogress, chunksize=CHUNKSIZE):
+    """
+    Streams the rebalancing csv into the on-disk cache, one chunk of
+    chunksize rows at a time. Peak memory is bounded by the chunk size.
+
+    INPUT
+       filein    - rebalancing csv file
+       sources   - csv files to record in the cache manifest
+       progress  - function called after each chunk with (rows read,
+                   bytes read, file size). None for no report.
+       chunksize - number of rows read at a time
+    """
+
+    manifest = BabsCache.startcache('rebalancing', sources)
+    totalbytes = os.path.getsize(filein)
+    names = BabsReleases.columnnames( 'rebalancing', filein, pd.read_csv(filein, nrows=0).columns )
+    with open(filein, 'rb') as fid:
+        for chunk in pd.read_csv( fid, na_values="?", header=0, names=names,
+                                  chunksize=chunksize ):
+            BabsCache.appendcache( manifest, convert(chunk) )
+            if progress is not None:
+                progress( manifest['nrows'], fid.tell(), totalbytes )
+    BabsCache.finishcache(manifest)
+
+    # Sort rows by station and time and build the offset table
+    sortbystation(sources, chunksize)
+    buildindex(sources)
+    buildrollups(sources, chunksize)
+
+
+def issorted(station, times, chunksize=CHUNKSIZE):
+    """
+    Returns True if the rows are sorted by station, then time.
+    Checked in chunks so the temporary arrays stay small.
+    """
+
+    for start in range(0, max(len(station)-1,0), chunksize):
+        stop = min(start+chunksize+1, len(station))
+        dstation = np.diff( station[start:stop].astype('int32') )
+        dtimes = np.diff( times[start:stop] )
+        if not ( (dstation>0) | ((dstation==0) & (dtimes>=0)) ).all():
+            return False
+    return True
+
+
+def countupto(station, times, first, last, key):
+    """
+    Returns the number of the rows first:last, sorted by station and
+    time, that come before or at key = (station_id, time).
+    """
+
+    lo = first + np.searchsorted( station[first:last], key[0], side='left' )
+    hi = first + np.searchsorted( station[first:last], key[0], side='right' )
+    return lo - first + np.searchsorted( times[lo:hi], key[1], side='right' )
+
+
+def sortbystation(sources, chunksize=CHUNKSIZE):
+    """
+    Sorts the cached rebalancing data by (station_id, datetime).
+    The data is left untouched if it is already sorted (as the BABS
+    csv usually is). Otherwise each chunk of chunksize rows is sorted
+    into a run of its own (cached as 'rebalancingruns'), and the runs
+    are merged, a block of each run at a time, so memory use is bounded
+    by the chunk size, not the number of rows.
+    """
+
+    data = BabsCache.readarrays('rebalancing', sources)
+    station = data['station_id']
+    times = data['datetime'].view('i8')
+    if issorted(station, times, chunksize):
+        return
+
+    # Sorted runs of chunksize rows
+    columns = [entry['name'] for entry in
+               BabsCache.readmanifest('rebalancing')['columns']]
+    nrows = len(station)
+    runs = [ (start, min(start+chunksize, nrows)) for start in range(0, nrows, chunksize) ]
+    manifest = BabsCache.startcache('rebalancingruns', sources)
+    for first,last in runs:
+        order = np.lexsort( (times[first:last], station[first:last]) )
+        chunk = pd.DataFrame( dict( (column, data[column][first:last][order])
+                                    for column in columns ),
+                              columns=columns )
+        BabsCache.appendcache(manifest, chunk)
+    BabsCache.finishcache(manifest)
+
+    # Merge the runs. Every row up to the smallest last key of the
+    #    blocks read from the runs not yet read to the end can be
+    #    written: no later row of any run comes before it.
+    rundata = BabsCache.readarrays('rebalancingruns', sources)
+    runstation = rundata['station_id']
+    runtimes = rundata['datetime'].view('i8')
+    block = max( chunksize//len(runs), 1 )
+    positions = [first for first,last in runs]
+    manifest = BabsCache.startcache('rebalancing', sources)
+    while any( position<last for position,(first,last) in zip(positions,runs) ):
+        ends = [ min(position+block, last) for position,(first,last) in zip(positions,runs) ]
+        keys = [ (runstation[end-1], runtimes[end-1]) for end,(first,last) in zip(ends,runs)
+                 if end<last ]
+        pieces = []
+        for ii,(first,last) in enumerate(runs):
+            stop = ends[ii]
+            if keys!=[]:
+                stop = positions[ii] + countupto( runstation, runtimes, positions[ii],
+                                                  ends[ii], min(keys) )
+            pieces.append( np.arange(positions[ii], stop) )
+            positions[ii] = stop
+        rows = np.concatenate(pieces)
+        rows = rows[ np.lexsort( (runtimes[rows], runstation[rows]) ) ]
+        chunk = pd.DataFrame( dict( (column, rundata[column][rows]) for column in columns ),
+                              columns=columns )
+        BabsCache.appendcache(manifest, chunk)
+    BabsCache.finishcache(manifest)
+    shutil.rmtree( BabsCache.datasetdir('rebalancingruns') )
+
+
+def buildindex(sources):
+    """
+    Builds the per-station offset table of the sorted rebalancing data:
+    one row per station with the position of its first row (start)
+    and one past its last row (stop). Saved in the cache as
+    'rebalancingindex'.
+    """
+
+    station = BabsCache.readarrays('rebalancing', sources, columns=['station_id'])['station_id']
+    if len(station)==0:
+        starts = np.zeros(0, dtype='int64')
+    else:
+        starts = np.append( 0, np.flatnonzero(station[1:]!=station[:-1]) + 1 )
+    stops = np.append( starts[1:], len(station) ).astype('int64')
+    index = pd.DataFrame( {'station_id': np.asarray(station)[starts],
+                           'start': starts.astype('int64'),
+                           'stop': stops},
+                          columns=['station_id','start','stop'] )
+    BabsCache.writecache('rebalancingindex', index, sources)
+
+
+def loadindex(filein):
+    """
+    Returns the per-station offset table of the rebalancing data,
+    indexed by station_id. Ingests the csv first if needed.
+    """
+
+    sources = [filein]
+    index = BabsCache.readcache('rebalancingindex', sources)
+    if index is None:
+        loaddata(filein)
+        index = BabsCache.readcache('rebalancingindex', sources)
+        if index is None:
+            buildindex(sources)
+            index = BabsCache.readcache('rebalancingindex', sources)
+
+    return index.set_index('station_id')
+
+
+def timewindow(times, first, last, start=None, end=None):
+    """
+    Narrows the rows first:last, sorted by time, to the times between
+    start and end (inclusive; None for no limit) by binary search.
+    Returns the new (first, last).
+    """
+
+    window = times[first:last]
+    stop = first + len(window)
+    if end is not None:
+        stop = first + np.searchsorted( window, np.datetime64(pd.Timestamp(end)), side='right' )
+    if start is not None:
+        first = first + np.searchsorted( window, np.datetime64(pd.Timestamp(start)), side='left' )
+    return first, stop
+
+
+def stationslice(data, index, station_id, start=None, end=None):
+    """
+    Returns the bikes and docks available at one station between the
+    times start and end (inclusive; None for no limit), as a dictionary
+    of numpy arrays ('datetime', 'bikes_available', 'docks_available').
+    The rows of the station are looked up in the offset table and the
+    time window is found by binary search in the memory mapped times.
+    The arrays are views of the mapped files, not copies, so only the
+    rows in the window are read from disk, and only when used.
+
+    INPUT
+       data       - memory mapped columns from loaddata
+       index      - offset table from loadindex
+       station_id - station ID number
+       start, end - anything pandas can convert to a Timestamp, or None
+    """
+
+    if station_id in index.index:
+        first = index.loc[station_id,'start']
+        last = index.loc[station_id,'stop']
+    else:
+        first = last = 0
+    first, last = timewindow( data['datetime'], first, last, start, end )
+
+    return dict( (column, data[column][first:last])
+                 for column in ['datetime','bikes_available','docks_available'] )
+
+
+def loaddata(filein, progress=printprogress):
+    """
+    Returns the columns of the rebalancing data as a dictionary of
+    numpy arrays memory mapped from the on-disk cache (see
+    BabsCache.readarrays), so no column is read into memory until it
+    is used. Ingests the csv first if the cache is missing or out of
+    date.
+    """
+
+    sources = [filein]
+    data = BabsCache.readarrays('rebalancing', sources)
+    if data is None:
+        ingest(filein, sources, progress)
+        data = BabsCache.readarrays('rebalancing', sources)
+
+    return data
+
+
+def rawstats(data, first, last):
+    """
+    Returns the minute-level rows first:last of the rebalancing data in
+    the format of the rollup levels: a dictionary of the ROLLUPCOLUMNS
+    in which each row is a bin of one snapshot. Missing values (-1) are
+    not counted.
+    """
+
+    stats = {'station_id': np.array(data['station_id'][first:last]),
+             'datetime': np.array(data['datetime'][first:last])}
+    valid = np.ones(last-first, dtype=bool)
+    for prefix,column in VARIABLES:
+        valid &= np.asarray(data[column][first:last])>=0
+    stats['count'] = valid.astype('int32')
+
+    for prefix,column in VARIABLES:
+        values = np.asarray(data[column][first:last]).astype('float32')
+        values[~valid] = np.nan
+        for stat in ['min','mean','max']:
+            stats[prefix+'_'+stat] = values
+
+    return stats
+
+
+def rollup(stats, seconds):
+    """
+    Rolls the rows of stats (a dictionary of the ROLLUPCOLUMNS, sorted by
+    station and time) up into time bins of the given number of seconds.
+    The bins start at multiples of seconds since 1970-01-01, so every
+    bin of a finer level falls in exactly one bin of a coarser level.
+    """
+
+    step = np.int64(seconds)*10**9
+    station = stats['station_id']
+    bins = stats['datetime'].view('i8') // step
+    if len(bins)==0:
+        return dict( (column, stats[column][:0]) for column in ROLLUPCOLUMNS )
+
+    # Rows of the same station and bin are next to each other
+    starts = np.append( 0, np.flatnonzero( (station[1:]!=station[:-1]) |
+                                           (bins[1:]!=bins[:-1]) ) + 1 )
+    count = stats['count']
+    empty = count==0
+    newcount = np.add.reduceat( count, starts )
+    newempty = newcount==0
+
+    newstats = {'station_id': station[starts],
+                'datetime': (bins[starts]*step).view('M8[ns]'),
+                'count': newcount.astype('int32')}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for prefix,column in VARIABLES:
+            low = np.minimum.reduceat( np.where(empty, np.inf, stats[prefix+'_min']), starts )
+            high = np.maximum.reduceat( np.where(empty, -np.inf, stats[prefix+'_max']), starts )
+            total = np.add.reduceat( np.where(empty, 0., stats[prefix+'_mean']*count), starts )
+            low[newempty] = np.nan
+            high[newempty] = np.nan
+            newstats[prefix+'_min'] = low.astype('float32')
+            newstats[prefix+'_mean'] = (total/newcount).astype('float32')
+            newstats[prefix+'_max'] = high.astype('float32')
+
+    return newstats
+
+
+def buildrollups(sources, chunksize=CHUNKSIZE):
+    """
+    Builds the rollup levels (see LEVELS) from the sorted rebalancing
+    data, a group of whole stations of about chunksize rows at a time.
+    Each level is rolled up from the one below it.
+    """
+
+    data = BabsCache.readarrays('rebalancing', sources)
+    index = BabsCache.readcache('rebalancingindex', sources)
+
+    # Rows of groups of whole stations
+    groups = []
+    first = 0
+    for stop in index['stop'].values:
+        if stop-first>=chunksize:
+            groups.append( (first,stop) )
+            first = stop
+    if first<len(data['station_id']) or groups==[]:
+        groups.append( (first,len(data['station_id'])) )
+
+    manifests = [BabsCache.startcache(name, sources) for name,seconds in LEVELS]
+    for first,last in groups:
+        stats = rawstats(data, first, last)
+        for manifest,(name,seconds) in zip(manifests,LEVELS):
+            stats = rollup(stats, seconds)
+            BabsCache.appendcache( manifest, pd.DataFrame(stats, columns=ROLLUPCOLUMNS) )
+    for manifest in manifests:
+        BabsCache.finishcache(manifest)
+
+
+def levelfor(dT):
+    """
+    Returns the name of the coarsest rollup level whose bins divide
+    the time step dT (e.g. '7D', '3H'), or None if no level does and
+    the minute-level rows must be used.
+    """
+
+    offset = pd.tseries.frequencies.to_offset(dT)
+    try:
+        seconds = offset.nanos // 10**9
+    except ValueError:
+        # Calendar offsets (weeks, months) are made of whole days
+        seconds = 86400
+
+    name = None
+    for level,levelseconds in LEVELS:
+        if seconds>0 and seconds % levelseconds==0:
+            name = level
+    return name
+
+
+def availability(filein, station_id, dT, start=None, end=None):
+    """
+    Returns a pandas dataframe of the bikes and docks available at one
+    station, binned to the time step dT: the min, mean, and max of each
+    (columns STATCOLUMNS), indexed by the start of each bin.
+
+    The data is read from the coarsest rollup level that divides dT,
+    so a long time series reads a few rows per day instead of one per
+    minute.
+
+    INPUT
+       filein     - rebalancing csv file
+       station_id - station ID number
+       dT         - time step, e.g. '7D' or '1H'
+       start, end - anything pandas can convert to a Timestamp, or None.
+                    Compared with the start of the bins of the level read.
+    """
+
+    name = levelfor(dT)
+    if name is None:
+        data = loaddata(filein)
+        index = loadindex(filein)
+        if station_id in index.index:
+            first = index.loc[station_id,'start']
+            last = index.loc[station_id,'stop']
+        else:
+            first = last = 0
+        first, last = timewindow( data['datetime'], first, last, start, end )
+        stats = rawstats(data, first, last)
+    else:
+        sources = [filein]
+        data = BabsCache.readarrays(name, sources)
+        if data is None:
+            loaddata(filein)
+            data = BabsCache.readarrays(name, sources)
+        # Rows are sorted by station, so its rows are found by binary search
+        first = np.searchsorted( data['station_id'], station_id, side='left' )
+        last = np.searchsorted( data['station_id'], station_id, side='right' )
+        first, last = timewindow( data['datetime'], first, last, start, end )
+        stats = dict( (column, np.array(data[column][first:last])) for column in ROLLUPCOLUMNS )
+
+    frame = pd.DataFrame( stats, columns=ROLLUPCOLUMNS ).set_index('datetime')
+    if len(frame)==0:
+        return pd.DataFrame( columns=STATCOLUMNS, index=pd.DatetimeIndex([],name='datetime') )
+
+    # Combine the bins into the time step of the plot. Means are
+    #    weighted by the number of snapshots in each bin.
+    how = {'count':'sum'}
+    for prefix,column in VARIABLES:
+        frame[prefix+'_sum'] = (frame[prefix+'_mean']*frame['count']).fillna(0)
+        how[prefix+'_sum'] = 'sum'
+        how[prefix+'_min'] = 'min'
+        how[prefix+'_max'] = 'max'
+    binned = frame.resample(dT, how=how)
+    for prefix,column in VARIABLES:
+        binned[prefix+'_mean'] = binned[prefix+'_sum']/binned['count']
+
+    return binned[STATCOLUMNS]
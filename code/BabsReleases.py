@@ -0,0 +1,178 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file finds the BABS data releases on disk so they can be
+#    loaded together. Every directory in DATAROOT named
+#    <YYYYMM>-babs-open-data is a release, named by its date (e.g.
+#    201402 for ../data/201402-babs-open-data/). Releases are ordered
+#    by name, so the BABS releases (201402, 201408, 201508, ...) are
+#    ordered from oldest to newest. Other directories (e.g. synthetic
+#    data) are ignored.
+#
+#    Each release holds csv files named <release>_<file>_data.csv.
+#    Later releases renamed some files and columns (e.g. the
+#    rebalancing data became status data, and Subscription Type became
+#    Subscriber Type). RELEASEFORMATS maps them back to the names of
+#    the 201402 release, which the rest of the code uses.
+#
+#    A dataset is built from the csv files of every release that has
+#    it. Rows that appear in several releases (the same trip, station,
+#    or day of weather) are kept once, from the newest release.
+#
+#    OUTLINE
+#       columnnames- csv columns of a release renamed to the 201402 names
+#       fileformat - file names and column names of a release
+#       newest     - keep the newest row of each key
+#       releasefiles - csv files of a dataset, oldest release first
+#       releaseof  - name of the release holding a csv file
+#       releases   - names and directories of the releases on disk
+#
+########################################################################
+
+# Import modules required by these functions
+import os
+import re
+import glob
+import pandas as pd
+
+########################################################################
+
+# Directory holding one directory per release
+DATAROOT = '../data/'
+
+# Name of a release directory
+RELEASEPATTERN = re.compile(r'^(\d{6})-babs-open-data$')
+
+# File and column names of each release whose files differ from the
+#    release before it. A release uses the entry of the newest release
+#    at or before it.
+#       files   - dataset name: name of its csv file, where it differs
+#                 from the dataset name
+#       columns - dataset name: {csv column: 201402 column}. csv columns
+#                 are matched with surrounding spaces removed.
+RELEASEFORMATS = {
+    '201402': {'files': {}, 'columns': {}},
+    '201408': {'files': {},
+               'columns': {'trip': {'Subscriber Type':'Subscription Type'}}},
+    '201508': {'files': {'rebalancing':'status'},
+               'columns': {'trip': {'Subscriber Type':'Subscription Type'},
+                           'weather': {'PDT':'Date',
+                                       'Max TemperatureF':'Max_Temperature_F',
+                                       'Mean TemperatureF':'Mean_Temperature_F',
+                                       'Min TemperatureF':'Min_TemperatureF',
+                                       'Mean Wind SpeedMPH':'Mean_Wind_Speed_MPH ',
+                                       'Max Gust SpeedMPH':'Max_Gust_Speed_MPH',
+                                       'PrecipitationIn':'Precipitation_In ',
+                                       'Zip':'zip'}}},
+    }
+
+# Columns of each dataset (201402 names) that must be in every release
+REQUIRED = {'trip': ['Trip ID','Duration','Start Date','End Date','Start Terminal',
+                     'Subscription Type'],
+            'station': ['station_id','landmark','installation'],
+            'weather': ['Date','Max_Temperature_F','Mean_Temperature_F','Min_TemperatureF',
+                        'Mean_Wind_Speed_MPH ','Max_Gust_Speed_MPH','Precipitation_In ',
+                        'Events','zip'],
+            'rebalancing': ['station_id','bikes_available','docks_available','time']}
+
+
+def releases(dataroot=None):
+    """
+    Returns a list of (release name, directory) of the releases in
+    dataroot (default DATAROOT), oldest first.
+    """
+
+    if dataroot is None:
+        dataroot = DATAROOT
+    found = []
+    for thisdir in sorted( glob.glob(os.path.join(dataroot, '*-babs-open-data')) ):
+        match = RELEASEPATTERN.match( os.path.basename(thisdir) )
+        if match is not None and os.path.isdir(thisdir):
+            found.append( (match.group(1), thisdir) )
+    return found
+
+
+def fileformat(release):
+    """
+    Returns the entry of RELEASEFORMATS used by release: the entry of
+    the newest release at or before it (the oldest entry for releases
+    older than all entries).
+    """
+
+    known = sorted(RELEASEFORMATS)
+    older = [name for name in known if name<=release]
+    return RELEASEFORMATS[ older[-1] if older else known[0] ]
+
+
+def releaseof(filein):
+    """Returns the name of the release whose directory holds filein."""
+
+    match = RELEASEPATTERN.match( os.path.basename(os.path.dirname(os.path.abspath(filein))) )
+    if match is None:
+        return sorted(RELEASEFORMATS)[0]
+    return match.group(1)
+
+
+def releasefiles(name, dataroot=None):
+    """
+    Returns the csv files holding dataset name
+    {"rebalancing"|"trip"|"weather"|"station"} in every release
+    that has it, oldest release first.
+    """
+
+    files = []
+    for release,thisdir in releases(dataroot):
+        filename = fileformat(release)['files'].get(name, name)
+        files += sorted( glob.glob(os.path.join(thisdir, '*_'+filename+'_data.csv')) )
+    return files
+
+
+def columnnames(name, filein, header):
+    """
+    Returns the columns header of the csv file filein, holding dataset
+    name, renamed to the names of the 201402 release (see
+    RELEASEFORMATS). Raises ValueError if a column in REQUIRED is
+    missing after renaming.
+    """
+
+    renames = fileformat( releaseof(filein) )['columns'].get(name, {})
+    names = []
+    for column in header:
+        column = str(column)
+        names.append( renames.get(column.strip(), column) )
+
+    # The 201402 names of a few weather columns end in a space; match
+    #    every column with and without surrounding spaces
+    stripped = dict( (column.strip(),column) for column in names )
+    for column in REQUIRED.get(name, []):
+        if column not in names and column.strip() in stripped:
+            names[ names.index(stripped[column.strip()]) ] = column
+    missing = [column for column in REQUIRED.get(name, []) if column not in names]
+    if missing:
+        raise ValueError( 'Columns %s of the %s data are missing from %s; add its column '
+                          'names to BabsReleases.RELEASEFORMATS' % (missing, name, filein) )
+    return names
+
+
+def newest(data, keys):
+    """
+    Returns the rows of data with the last occurrence of each key,
+    in their original order. Rows of the releases are concatenated
+    oldest first, so the row from the newest release is kept.
+
+    INPUT
+       data  - pandas dataframe
+       keys  - list of arrays, one value per row of data, that
+               together identify a row (e.g. [station_id])
+    """
+
+    keyframe = pd.DataFrame( dict( (ii,values) for ii,values in enumerate(keys) ) )
+    keep = ~keyframe.iloc[::-1].duplicated().values[::-1]
+    if keep.all():
+        return data
+    return data[keep]
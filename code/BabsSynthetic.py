@@ -0,0 +1,356 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file writes a synthetic BABS dataset: station, trip, weather,
+#    and rebalancing csv files with the same columns and formats as the
+#    201402 open data release, so every loader and plot can be tested
+#    at any size without the real files.
+#
+#    The data has the main features of the real data: more stations
+#    and many more rides in San Francisco than in the other regions,
+#    weekday commute peaks at 8am and 5pm, a broad midday peak on
+#    weekends, more casual customers on weekends, longer rides by
+#    customers than subscribers, and fewer rides on rainy days.
+#
+#    The files are written one day (trips) or one station (rebalancing)
+#    at a time, so memory use does not grow with the size of the
+#    dataset. The random numbers of each day and station come from
+#    their own generator seeded from the seed and their position, so
+#    the same seed always gives the same files.
+#
+#    The files are written to a release directory under
+#    ../data/synthetic/, outside the directory of the real releases,
+#    so they are never loaded together with the real data. Trip IDs
+#    start at FIRSTTRIPID, above the IDs of the real releases. To load
+#    the synthetic data instead of the real data, set
+#    BabsReleases.DATAROOT = '../data/synthetic/'.
+#
+#    Usage, from the code directory:
+#       python BabsSynthetic.py --trips 1000000 --stations 500
+#       python BabsSynthetic.py --trips 100000000 --stations 20000 \
+#              --rebalancing-minutes 15 --outdir ../data/synthetic-big/201402-babs-open-data
+#
+#    OUTLINE
+#       dayprofile - expected share of the rides in each hour of a day
+#       generator  - random number generator of one day or station
+#       main       - parse the command line and write the dataset
+#       makestations - write the station csv
+#       makeweather  - write the weather csv
+#       maketrips  - write the trip csv, one day at a time
+#       makerebalancing - write the rebalancing csv, one station at a time
+#       timestrings- csv time strings of minutes since the first day
+#
+########################################################################
+
+# Import modules required by these functions
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+########################################################################
+
+# Regions, their share of the stations, their share of the rides, the
+#    zip code of their weather station, and the latitude and longitude
+#    of their center
+REGIONS = ['San Francisco','San Jose','Mountain View','Redwood City','Palo Alto']
+STATIONSHARE = [0.50, 0.23, 0.10, 0.10, 0.07]
+RIDESHARE = [0.88, 0.06, 0.03, 0.015, 0.015]
+ZIPCODES = [94107, 95113, 94041, 94063, 94301]
+CENTERS = [(37.78,-122.40), (37.34,-121.89), (37.39,-122.08),
+           (37.49,-122.23), (37.44,-122.16)]
+
+# Share of casual customers on weekdays and weekends
+CUSTOMERSHARE = {'weekday':0.12, 'weekend':0.35}
+
+# Zip codes given by subscribers
+HOMEZIPS = ['94107','94103','94110','94117','95113','94041','94063','94301','94611']
+
+# Weather events and their probabilities
+EVENTS = ['', 'Rain', 'Fog', 'Fog-Rain']
+EVENTPROB = [0.75, 0.12, 0.10, 0.03]
+
+# Number of docks at a station
+DOCKCOUNTS = [11, 15, 19, 23, 27]
+
+# ID of the first synthetic trip. Real trip IDs are below a few million.
+FIRSTTRIPID = 1000000000
+
+
+def generator(seed, *position):
+    """
+    Returns a numpy RandomState seeded from seed and position (e.g. the
+    number of a day), so each part of the dataset is the same no matter
+    which other parts are written.
+    """
+    return np.random.RandomState( [seed % 2**32] + [int(val) for val in position] )
+
+
+def dayprofile(weekend):
+    """
+    Returns the expected share of the day's rides in each of the 24
+    hours: commute peaks on weekdays, a broad midday peak on weekends.
+    """
+
+    hours = np.arange(24)
+    if weekend:
+        profile = 0.1 + np.exp( -0.5*((hours-14)/3.0)**2 )
+    else:
+        profile = ( 0.05 + np.exp( -0.5*((hours-8.5)/1.2)**2 ) +
+                    0.9*np.exp( -0.5*((hours-17.5)/1.5)**2 ) +
+                    0.25*np.exp( -0.5*((hours-12.5)/1.5)**2 ) )
+    profile[:5] *= 0.2
+    return profile/profile.sum()
+
+
+def timestrings(minutes, days, timeformat):
+    """
+    Returns an array of csv time strings for minutes since midnight of
+    days[0]. Day parts are formatted once per day and minute parts once
+    per minute of the day, so large arrays are formatted quickly.
+
+    INPUT
+       minutes    - integer array of minutes since midnight of days[0]
+       days       - pandas DatetimeIndex of consecutive days, long enough
+                    to hold the largest minute
+       timeformat - 'trip' for 8/29/2013 14:13 or
+                    'rebalancing' for 2013/08/29 14:13:00
+    """
+
+    if timeformat=='trip':
+        dayparts = np.array( ['%d/%d/%d ' % (day.month,day.day,day.year) for day in days], dtype=object )
+        minuteparts = np.array( ['%d:%02d' % (val//60,val%60) for val in range(1440)], dtype=object )
+    else:
+        dayparts = np.array( [day.strftime('%Y/%m/%d ') for day in days], dtype=object )
+        minuteparts = np.array( ['%02d:%02d:00' % (val//60,val%60) for val in range(1440)], dtype=object )
+    return dayparts[minutes//1440] + minuteparts[minutes%1440]
+
+
+def makestations(fileout, nstations, seed):
+    """
+    Writes the station csv and returns the stations as a pandas
+    dataframe with the columns of the csv plus 'regionid' and the
+    relative popularity of each station ('weight').
+    """
+
+    rs = generator(seed, 0)
+    regionid = np.sort( rs.choice(len(REGIONS), nstations, p=STATIONSHARE) )
+    # Every region has at least one station if there are enough stations
+    if nstations>=len(REGIONS):
+        regionid[:len(REGIONS)] = np.arange(len(REGIONS))
+        regionid = np.sort(regionid)
+
+    centers = np.array(CENTERS)[regionid]
+    stations = pd.DataFrame( {'station_id': np.arange(nstations)+2,
+                              'name': ['Station %d' % val for val in np.arange(nstations)+2],
+                              'lat': np.round( centers[:,0]+rs.normal(0,0.01,nstations), 6 ),
+                              'long': np.round( centers[:,1]+rs.normal(0,0.01,nstations), 6 ),
+                              'dockcount': rs.choice(DOCKCOUNTS, nstations),
+                              'landmark': np.array(REGIONS)[regionid],
+                              'installation': '8/6/2013'},
+                             columns=['station_id','name','lat','long','dockcount',
+                                      'landmark','installation'] )
+    stations.to_csv(fileout, index=False)
+
+    # Popularity of each station: the share of rides of its region,
+    #    spread unevenly over the stations of the region
+    weight = rs.lognormal(0, 0.6, nstations)
+    for ii in range(len(REGIONS)):
+        inregion = regionid==ii
+        if inregion.any():
+            weight[inregion] *= RIDESHARE[ii]/weight[inregion].sum()
+    stations['regionid'] = regionid
+    stations['weight'] = weight/weight.sum()
+
+    return stations
+
+
+def makeweather(fileout, days, seed):
+    """
+    Writes the weather csv (one row per day and zip code) and returns
+    a boolean array that is True on the days it rained in San Francisco.
+    """
+
+    rows = []
+    rainy = np.zeros( len(days), dtype=bool )
+    for ii,zipcode in enumerate(ZIPCODES):
+        rs = generator(seed, 1, ii)
+        season = np.cos( 2*np.pi*(days.dayofyear.values-200)/365. )
+        mean = np.round( 60 + 8*season + rs.normal(0,3,len(days)) )
+        events = rs.choice( EVENTS, len(days), p=EVENTPROB )
+        rain = np.array( ['Rain' in event for event in events] )
+        precip = np.where( rain, np.round(rs.exponential(0.3,len(days)),2), 0. )
+        precip = np.array( ['T' if (wet and val<0.01) else '%.2f' % val
+                            for wet,val in zip(rain,precip)], dtype=object )
+        rows.append( pd.DataFrame( {'Date': ['%d/%d/%d' % (day.month,day.day,day.year) for day in days],
+                                    'Max_Temperature_F': (mean + rs.randint(5,15,len(days))).astype(int),
+                                    'Mean_Temperature_F': mean.astype(int),
+                                    'Min_TemperatureF': (mean - rs.randint(5,15,len(days))).astype(int),
+                                    'Mean_Wind_Speed_MPH ': rs.randint(2,15,len(days)),
+                                    'Max_Gust_Speed_MPH': rs.randint(15,35,len(days)),
+                                    'Precipitation_In ': precip,
+                                    'Events': events,
+                                    'zip': zipcode} ) )
+        if REGIONS[ii]=='San Francisco':
+            rainy = rain
+
+    columns = ['Date','Max_Temperature_F','Mean_Temperature_F','Min_TemperatureF',
+               'Mean_Wind_Speed_MPH ','Max_Gust_Speed_MPH','Precipitation_In ','Events','zip']
+    pd.concat(rows)[columns].to_csv(fileout, index=False)
+
+    return rainy
+
+
+def maketrips(fileout, ntrips, stations, days, rainy, seed, progress=True):
+    """
+    Writes the trip csv one day at a time. The number of rides of each
+    day follows the day of week and the weather; the hour, start
+    station, customer type, and duration of each ride follow the
+    profiles at the top of this file. Rides end at a station in the
+    region they started in.
+    """
+
+    columns = ['Trip ID','Duration','Start Date','Start Station','Start Terminal',
+               'End Date','End Station','End Terminal','Bike #','Subscription Type','Zip Code']
+
+    # Expected share of the rides on each day
+    weekend = days.dayofweek.values>=5
+    dayweight = np.where(weekend, 0.45, 1.0) * np.where(rainy, 0.6, 1.0)
+    dayweight = dayweight/dayweight.sum()
+
+    # Number of rides of each day. Rounding errors are added to the last day.
+    perday = np.floor( ntrips*dayweight ).astype('int64')
+    perday[-1] += ntrips - perday.sum()
+
+    # Stations of each region, to choose end stations
+    names = stations['name'].values
+    ids = stations['station_id'].values
+    regionstations = [np.flatnonzero(stations['regionid'].values==ii) for ii in range(len(REGIONS))]
+
+    # Rides may end after the last day
+    enddays = pd.date_range( days[0], periods=len(days)+30, freq='D' )
+
+    tripid = FIRSTTRIPID
+    header = True
+    for ii,day in enumerate(days):
+        rs = generator(seed, 2, ii)
+        nday = perday[ii]
+
+        # Minute of each ride, in time order
+        hour = rs.choice( 24, nday, p=dayprofile(weekend[ii]) )
+        start = np.sort( ii*1440 + hour*60 + rs.randint(0,60,nday) )
+
+        # Start and end stations
+        first = rs.choice( len(stations), nday, p=stations['weight'].values )
+        last = np.empty( nday, dtype='int64' )
+        for jj,members in enumerate(regionstations):
+            inregion = np.flatnonzero( stations['regionid'].values[first]==jj )
+            if len(inregion)>0:
+                last[inregion] = members[ rs.randint(0,len(members),len(inregion)) ]
+
+        # Customer type and duration (seconds)
+        share = CUSTOMERSHARE['weekend' if weekend[ii] else 'weekday']
+        customer = rs.random_sample(nday)<share
+        duration = np.where( customer, rs.lognormal(np.log(1500),0.7,nday),
+                                       rs.lognormal(np.log(550),0.5,nday) )
+        duration = np.maximum( duration, 60 ).astype('int64')
+        end = start + duration//60
+
+        trips = pd.DataFrame( {'Trip ID': np.arange(tripid, tripid+nday),
+                               'Duration': duration,
+                               'Start Date': timestrings(start, days, 'trip'),
+                               'Start Station': names[first],
+                               'Start Terminal': ids[first],
+                               'End Date': timestrings(end, enddays, 'trip'),
+                               'End Station': names[last],
+                               'End Terminal': ids[last],
+                               'Bike #': rs.randint(9,900,nday),
+                               'Subscription Type': np.where(customer,'Customer','Subscriber'),
+                               'Zip Code': np.where( customer, 'nil',
+                                                     np.array(HOMEZIPS)[rs.randint(0,len(HOMEZIPS),nday)] )},
+                              columns=columns )
+        trips.to_csv( fileout, index=False, header=header, mode='w' if header else 'a' )
+        header = False
+        tripid += nday
+
+        if progress:
+            sys.stdout.write('\rWriting trips: day %d of %d' % (ii+1,len(days)))
+            sys.stdout.flush()
+    if progress:
+        sys.stdout.write('\n')
+
+
+def makerebalancing(fileout, stations, days, interval, seed, progress=True):
+    """
+    Writes the rebalancing csv one station at a time, with a snapshot of
+    the bikes and docks available every interval minutes. Bikes follow
+    a daily cycle (stations empty out in the morning and fill up in the
+    evening, or the reverse) plus noise. A few snapshots are missing.
+    """
+
+    minutes = np.arange( 0, len(days)*1440, interval )
+    phase = 2*np.pi*(minutes%1440)/1440.
+    header = True
+    for ii in range(len(stations)):
+        rs = generator(seed, 3, ii)
+        docks = stations['dockcount'].values[ii]
+        sign = 1 if rs.random_sample()<0.5 else -1
+        level = 0.5 + 0.3*sign*np.sin(phase-2.0) + rs.normal(0,0.1,len(minutes))
+        bikes = np.clip( np.round(level*docks), 0, docks ).astype('int64')
+
+        snapshots = pd.DataFrame( {'station_id': stations['station_id'].values[ii],
+                                   'bikes_available': bikes,
+                                   'docks_available': docks-bikes,
+                                   'time': timestrings(minutes, days, 'rebalancing')},
+                                  columns=['station_id','bikes_available','docks_available','time'] )
+        missing = rs.random_sample(len(minutes))<0.0005
+        snapshots.loc[missing,'bikes_available'] = np.nan
+        snapshots.loc[missing,'docks_available'] = np.nan
+        snapshots.to_csv( fileout, index=False, header=header, mode='w' if header else 'a',
+                          float_format='%d' )
+        header = False
+
+        if progress:
+            sys.stdout.write('\rWriting rebalancing data: station %d of %d' % (ii+1,len(stations)))
+            sys.stdout.flush()
+    if progress:
+        sys.stdout.write('\n')
+
+
+def main():
+
+    parser = argparse.ArgumentParser( description='Write a synthetic BABS dataset.' )
+    parser.add_argument( '--outdir', default='../data/synthetic/201402-babs-open-data/',
+                         help='directory for the csv files' )
+    parser.add_argument( '--prefix', default='201402', help='prefix of the csv file names' )
+    parser.add_argument( '--trips', type=int, default=150000, help='number of trips' )
+    parser.add_argument( '--stations', type=int, default=69, help='number of stations' )
+    parser.add_argument( '--start', default='2013-08-29', help='first day' )
+    parser.add_argument( '--end', default='2014-02-28', help='last day' )
+    parser.add_argument( '--rebalancing-minutes', type=int, default=1,
+                         help='minutes between rebalancing snapshots; 0 for no rebalancing data' )
+    parser.add_argument( '--seed', type=int, default=0, help='seed of the random numbers' )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    def fileof(name):
+        return os.path.join( args.outdir, args.prefix+'_'+name+'_data.csv' )
+
+    days = pd.date_range(args.start, args.end, freq='D')
+    stations = makestations( fileof('station'), args.stations, args.seed )
+    rainy = makeweather( fileof('weather'), days, args.seed )
+    maketrips( fileof('trip'), args.trips, stations, days, rainy, args.seed )
+    if args.rebalancing_minutes>0:
+        makerebalancing( fileof('rebalancing'), stations, days,
+                         args.rebalancing_minutes, args.seed )
+
+
+if __name__ == '__main__':
+    main()
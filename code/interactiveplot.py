@@ -10,7 +10,10 @@
 #       visualization of the BABS data.
 #
 #    OUTLINE
-#       functionname - description
+#       MainWindow - the main interactive window
+#       PlotWorker - thread that calculates plot data away from the
+#                       Qt event thread
+#       main       - starts the Qt application
 #
 ########################################################################
 
@@ -25,13 +28,86 @@ import numpy as np
 import random
 import BabsFunctions
 import BabsClasses
+import BabsPlot
 import pandas as pd
 #import pdb
 import itertools
+import threading
 
 ########################################################################
 
 
+# Define thread to calculate plot data in the background
+class PlotWorker(QtCore.QThread):
+    """Thread that calculates plot data so the GUI stays responsive.
+
+Each request carries a generation number. Only the newest request is
+kept: a request that arrives while another is waiting replaces it, and
+a request that is being calculated when a newer one arrives is cancelled
+at its next checkpoint (see BabsFunctions.plotdata). Results are sent
+to the GUI with the resultReady signal.
+
+METHODS
+   request  -  ask for the data of a new plot
+   stop     -  stop the thread
+   run      -  main loop of the thread"""
+
+    # Signals carrying (generation, options, result) and (generation, message)
+    resultReady = QtCore.pyqtSignal(int, object, object)
+    failed = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        """Initialize the thread. Call start() to begin processing requests."""
+        super(PlotWorker, self).__init__(parent)
+        self.condition = threading.Condition()
+        self.pending = None   # (generation, options, previous options) waiting to be calculated
+        self.latest = 0       # generation of the newest request
+        self.stopped = False
+
+    def request(self, generation, NewOptions, previous=None):
+        """Ask for the data of the plot described by NewOptions. previous
+        holds the options of the plot shown now (see BabsFunctions.plotdata)."""
+        with self.condition:
+            self.pending = (generation, NewOptions, previous)
+            self.latest = generation
+            self.condition.notify()
+
+    def stop(self):
+        """Stop the thread after the current request."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def run(self):
+        """Calculate requested plots until stopped."""
+
+        while True:
+
+            # Wait for the next request
+            with self.condition:
+                while self.pending is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                generation, NewOptions, previous = self.pending
+                self.pending = None
+
+            # Calculate the plot data, giving up if a newer request arrives.
+            #    Stages are recorded under the generation of the request.
+            stale = lambda: generation!=self.latest
+            BabsFunctions.PROFILER.setrefresh(generation)
+            try:
+                result = BabsFunctions.plotdata(NewOptions, stale, previous)
+            except BabsClasses.Cancelled:
+                continue
+            except Exception as error:
+                self.failed.emit(generation, str(error))
+                continue
+
+            if not stale():
+                self.resultReady.emit(generation, NewOptions, result)
+
+
 # Define class to hold our main interactive window
 class MainWindow(QtGui.QWidget):
     """Python Class to hold our main interactive GUI window.
@@ -41,7 +117,13 @@ METHODS
    __init__    -  initializes the window class
    initUI      -  initializes and draws the GUI grid
    initPlot    -  places Matplotlib canvas on the grid
-   initOptions -  places widgets on the grid to manipulate the plot"""
+   initOptions -  places widgets on the grid to manipulate the plot
+   initWorker  -  starts the thread that calculates plot data
+   updateplot  -  requests a new plot from the current widget selections
+   showplot    -  draws a plot once its data has been calculated
+   showerror   -  reports a failed plot request in a message box
+   showtiming  -  shows the stages of the last refresh in the timing panel
+   exporttiming-  writes the recorded stages to a log file"""
 
 
     def __init__(self):
@@ -57,6 +139,9 @@ METHODS
         # Create grid layout on which the GUI will be based
         self.initGrid()
 
+        # Start the thread that calculates plot data
+        self.initWorker()
+
         # ---- Initialize different types of widgets on the grid
         self.initOptions()  # Options for selecting what to plot
         self.initPlot()     # After initializing the options
@@ -99,6 +184,25 @@ METHODS
         #for ii in range(self.optcol0,self.optcol1+1):
         #    self.
 
+    def initWorker(self):
+        """Start the thread that calculates plot data in the background."""
+
+        # Generation number of the newest plot request
+        self.generation = 0
+
+        self.worker = PlotWorker()
+        self.worker.resultReady.connect(self.showplot)
+        self.worker.failed.connect(self.showerror)
+        QtCore.QCoreApplication.instance().aboutToQuit.connect(self.stopWorker)
+        self.worker.start()
+
+
+    def stopWorker(self):
+        """Stop the background thread before the application quits."""
+        self.worker.stop()
+        self.worker.wait()
+
+
     def initPlot(self):
         """Initialize plot in window."""
 
@@ -113,9 +217,10 @@ METHODS
                                         self.gridParams.plotnrow,
                                         self.gridParams.plotncol)
 
-        # Create axis on which to plot everything
-        self.ax = self.figure.add_subplot(111)
-        self.ax.hold(False)
+        # Create axis on which to plot everything, and the object that
+        #   draws the bars and lines on it
+        self.barplot = BabsPlot.BarPlot(self.figure)
+        self.ax = self.barplot.ax
 
         # Create the initial plot from the buttons already selected
         #   during initOptions()
@@ -133,6 +238,7 @@ METHODS
         self.initMainGroup()  # number of rides, duration, ...
         self.initBinGroup()   # how to bin the data
         self.initTimeBin()    # If binning by time, what time step to use
+        self.initStations()   # Station to show when plotting availability
 
         # Initialize Bar plot divisions
         self.initDivisions()  # weather, region, customer type, ...
@@ -165,7 +271,13 @@ METHODS
         for button in self.divisionGroup.buttons():
             button.setEnabled(True)
 
+        # Enable bin options and disable the station list
+        self.binGroup.setEnabled(True)
+        self.stationGroup.setEnabled(False)
+
         # Enable all check boxes in the overplot options
+        for button in self.overGroup.buttons():
+            button.setEnabled(True)
 
         # Enable all check boxes in filtering options
         
@@ -214,48 +326,19 @@ METHODS
         for button in self.divisionGroup.buttons():
             if str(button.objectName())=='Other': button.setEnabled(False)
 
+        # When showing bike availability, only the station and the time
+        #    step apply. Bars are not divided and nothing is overplotted.
+        if NewOptions.typeid==2:
+            NewOptions.binid = 0
+            self.binGroup.setCurrentIndex(0)
+            self.mainGroup.setEnabled(False)
+            self.binGroup.setEnabled(False)
+            self.stationGroup.setEnabled(True)
+            for button in self.divisionGroup.buttons():
+                button.setEnabled(False)
+            for button in self.overGroup.buttons():
+                button.setEnabled(False)
 
-    def setLabels(self,NewOptions):
-        """
-        Sets plot title, axis labels, and tick marks for the current plot.
-        """
-
-        # Set plot title = title0 + ' of ' + title1
-        title0 = ['Timeseries', 'Histogram']
-        title1 = ['Number of Rides', 'Ride Duration [minutes]', 'Ride Distance [km]']
-        title2 = ['Time (other)', 'Number of Rides', 'Day of Week', 
-                  'Hour of Day', 'Region']
-        title = (title0[NewOptions.typeid] + ' of ' + 
-                 title1[NewOptions.barid] + ' binned by ' + 
-                 title2[NewOptions.binid])
-
-        # Set y-axis label
-        if NewOptions.typeid==1: 
-            ylabel = 'Number of Occurances'
-        else:
-            ylabel = title1[NewOptions.barid]
-
-        if NewOptions.overtype!=[]:
-            ylabel2 = NewOptions.overtype[0]
-
-        # Set x-axis label
-        if NewOptions.typeid==0: xlabel='Date'
-        if NewOptions.typeid==1: xlabel=title2[NewOptions.binid]
-
-        # Set x-tick labels
-        xticks = []
-
-        # Set y-tick labels
-
-
-        # Place all labels on the plot
-        plt.title(title)
-        self.ax.set_ylabel(ylabel)
-        self.ax.set_xlabel(xlabel)
-        if hasattr(self,'ax2'):
-            self.ax2.set_ylabel(ylabel2)
-        #plt.yticks()
-        #plt.xticks()
 
     def initMainType(self):
         """Initialize widgets to control the type of bar plot"""
@@ -274,7 +357,7 @@ METHODS
         show_label.setAlignment(QtCore.Qt.AlignCenter)
 
         # Radio Buttons
-        button_names = ['Timeseries', 'Histogram']#, ]
+        button_names = ['Timeseries', 'Histogram', 'Availability']
         buttonlist = []
 
         # Add each name to the drop down list
@@ -395,6 +478,34 @@ METHODS
                              1, self.gridParams.nfiltercol-1 )
 
 
+    def initStations(self):
+        """Create drop down list of stations for the availability plot."""
+
+        # Label to the left of the drop down list
+        station_label = QtGui.QLabel('Station: ')
+        station_label.setAlignment(QtCore.Qt.AlignCenter)
+
+        # Drop down list of stations, labeled by ID number and name
+        self.stationGroup = QtGui.QComboBox()
+        stations = BabsFunctions.getdata('station', self.PlotOptions)
+        self.stationids = [int(val) for val in stations['station_id']]
+        self.stationGroup.addItems( [str(sid)+': '+str(name) for sid,name in
+                                     zip(stations['station_id'],stations['name'])] )
+        self.stationGroup.setEnabled(False)
+
+        # Upon item selection, call the method updateplot
+        self.connect(self.stationGroup, QtCore.SIGNAL('activated(QString)'), self.updateplot)
+
+        # Place widgets on grid
+        rowoffset = self.gridParams.stationgroup_row0
+        self.grid.addWidget( station_label, self.gridParams.optrow0+1+rowoffset,
+                             self.gridParams.optcol0+self.gridParams.nfiltercol*(0)+1,
+                             1, self.gridParams.nfiltercol-1 )
+        self.grid.addWidget( self.stationGroup, self.gridParams.optrow0+1+rowoffset,
+                             self.gridParams.optcol0+self.gridParams.nfiltercol*(1),
+                             1, self.gridParams.nfiltercol*3 )
+
+
     def initDivisions(self):
         """Initialize widgets to divide each bar in the bar plot"""
 
@@ -520,7 +631,7 @@ METHODS
             thisbutton = QtGui.QCheckBox(name,self)
             thisbutton.setObjectName(name)
             buttonlist.append(thisbutton)
-            #buttonlist[counter].clicked.connect(self.updateplot)
+            buttonlist[counter].clicked.connect(self.updateplot)
             buttonlist[counter].setChecked(True)
             self.filterGroup_customer.addButton(thisbutton)
             self.filterGroup_customer.setId(thisbutton, counter)
@@ -549,7 +660,7 @@ METHODS
             thisbutton = QtGui.QCheckBox(name,self)
             thisbutton.setObjectName(name)
             buttonlist.append(thisbutton)
-            #buttonlist[counter].clicked.connect(self.updateplot)
+            buttonlist[counter].clicked.connect(self.updateplot)
             buttonlist[counter].setChecked(True)
             self.filterGroup_region.addButton(thisbutton)
             self.filterGroup_region.setId(thisbutton, counter)
@@ -578,7 +689,7 @@ METHODS
             thisbutton = QtGui.QCheckBox(name,self)
             thisbutton.setObjectName(name)
             buttonlist.append(thisbutton)
-            #buttonlist[counter].clicked.connect(self.updateplot)
+            buttonlist[counter].clicked.connect(self.updateplot)
             buttonlist[counter].setChecked(True)
             self.filterGroup_dayofweek.addButton(thisbutton)
             self.filterGroup_dayofweek.setId(thisbutton, counter)
@@ -607,7 +718,7 @@ METHODS
             thisbutton = QtGui.QCheckBox(name,self)
             thisbutton.setObjectName(name)
             buttonlist.append(thisbutton)
-            #buttonlist[counter].clicked.connect(self.updateplot)
+            buttonlist[counter].clicked.connect(self.updateplot)
             buttonlist[counter].setChecked(True)
             self.filterGroup_hourofday.addButton(thisbutton)
             self.filterGroup_hourofday.setId(thisbutton, counter)
@@ -617,8 +728,92 @@ METHODS
                                 1, colwidth)
             counter += 1
 
+        # ---- Weather: limits of each weather variable and check boxes
+        #    of weather events
+        rowoffset = self.gridParams.weathergroup_row0
+        label_weather = QtGui.QLabel('Weather (min / max)')
+        label_weather.setAlignment(QtCore.Qt.AlignCenter)
+        self.grid.addWidget(label_weather, self.gridParams.optrow0+rowoffset,
+                            self.gridParams.optcol0+1, 1, self.gridParams.optncol-2)
+        types = ['Temperature (Min)', 'Temperature (Mean)', 'Temperature (Max)', 
+                 'Precipitation', 'Wind Speed (Mean)', 'Wind Speed (Max)']
+        self.weatherRanges = {}
+        for counter,name in enumerate(types):
+            thislabel = QtGui.QLabel(name)
+            minText = QtGui.QLineEdit('')
+            maxText = QtGui.QLineEdit('')
+            self.weatherRanges[name] = (minText, maxText)
+            self.grid.addWidget(thislabel, self.gridParams.optrow0+rowoffset+1+counter,
+                                self.gridParams.optcol0+1, 1, 5)
+            self.grid.addWidget(minText, self.gridParams.optrow0+rowoffset+1+counter,
+                                self.gridParams.optcol0+6, 1, 2)
+            self.grid.addWidget(maxText, self.gridParams.optrow0+rowoffset+1+counter,
+                                self.gridParams.optcol0+8, 1, 2)
+
+        label_events = QtGui.QLabel('Events')
+        label_events.setAlignment(QtCore.Qt.AlignCenter)
+        thisrowoffset = len(types)+2
+        self.grid.addWidget(label_events, self.gridParams.optrow0+rowoffset+thisrowoffset,
+                            self.gridParams.optcol0+1, 1, self.gridParams.optncol-2)
+        self.filterGroup_events = QtGui.QButtonGroup()
+        self.filterGroup_events.setExclusive(False)
+        self.filterGroup_events.setObjectName('Events')
+        types = BabsFunctions.EVENTS
+        buttonlist = []
+        counter = 0
+        ijs = [val for val in itertools.product(range(2),range(3))]
+        for name,ij in zip(types,ijs):
+            thisbutton = QtGui.QCheckBox(name,self)
+            thisbutton.setObjectName(name)
+            buttonlist.append(thisbutton)
+            buttonlist[counter].clicked.connect(self.updateplot)
+            buttonlist[counter].setChecked(True)
+            self.filterGroup_events.addButton(thisbutton)
+            self.filterGroup_events.setId(thisbutton, counter)
+            self.grid.addWidget(buttonlist[counter], 
+                                self.gridParams.optrow0+rowoffset+thisrowoffset+1+ij[0],
+                                self.gridParams.optcol0+ij[1]*4+1, 1, 4)
+            counter += 1
 
-        # ---- Group to hold date range calendar objects
+
+        # ---- Group to hold date range calendar objects and the time of
+        #    day window. The date range is used only when checked.
+        rowoffset = self.gridParams.dategroup_row0
+        label_dates = QtGui.QLabel('Dates and Time of Day')
+        label_dates.setAlignment(QtCore.Qt.AlignCenter)
+        self.grid.addWidget(label_dates, self.gridParams.optrow0+rowoffset,
+                            self.gridParams.optcol0+1, 1, self.gridParams.optncol-2)
+
+        # First and last day of the data, the default date range
+        cube = BabsFunctions.getdata('tripcube', self.PlotOptions)
+        if len(cube)>0:
+            first, last = cube.index[0], cube.index[-1]
+        else:
+            first = last = pd.Timestamp('now')
+        self.dateCheck = QtGui.QCheckBox('Dates',self)
+        self.dateCheck.setChecked(False)
+        self.startDate = QtGui.QDateEdit( QtCore.QDate(first.year,first.month,first.day) )
+        self.endDate = QtGui.QDateEdit( QtCore.QDate(last.year,last.month,last.day) )
+        for thisdate in [self.startDate, self.endDate]:
+            thisdate.setCalendarPopup(True)
+            thisdate.setDisplayFormat('yyyy-MM-dd')
+        self.grid.addWidget(self.dateCheck, self.gridParams.optrow0+rowoffset+1,
+                            self.gridParams.optcol0+1, 1, 3)
+        self.grid.addWidget(self.startDate, self.gridParams.optrow0+rowoffset+1,
+                            self.gridParams.optcol0+4, 1, 4)
+        self.grid.addWidget(self.endDate, self.gridParams.optrow0+rowoffset+1,
+                            self.gridParams.optcol0+8, 1, 4)
+
+        # Time of day window, HH:MM. Empty entries do not limit the window.
+        label_time = QtGui.QLabel('Time (HH:MM)')
+        self.timeStart = QtGui.QLineEdit('')
+        self.timeEnd = QtGui.QLineEdit('')
+        self.grid.addWidget(label_time, self.gridParams.optrow0+rowoffset+2,
+                            self.gridParams.optcol0+1, 1, 3)
+        self.grid.addWidget(self.timeStart, self.gridParams.optrow0+rowoffset+2,
+                            self.gridParams.optcol0+4, 1, 4)
+        self.grid.addWidget(self.timeEnd, self.gridParams.optrow0+rowoffset+2,
+                            self.gridParams.optcol0+8, 1, 4)
 
 
 
@@ -637,7 +832,28 @@ METHODS
         self.buttonQuit = QtGui.QPushButton('Quit Window',self)
         self.buttonQuit.clicked.connect(QtCore.QCoreApplication.instance().quit)
 
+        # Busy indicator, shown while plot data is being calculated
+        self.busyBar = QtGui.QProgressBar(self)
+        self.busyBar.setRange(0,0)
+        self.busyBar.setTextVisible(False)
+        self.busyBar.hide()
+
+        # Panel below the plot listing the time, rows, and bytes of
+        #    each stage of the last refresh. Hidden unless asked for.
+        self.timingPanel = QtGui.QPlainTextEdit(self)
+        self.timingPanel.setReadOnly(True)
+        self.timingPanel.setFont( QtGui.QFont('Monospace') )
+        self.timingPanel.hide()
+        self.buttonTiming = QtGui.QCheckBox('Show Timing',self)
+        self.buttonTiming.setChecked(False)
+        self.buttonTiming.clicked.connect(self.showtiming)
+        self.buttonExport = QtGui.QPushButton('Export Timing',self)
+        self.buttonExport.clicked.connect(self.exporttiming)
+
         # Place buttons on the grid
+        self.grid.addWidget(self.busyBar,
+                            self.gridParams.nrow-1,self.gridParams.optcol0,
+                            1, self.gridParams.nfiltercol-1)
         self.grid.addWidget(self.buttonRefresh, 
                             self.gridParams.nrow-1,self.gridParams.ncol-3*self.gridParams.nfiltercol,
                             1, self.gridParams.nfiltercol-1)
@@ -647,6 +863,16 @@ METHODS
         self.grid.addWidget(self.buttonQuit, 
                             self.gridParams.nrow-1,self.gridParams.ncol-1*self.gridParams.nfiltercol,
                             1, self.gridParams.nfiltercol-1)
+        self.grid.addWidget(self.timingPanel,
+                            self.gridParams.plotrow1+1,self.gridParams.plotcol0,
+                            self.gridParams.nrow-self.gridParams.plotrow1-2,
+                            self.gridParams.plotncol)
+        self.grid.addWidget(self.buttonTiming,
+                            self.gridParams.nrow-1,self.gridParams.plotcol0,
+                            1, self.gridParams.nfiltercol*2)
+        self.grid.addWidget(self.buttonExport,
+                            self.gridParams.nrow-1,self.gridParams.plotcol0+self.gridParams.nfiltercol*2,
+                            1, self.gridParams.nfiltercol*2)
 
 
     def resetplot(self,state):
@@ -663,41 +889,93 @@ METHODS
         """Set up plot options based on which buttons are checked.
            Then, call the plottng function (plotbar) with the new options"""
 
+        # Number of this refresh. Its stages are recorded under it.
+        self.generation += 1
+        BabsFunctions.PROFILER.setrefresh(self.generation)
+
         # Initialize instance of plot options class.
         # These options will replace the existing options.
         newoptions = BabsClasses.PlotOptions()
 
-        # Get new options from the current widget selections
-        newoptions.populate(self)
+        # Get new options from the current widget selections and
+        #   disable some widgets based on currently selected widgets
+        with BabsFunctions.PROFILER.stage('populate'):
+            newoptions.populate(self)
+            self.DisableOptions(newoptions)
+
+        # Ask the background thread for the plot data. The plot is
+        #   drawn by showplot when the data is ready; any older request
+        #   still being calculated is discarded. When only filter
+        #   checkboxes changed, the bars of the plot shown now are
+        #   updated with the rides of the toggled values.
+        self.worker.request(self.generation, newoptions, self.PlotOptions)
+        self.setBusy(True)
+
 
-        # Disable some widgets based on currently selected widgets
-        self.DisableOptions(newoptions)
+    def showplot(self,generation,NewOptions,result):
+        """Draw the plot once the background thread calculated its data.
+           Results of requests older than the newest one are ignored."""
+
+        if generation!=self.generation:
+            return
+        self.setBusy(False)
 
         # Call plotting routine, passing the newly constructed instance
-        #   of the PlotOptions class.
-        self.clearplot()
-        self.plotbar(newoptions)
+        #   of the PlotOptions class and the calculated data.
+        BabsFunctions.PROFILER.setrefresh(generation)
+        self.plotbar(NewOptions,result)
 
+        # List the stages of this refresh if the timing panel is shown
+        self.showtiming(None)
 
-    def clearplot(self):
-        """
-        Clear secondary axis from plot before plotting again."""
-
-        if hasattr(self,'ax2'):
-            for ii in range(len(self.ax2.lines)):
-                self.ax2.lines[0].remove()
-            self.overplotlegend.remove()
-            self.ax2.set_ylabel('')
-            self.ax2.set_yticklabels(['']*5)
-            self.canvas.draw()
+
+    def showerror(self,generation,message):
+        """Report a failed plot request in a message box.
+           The plot shown before the request is kept."""
+
+        if generation!=self.generation:
+            return
+        self.setBusy(False)
+        QtGui.QMessageBox.warning(self, 'Plot Error',
+                                  'Could not calculate plot:\n' + str(message))
+
+
+    def showtiming(self,state):
+        """Show or hide the table of stages of the last refresh."""
+
+        if not self.buttonTiming.isChecked():
+            self.timingPanel.hide()
+            return
+        self.timingPanel.setPlainText( BabsFunctions.PROFILER.summary(self.generation) )
+        self.timingPanel.show()
 
 
-    def plotbar(self,NewOptions):
+    def exporttiming(self,state):
+        """Write the recorded stages of recent refreshes to a file (one JSON record per line)."""
+
+        fileout = QtGui.QFileDialog.getSaveFileName(self, 'Export Timing', 'babs_timing.jsonl')
+        if fileout:
+            BabsFunctions.PROFILER.export( str(fileout) )
+
+
+    def setBusy(self,busy):
+        """Show or hide the busy indicator and cursor."""
+
+        if busy:
+            self.busyBar.show()
+            self.setCursor(QtCore.Qt.BusyCursor)
+        else:
+            self.busyBar.hide()
+            self.unsetCursor()
+
+
+    def plotbar(self,NewOptions,result):
         """Plots the bar plot.
 
            INPUT
               self.options  - Options class object that determines what to plot.
-                              See class PlotOptions? for more information."""
+                              See class PlotOptions? for more information.
+              result        - (tempdf, lines) calculated by BabsFunctions.plotdata"""
 
         # Self.PlotOptions  holds option information of old plot
         # newoptions        holds the option information of the new plot
@@ -707,263 +985,16 @@ METHODS
         #   3. Replace self.PlotOptions with NewOptions
 
         # Get data to plot on the bar plot.
+        tempdf, lines = result
 
-        # Main Type: Timeseries 
-        if NewOptions.typeid==0:
-            
-            # Main Group: Number of Rides
-            if NewOptions.barid==0:
-                basedata = BabsFunctions.getdata('trip',NewOptions)
-
-                # Create Pandas data frame to hold all information
-                tempdf = pd.DataFrame( basedata['Trip ID'].resample( NewOptions.dT, how='count' ).fillna(0) )
-                tempdf.columns = ['Number of Rides']
-
-                # Calculate values for each sub-division of the data set
-                if NewOptions.division!=[]:
-
-                    types = NewOptions.division_types
-                    for ii in range(len(types)):
-
-                        # Make column of zeros for each bicycle ride
-                        column = pd.DataFrame( np.zeros(len(basedata)), index=basedata.index )
-
-                        # Place a 1 in each row associated with this particular type
-                        if NewOptions.division=='Customer Type':
-                            column.loc[basedata['Subscription Type']==types[ii]] = 1
-                        elif NewOptions.division=='Day of Week':
-                            column.loc[basedata.index.dayofweek==ii] = 1
-                        elif NewOptions.division=='Hour of Day':
-                            column.loc[basedata.index.hour==ii] = 1
-                        elif NewOptions.division=='Region':
-                            column.loc[basedata['region']==types[ii]] = 1
-
-                        # Count the number of ones in each part of the timeseries
-                        column = column.resample( NewOptions.dT, how=np.sum ).fillna(0)
-                        if not column.empty:
-                                tempdf[types[ii]] = column
-
-                # Drop original item in the pandas dataframe
-                if NewOptions.division!='None':
-                    tempdf.drop('Number of Rides',axis=1,inplace=True)
-
-
-            # Main Group: Duration of rides
-            if NewOptions.barid==1:
-                basedata = BabsFunctions.getdata('trip',NewOptions)
-                tempdf = basedata[['Duration']]
-                tempdf = tempdf.resample( NewOptions.dT, how=np.median ).fillna(0)
-                tempdf.columns = ['Duration of Ride']
-
-                # Calculate values for each sub-division of the data set
-                if NewOptions.division=='Customer Type':
-                    barcolors = []
-                    # Add Number of Subscribers to the data frame
-                    types = ['Subscriber','Customer']
-                    for ii in range(len(types)):
-                        column = basedata[['Duration']]
-                        column.loc[basedata['Subscription Type']==types[ii]] = 1
-                        column = column.resample( NewOptions.dT, how=np.median ).fillna(0)
-                        tempdf[types[ii]] = column[0]
-
-                    # Drop total Number from the Data Frame
-                    tempdf.drop('Duration of Rides',axis=1,inplace=True)
-
-                #elif NewOptions.division=='Another Division':
-
-                        # do similar things
-
-
-        # Main Type: Histogram
-        elif NewOptions.typeid==1:
-
-            # Number of Rides
-            if NewOptions.barid==0:
-
-                # Get column of number of rides in the basedata
-                basedata = BabsFunctions.getdata('trip', NewOptions)
-
-                # Group the basedata into divisions indicated by the bin ID
-                if NewOptions.binid==1:
-                    tempdf = basedata.resample( NewOptions.dT, how='count' ).fillna(0)['Trip ID']
-                    count, divisions = np.histogram(tempdf, bins=20)  # Put histogram into dataframe
-                    tempdf = pd.DataFrame(count, index=divisions[:-1]+(divisions[1]-divisions[0])/2.)
-                if NewOptions.binid==2:
-                    tempdf = pd.DataFrame(basedata['Trip ID'].groupby(basedata.index.dayofweek).count())
-                if NewOptions.binid==3:
-                    tempdf = pd.DataFrame(basedata['Trip ID'].groupby(basedata.index.hour).count())
-                if NewOptions.binid==4:
-                    tempdf = pd.DataFrame(basedata['Trip ID'].groupby(basedata['region']).count())
-                tempdf.index.name = 'Number of Rides'
-                tempdf.columns = ['Number of Rides']
-
-                # Divide bars for plotting, if indicated
-                if NewOptions.division!='None':
-                    
-                    types = NewOptions.division_types
-                    for ii in range(len(types)):
-                        column = BabsFunctions.get_column(basedata,ii,NewOptions)
-                        if NewOptions.binid==1:
-                            column = pd.DataFrame( column.resample( NewOptions.dT, 
-                                                                    how='count' ).fillna(0),
-                                                   columns=['ones'] )
-                            thistypefrac = BabsFunctions.typefraction(column,divisions)
-                        elif NewOptions.binid==2:
-                            thistypefrac = column.groupby(column.index.dayofweek).count()
-                        elif NewOptions.binid==3:
-                            thistypefrac = column.groupby(column.index.hourofday).count()
-                        elif NewOptions.binid==4:
-                            thistypefrac = column.groupby(column.index).count()
-
-                        # Add the value for this type to the dataframe
-                        if not column.empty:
-                            tempdf[types[ii]] = thistypefrac
-
-                    # Drop original item in the pandas dataframe
-                    if NewOptions.division!='None':
-                        tempdf.drop('Number of Rides',axis=1,inplace=True)
-
-
-        # Create the barplot
-        # Calculate width of bars
-        # Regularly spaced time series
-        if NewOptions.typeid==0: 
-            width = 1.0*(tempdf.index[1]-tempdf.index[0]).days
-
-        # Histogram
-        else: 
-            diffs = [tempdf.index[ind+1] - tempdf.index[ind] for 
-                     ind in range(len(tempdf.index)-1)]
-            width = 1.0*(min(diffs))
-            #width = 1.0*(tempdf.index[1]-tempdf.index[0])
-
-        # Calculate barplot colors
-        types = NewOptions.division_types
-        if NewOptions.division=='None':
-            barcolors = ['b']
-        elif NewOptions.division=='Customer Type':
-            barcolors = cm.rainbow( np.linspace(0,1,len(types)) )
-        elif NewOptions.division=='Day of Week':
-            barcolors = cm.rainbow( np.linspace(0,1,len(types)) )
-        elif NewOptions.division=='Hour of Day':
-            barcolors = cm.hsv( np.linspace(0,1,len(types)) )
-        elif NewOptions.division=='Region':
-            barcolors = cm.jet( np.linspace(0,1,len(types)) )
-
-
-        # Create the bars on the bar plot
-        bars = []   # list of handles for each bar in barplot
-        for ii in range(len(tempdf.columns)):
-            # Save previous plot's y-value for base of next plot
-            if ii==0: 
-                previous = np.zeros(len(tempdf.iloc[:,ii]))
-
-            # Add the bar to the axis. If plotting many (divisions), make sure
-            #   to set ax.hold(True) after the first call
-            if len(tempdf.columns)==1: 
-                colorindex = 0
-            else:
-                colorindex = types.index(tempdf.columns[ii])
-
-            thisbar = self.ax.bar( tempdf.index, tempdf.iloc[:,ii], width,
-                                   bottom=previous, color=barcolors[ii] )
-            bars.append(thisbar)
-            self.ax.hold(True)
-            previous = previous + tempdf.iloc[:,ii]
-
-
-        # Update all other lines to overplot
-        if NewOptions.overtype!=[]:
-
-            # Initialize the new plot
-            self.ax2 = self.ax.twinx()
-            self.ax2.hold(True)
-
-            # Get data.
-            overdata = BabsFunctions.getdata('weather', NewOptions)
-            overlines = []
-
-            # Add each new plot to the axis
-            for name in NewOptions.overtype:
-
-                # Match names in NewOptions.overtype to column names in overdata
-                if name=='Temperature (Min)': 
-                    column='Min_TemperatureF'
-                    color='#00bfff'
-                if name=='Temperature (Mean)': 
-                    column='Mean_Temperature_F'
-                    color='#3cb371'
-                if name=='Temperature (Max)':
-                    column='Max_Temperature_F'
-                    color='#ff0000'
-                if name=='Precipitation': 
-                    column='Precipitation_In '
-                    color='#888888'
-                if name=='Wind Speed (Mean)': 
-                    column='Mean_Wind_Speed_MPH '
-                    color='#da70d6'
-                if name=='Wind Speed (Max)': 
-                    column='Max_Gust_Speed_MPH'
-                    color='#9400d3'
-
-                # Average weather data into bins corresponding to the x-axis of the main plot
-                thisdata = BabsFunctions.bin_weather(overdata[column], tempdf, NewOptions )
-                if NewOptions.typeid==0: 
-                    thisdata.index = thisdata.index + (thisdata.index[1]-thisdata.index[0])//2
-                else:
-                    thisdata.index = thisdata.index + 0.5*(thisdata.index[1]-thisdata.index[0])
-
-                # Make a line to show this data
-                if name[0:11]=='Temperature':
-                    baserange = 50.
-                    basemin   = 25
-                    basemax   = 95
-                    overlines.append( self.ax2.plot(thisdata.index,
-                                                    thisdata,color=color,lw=4,
-                                                    label=name))
-                    self.ax2.set_ylim([basemin,basemax])
-                else:
-                    # If we have already plotted something, scale this plot to a range
-                    if overlines!=[]:
-                        axlimit = self.ax2.get_ylim()
-                        thisrange = thisdata.max()-thisdata.min()
-                        thisdata = thisdata-thisdata.min()
-                        thisdata = thisdata*(baserange/thisrange)
-                        thisdata = thisdata + basemin
-                    # Otherwise don't scale the information
-                    else:
-                        baserange = thisdata.max()-thisdata.min()
-                        basemin = thisdata.min()-0.2*baserange
-                        basemax = thisdata.max()+0.2*baserange
-                        self.ax2.set_ylim([basemin,basemax])
-
-                    # Plot the non-temperature information on the plot
-                    overlines.append( self.ax2.plot(thisdata.index,
-                                                    thisdata,color=color,lw=4,
-                                                    label=name))
-                
-            # Create legend for this second axis
-            #ooga=booga
-            self.ax2.hold(False)
-            self.overplotlegend = self.ax2.legend(loc=2)# (line for line in overlines), 
-                                                       #(col for col in overdata) )
-            #self.overplotlegend.draggable()
-
-        # Reset ax.hold(False) after placing everything on the plot
-        self.ax.hold(False)
-
-        # Make a legend for the figure
-        self.plotlegend = self.ax.legend( (bar[0] for bar in bars), 
-                                          (col for col in tempdf.columns) )
-        self.plotlegend.draggable()
-
-
-        # Add titles and labels
-        #    Plot title and axis labels
-        self.setLabels(NewOptions)
-
-        # Refresh the canvas
-        self.canvas.draw()
+        # Update the bars, overplot lines, and labels. Existing artists
+        #   are reused when only the data changed.
+        with BabsFunctions.PROFILER.stage('draw'):
+            self.barplot.draw(NewOptions, tempdf, lines)
+
+        # Refresh the canvas once
+        with BabsFunctions.PROFILER.stage('canvas.draw'):
+            self.canvas.draw()
 
         # Resent plot options with the new options
         self.PlotOptions = NewOptions
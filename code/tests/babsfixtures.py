@@ -0,0 +1,172 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    This file holds the fixtures shared by the tests: a test case that
+#    runs in a temporary copy of the directory layout (code/ next to
+#    data/), and functions that write small BABS releases into it.
+#
+#    The modules read '../data/' relative to the working directory, so
+#    each test changes into the temporary code/ directory and sees only
+#    the releases it wrote.
+#
+#    Run the tests from the code directory:
+#       python -m unittest discover -s tests
+#
+#    OUTLINE
+#       FixtureCase - test case running in a temporary data directory
+#       stationframe - stations, two in each region
+#       tripframe  - trips from a list of (start, terminal, customer type)
+#       weatherframe - weather from a list of (date, zip, precipitation)
+#       writerelease - write csv files of one release
+#       writesynthetic - write a synthetic release (see BabsSynthetic)
+#
+########################################################################
+
+# Import modules required by these functions
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import BabsFunctions
+import BabsSynthetic
+
+########################################################################
+
+# Regions of the stations written by stationframe, and the zip code of
+#    the weather of each region
+REGIONS = BabsSynthetic.REGIONS
+ZIPCODES = BabsSynthetic.ZIPCODES
+
+
+# Define test case that runs in a temporary data directory
+class FixtureCase(unittest.TestCase):
+    """
+    Test case that runs each test in a temporary directory holding
+    code/ (the working directory) and data/, with an empty STORE.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.root, 'data')
+        os.makedirs( os.path.join(self.root, 'code') )
+        os.makedirs( self.datadir )
+        self.cwd = os.getcwd()
+        os.chdir( os.path.join(self.root, 'code') )
+        BabsFunctions.STORE.clear()
+
+    def tearDown(self):
+        BabsFunctions.STORE.clear()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+
+def stationframe():
+    """Returns a station table with two stations (IDs 2 to 11) in each region."""
+
+    ids = np.arange(2, 2+2*len(REGIONS))
+    return pd.DataFrame( {'station_id': ids,
+                          'name': ['Station %d' % val for val in ids],
+                          'lat': 37.5, 'long': -122.0, 'dockcount': 15,
+                          'landmark': [REGIONS[(val-2)//2] for val in ids],
+                          'installation': '8/6/2013'},
+                         columns=['station_id','name','lat','long','dockcount',
+                                  'landmark','installation'] )
+
+
+def tripframe(rows, firstid=1):
+    """
+    Returns a trip table from a list of (start time 'M/D/YYYY H:MM',
+    start terminal, customer type). Rides last 10 minutes and end at
+    their start station.
+    """
+
+    starts = pd.to_datetime( [row[0] for row in rows] )
+    ends = starts + pd.Timedelta(minutes=10)
+    def timestring(times):
+        return [ '%d/%d/%d %d:%02d' % (val.month,val.day,val.year,val.hour,val.minute)
+                 for val in times ]
+    return pd.DataFrame( {'Trip ID': np.arange(firstid, firstid+len(rows)),
+                          'Duration': 600,
+                          'Start Date': timestring(starts),
+                          'Start Station': ['Station %d' % row[1] for row in rows],
+                          'Start Terminal': [row[1] for row in rows],
+                          'End Date': timestring(ends),
+                          'End Station': ['Station %d' % row[1] for row in rows],
+                          'End Terminal': [row[1] for row in rows],
+                          'Bike #': 100,
+                          'Subscription Type': [row[2] for row in rows],
+                          'Zip Code': '94107'},
+                         columns=['Trip ID','Duration','Start Date','Start Station',
+                                  'Start Terminal','End Date','End Station','End Terminal',
+                                  'Bike #','Subscription Type','Zip Code'] )
+
+
+def weatherframe(rows):
+    """
+    Returns a weather table from a list of (date 'M/D/YYYY', zip code,
+    precipitation string, e.g. 'T' or '0.25'). Days with precipitation
+    other than '0' have the event 'Rain'.
+    """
+
+    return pd.DataFrame( {'Date': [row[0] for row in rows],
+                          'Max_Temperature_F': 70,
+                          'Mean_Temperature_F': 60,
+                          'Min_TemperatureF': 50,
+                          'Mean_Wind_Speed_MPH ': 5,
+                          'Max_Gust_Speed_MPH': 20,
+                          'Precipitation_In ': [row[2] for row in rows],
+                          'Events': ['' if row[2] in ['0','0.00'] else 'Rain' for row in rows],
+                          'zip': [row[1] for row in rows]},
+                         columns=['Date','Max_Temperature_F','Mean_Temperature_F',
+                                  'Min_TemperatureF','Mean_Wind_Speed_MPH ',
+                                  'Max_Gust_Speed_MPH','Precipitation_In ','Events','zip'] )
+
+
+def writerelease(datadir, release, frames, filenames=None):
+    """
+    Writes the tables in frames (dataset name: dataframe) as the csv
+    files of release (e.g. '201402') in datadir. filenames optionally
+    maps a dataset to the name used in its file name (e.g.
+    {'rebalancing':'status'}). Returns the release directory.
+    """
+
+    filenames = filenames or {}
+    releasedir = os.path.join(datadir, release+'-babs-open-data')
+    if not os.path.isdir(releasedir):
+        os.makedirs(releasedir)
+    for name,frame in frames.items():
+        fileout = os.path.join( releasedir, '%s_%s_data.csv' % (release, filenames.get(name,name)) )
+        frame.to_csv(fileout, index=False)
+    return releasedir
+
+
+def writesynthetic(datadir, release='201402', ntrips=20000, nstations=20,
+                   start='2013-08-29', end='2013-11-30', seed=0, rebalancing=0):
+    """
+    Writes a synthetic release (stations, weather, and trips; see
+    BabsSynthetic) to datadir and returns the release directory.
+    rebalancing is the number of minutes between rebalancing
+    snapshots; 0 for no rebalancing data.
+    """
+
+    releasedir = os.path.join(datadir, release+'-babs-open-data')
+    os.makedirs(releasedir)
+    def fileof(name):
+        return os.path.join( releasedir, release+'_'+name+'_data.csv' )
+
+    days = pd.date_range(start, end, freq='D')
+    stations = BabsSynthetic.makestations( fileof('station'), nstations, seed )
+    rainy = BabsSynthetic.makeweather( fileof('weather'), days, seed )
+    BabsSynthetic.maketrips( fileof('trip'), ntrips, stations, days, rainy, seed,
+                             progress=False )
+    if rebalancing>0:
+        BabsSynthetic.makerebalancing( fileof('rebalancing'), stations, days, rebalancing,
+                                       seed, progress=False )
+    return releasedir
@@ -0,0 +1,93 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests of the values shown in the bars of the main plot, calculated
+#    from the trips, the trip cube, and hourly counts.
+#
+########################################################################
+
+# Import modules required by these tests
+import unittest
+import numpy as np
+import BabsFunctions
+import BabsClasses
+from babsfixtures import FixtureCase, stationframe, tripframe, weatherframe, writerelease
+
+########################################################################
+
+
+def options(binid, division='None', filters=None):
+    NewOptions = BabsClasses.PlotOptions()
+    NewOptions.typeid = 1
+    NewOptions.binid = binid
+    NewOptions.dT = '1D'
+    NewOptions.setdivision(division)
+    NewOptions.filters = filters or {}
+    return NewOptions
+
+
+class RegionTest(FixtureCase):
+    """Region histograms show the regions with rides, in alphabetical order."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+
+        # Rides in San Francisco (2, 3), Palo Alto (10) and Redwood City (8)
+        rows = [('9/1/2013 8:00',2,'Subscriber'), ('9/1/2013 9:00',3,'Customer'),
+                ('9/2/2013 8:00',10,'Subscriber'), ('9/2/2013 17:00',8,'Customer'),
+                ('9/3/2013 8:00',2,'Subscriber')]
+        weather = weatherframe( [('9/%d/2013' % day,94107,'0') for day in [1,2,3]] )
+        writerelease( self.datadir, '201402', {'station':stationframe(), 'weather':weather,
+                                               'trip':tripframe(rows)} )
+
+    def check(self, bars, regions, counts):
+        self.assertEqual( list(bars.index), regions )
+        self.assertEqual( list(bars.sum(axis=1)), counts )
+
+    def test_regions(self):
+        regions = ['Palo Alto','Redwood City','San Francisco']
+        # Trip cube, hourly counts, and trips (a time of day filter
+        #    that does not start on a whole hour)
+        self.check( BabsFunctions.cubebars(options(4)), regions, [1,1,3] )
+        self.check( BabsFunctions.calcbars(options(4),BabsClasses.PlotOptions()), regions, [1,1,3] )
+        trips = options( 4, filters={'Time of Day':{'min':'00:30','max':'23:59'}} )
+        self.check( BabsFunctions.calcbars(trips), regions, [1,1,3] )
+
+    def test_divided(self):
+        regions = ['Palo Alto','San Francisco']
+        filters = {'Region':['Redwood City']}
+        for bars in [ BabsFunctions.cubebars(options(4,'Customer Type',filters)),
+                      BabsFunctions.calcbars(options(4,'Customer Type',filters),
+                                             BabsClasses.PlotOptions()) ]:
+            self.check( bars, regions, [1,3] )
+            self.assertEqual( list(bars['Customer']), [0,1] )
+
+
+class MissingDurationTest(FixtureCase):
+    """Rides without a duration are counted in the trip cube."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+        rows = [('9/1/2013 8:00',2,'Subscriber'), ('9/1/2013 8:20',2,'Subscriber'),
+                ('9/1/2013 8:40',2,'Subscriber'), ('9/2/2013 9:00',3,'Customer')]
+        trips = tripframe(rows)
+        trips.loc[[1,3],'Duration'] = np.nan
+        weather = weatherframe( [('9/%d/2013' % day,94107,'0') for day in [1,2]] )
+        writerelease( self.datadir, '201402', {'station':stationframe(), 'weather':weather,
+                                               'trip':trips} )
+
+    def test_cube(self):
+        cube = BabsFunctions.loaddata('tripcube')
+        self.assertEqual( list(cube['count']), [3,1] )
+        self.assertEqual( list(cube['Duration']), [1200,0] )
+        bars = BabsFunctions.cubebars( options(3) )
+        self.assertEqual( list(bars['Number of Rides']), [3,1] )
+
+
+if __name__ == '__main__':
+    unittest.main()
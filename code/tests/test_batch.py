@@ -0,0 +1,77 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests of the datasets loaded before the batch worker processes
+#    are forked (see BabsBatch.preload), and of rendering the plots.
+#
+########################################################################
+
+# Import modules required by these tests
+import os
+import unittest
+import BabsBatch
+import BabsCache
+import BabsClasses
+import BabsFunctions
+from babsfixtures import FixtureCase, writesynthetic
+
+########################################################################
+
+
+class PreloadTest(FixtureCase):
+    """Availability plots have their rebalancing data loaded up front."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+        writesynthetic( self.datadir, ntrips=500, nstations=4,
+                        start='2013-09-01', end='2013-09-03', rebalancing=60 )
+
+    def job(self, typeid):
+        NewOptions = BabsClasses.PlotOptions()
+        NewOptions.typeid = typeid
+        NewOptions.station = 2
+        return (NewOptions, 'plot.png')
+
+    def test_rebalancing(self):
+        BabsBatch.preload( [self.job(0), self.job(2)] )
+        index = BabsFunctions.STORE.get( ('base','rebalancingindex') )
+        self.assertEqual( list(index.index), [2,3,4,5] )
+        for name in ['rebalancing','rebalancingindex']:
+            self.assertTrue( BabsCache.readmanifest(name) is not None )
+
+    def test_norebalancing(self):
+        BabsBatch.preload( [self.job(0)] )
+        self.assertTrue( BabsFunctions.STORE.get( ('base','rebalancingindex') ) is None )
+        self.assertTrue( BabsCache.readmanifest('rebalancing') is None )
+
+
+class RenderTest(FixtureCase):
+    """Each plot is rendered, or reported, on its own."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+        writesynthetic( self.datadir, ntrips=500, nstations=10,
+                        start='2013-09-01', end='2013-09-05' )
+
+    def test_region(self):
+        NewOptions = BabsClasses.PlotOptions().fromdict( {'typeid':1, 'binid':4,
+                                                          'overtype':['Temperature (Max)']} )
+        fileout, error = BabsBatch.renderplot( (NewOptions, 'region.png') )
+        self.assertEqual( error, None )
+        self.assertTrue( os.path.isfile('region.png') )
+
+    def test_error(self):
+        NewOptions = BabsClasses.PlotOptions().fromdict( {'dT':'not a time step'} )
+        fileout, error = BabsBatch.renderplot( (NewOptions, 'bad.png') )
+        self.assertEqual( fileout, 'bad.png' )
+        self.assertTrue( error is not None )
+        self.assertFalse( os.path.isfile('bad.png') )
+
+
+if __name__ == '__main__':
+    unittest.main()
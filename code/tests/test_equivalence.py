@@ -0,0 +1,304 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests that the faster ways of calculating the bars of the main
+#    plot give the same bars as counting the raw trips. The reference
+#    bars (oraclebars) are counted as the original plotting code did:
+#    straight from the trip csv files with pandas, with the filters
+#    applied as boolean masks and the regions joined from the station
+#    csv files. They do not use the cache, the trip cube, the trip
+#    pyramid, or the bitmap index.
+#
+#    OUTLINE
+#       oracletrips - trips of every release, read straight from csv
+#       oraclemask - rows of the oracle trips kept by the filters
+#       oraclebars - bars of the main plot counted from the oracle trips
+#
+########################################################################
+
+# Import modules required by these tests
+import copy
+import glob
+import os
+import random
+import unittest
+import numpy as np
+import pandas as pd
+import BabsClasses
+import BabsFunctions
+from babsfixtures import FixtureCase, writerelease, writesynthetic
+
+########################################################################
+
+# Plots compared: (typeid, binid, dT, division)
+CONFIGS = [(0,0,'1D','None'), (0,0,'7D','Customer Type'), (0,0,'2H','Region'),
+           (0,0,'1D','Hour of Day'), (1,1,'1D','None'), (1,2,'1D','Region'),
+           (1,3,'1D','Customer Type'), (1,4,'1D','Day of Week'), (1,4,'1D','None')]
+
+# Values of each categorical filter
+CHOICES = {'Customer Type': BabsFunctions.CUSTOMERTYPES,
+           'Region': BabsFunctions.REGIONS,
+           'Day of Week': [str(val) for val in range(7)],
+           'Hour of Day': [str(val) for val in range(24)],
+           'Station': [str(val) for val in range(2,22)]}
+
+
+def options(typeid, binid, dT, division, filters=None):
+    NewOptions = BabsClasses.PlotOptions()
+    NewOptions.typeid = typeid
+    NewOptions.binid = binid
+    NewOptions.dT = dT
+    NewOptions.setdivision(division)
+    NewOptions.filters = copy.deepcopy(filters or {})
+    return NewOptions
+
+
+def oracletrips(datadir):
+    """
+    Returns the trips of every release in datadir, read straight from
+    the csv files. A trip in several releases is kept from the newest.
+    Each trip gets the landmark of its start station in the newest
+    station file as its region.
+    """
+
+    releases = sorted( glob.glob(os.path.join(datadir,'*-babs-open-data')) )
+    trips = []
+    for release in releases:
+        trip = pd.read_csv( glob.glob(os.path.join(release,'*_trip_data.csv'))[0],
+                            parse_dates=['Start Date'] )
+        trips.append( trip.rename(columns={'Subscriber Type':'Subscription Type'}) )
+    trips = pd.concat(trips).drop_duplicates('Trip ID', keep='last')
+
+    stations = pd.read_csv( glob.glob(os.path.join(releases[-1],'*_station_data.csv'))[0] )
+    landmark = stations.set_index('station_id')['landmark']
+    trips['region'] = landmark.reindex(trips['Start Terminal'].values).values
+    return trips.sort_values(['Start Date','Trip ID']).set_index('Start Date')
+
+
+def oraclemask(trips, filters):
+    """Returns a boolean array that is True for the oracle trips kept by filters."""
+
+    fields = {'Customer Type': trips['Subscription Type'].values,
+              'Region': trips['region'].values,
+              'Day of Week': trips.index.dayofweek.astype(str),
+              'Hour of Day': trips.index.hour.astype(str),
+              'Station': trips['Start Terminal'].values.astype(str)}
+    keep = np.ones( len(trips), dtype=bool )
+    for filtername,filtervals in filters.items():
+        keep &= ~np.in1d( np.asarray(fields[filtername]), filtervals )
+    return keep
+
+
+def oraclebars(trips, NewOptions):
+    """
+    Returns the bars of the main plot counted from the oracle trips, as
+    the original plotting code counted them: rides per time step, or
+    per day of week, hour, or region with rides (regions in
+    alphabetical order), divided by the division types.
+    """
+
+    trips = trips[ oraclemask(trips, NewOptions.filters) ]
+    types = NewOptions.division_types
+    xkey = {2: trips.index.dayofweek, 3: trips.index.hour,
+            4: trips['region'].values}.get(NewOptions.binid)
+
+    if NewOptions.typeid==0 or NewOptions.binid==1:
+        total = trips['Trip ID'].resample(NewOptions.dT).count().fillna(0)
+    else:
+        total = trips['Trip ID'].groupby(xkey).count()
+
+    if NewOptions.binid==1:
+        count, divisions = np.histogram(total, bins=20)
+        tempdf = pd.DataFrame( {'Number of Rides': count},
+                               index=divisions[:-1]+(divisions[1]-divisions[0])/2. )
+        return tempdf
+    if NewOptions.division=='None':
+        return pd.DataFrame( {'Number of Rides': total} )
+
+    if NewOptions.division=='Customer Type':
+        codes = trips['Subscription Type'].values
+    elif NewOptions.division=='Region':
+        codes = trips['region'].values
+    elif NewOptions.division=='Day of Week':
+        codes = np.asarray(types)[trips.index.dayofweek]
+    else:
+        codes = trips.index.hour.astype(str)
+    if NewOptions.typeid==0:
+        xkey = pd.Grouper(freq=NewOptions.dT)
+    bytype = trips['Trip ID'].groupby( [xkey, np.asarray(codes)] ).count().unstack()
+    bytype = bytype.reindex( index=total.index, columns=types ).fillna(0)
+    if NewOptions.typeid==1:
+        bytype = bytype.loc[ :, (bytype!=0).any().values ]
+    return bytype
+
+
+class EquivalenceCase(FixtureCase):
+    """Compares bars with the oracle bars of a synthetic release."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+        writesynthetic( self.datadir, ntrips=2000, start='2013-09-01', end='2013-10-15' )
+
+    def assertSameBars(self, bars, expected):
+        self.assertEqual( list(bars.columns), list(expected.columns) )
+        self.assertEqual( list(bars.index), list(expected.index) )
+        self.assertTrue( np.allclose( bars.values.astype(float), expected.values.astype(float) ) )
+
+
+class CubeTest(EquivalenceCase):
+    """The trip cube and the trip pyramid count the same rides as the trips."""
+
+    def test_cube(self):
+        trips = oracletrips(self.datadir)
+        cube = BabsFunctions.loaddata('tripcube')
+        self.assertEqual( cube['count'].sum(), len(trips) )
+        self.assertEqual( cube['Duration'].sum(), trips['Duration'].sum() )
+        hourly = cube['count'].resample('1H').sum()
+        expected = trips['Trip ID'].resample('1H').count()
+        self.assertTrue( (hourly.reindex(expected.index).fillna(0)==expected).all() )
+
+    def test_pyramid(self):
+        cube = BabsFunctions.loaddata('tripcube')
+        pyramid = BabsFunctions.buildpyramid(cube)
+        for level,hours in BabsFunctions.PYRAMIDLEVELS:
+            counts = pyramid[(level,'count')].sum(axis=(1,2))
+            expected = cube['count'].resample( '%dH' % hours ).sum()
+            first = int( (expected.index[0]-pyramid['start']).total_seconds() // (3600*hours) )
+            self.assertTrue( np.array_equal( counts[first:first+len(expected)], expected.values ) )
+            self.assertEqual( counts.sum(), cube['count'].sum() )
+
+    def test_bars(self):
+        trips = oracletrips(self.datadir)
+        for filters in [{}, {'Customer Type':['Customer'], 'Region':['San Jose']},
+                        {'Hour of Day':['7','8','9'], 'Day of Week':['5','6']}]:
+            for config in CONFIGS:
+                NewOptions = options( *config, filters=filters )
+                self.assertSameBars( BabsFunctions.cubebars(NewOptions),
+                                     oraclebars(trips, NewOptions) )
+
+    def test_trippath(self):
+        # A time of day filter that does not start on a whole hour is
+        #    answered from the trips, not the trip cube. Bins without
+        #    rides of a division type are missing (NaN) there, as in the
+        #    original code, and drawn like bars of 0.
+        trips = oracletrips(self.datadir)
+        filters = {'Time of Day': {'min':'00:30', 'max':'23:59'}}
+        minutes = trips.index.hour*60 + trips.index.minute
+        trips = trips[ (minutes>=30) & (minutes<23*60+59) ]
+        for config in CONFIGS:
+            NewOptions = options( *config, filters=filters )
+            self.assertFalse( BabsFunctions.cubesupported(NewOptions) )
+            self.assertSameBars( BabsFunctions.calcbars(NewOptions).fillna(0),
+                                 oraclebars(trips, options(*config)) )
+
+
+class FilterTest(EquivalenceCase):
+    """The bitmap index keeps the same rows as the boolean mask."""
+
+    def test_bitmap(self):
+        trips = BabsFunctions.loaddata('trip')
+        index = BabsFunctions.bitmapindex(trips)
+        oracle = oracletrips(self.datadir)
+        rs = random.Random(1)
+        for trial in range(20):
+            filters = {}
+            for filtername in rs.sample( sorted(CHOICES), 2 ):
+                filters[filtername] = rs.sample( CHOICES[filtername], 2 )
+            NewOptions = options( 0, 0, '1D', 'None', filters )
+            mask = BabsFunctions.filtermask(trips, NewOptions)
+            self.assertEqual( list(BabsFunctions.filterindex(trips, NewOptions, index)),
+                              list(np.flatnonzero(mask)) )
+            self.assertEqual( sorted(trips['Trip ID'].values[mask]),
+                              sorted(oracle['Trip ID'].values[oraclemask(oracle, filters)]) )
+
+
+class IncrementalTest(EquivalenceCase):
+    """Bars updated by toggled filter values match bars counted afresh."""
+
+    def test_toggles(self):
+        trips = oracletrips(self.datadir)
+        rs = random.Random(2)
+        filters = {}
+        previous = BabsClasses.PlotOptions()
+        for step in range(30):
+            filtername = rs.choice( sorted(CHOICES) )
+            value = rs.choice( CHOICES[filtername] )
+            values = filters.setdefault( filtername, [] )
+            if value in values:
+                values.remove(value)
+            else:
+                values.append(value)
+            if values==[]:
+                del filters[filtername]
+
+            NewOptions = options( *rs.choice(CONFIGS), filters=filters )
+            self.assertSameBars( BabsFunctions.calcbars(NewOptions, previous),
+                                 oraclebars(trips, NewOptions) )
+            previous = NewOptions
+
+    def test_ranges(self):
+        # Range limits edited together with a checkbox toggle: the bars
+        #    are not updated from the counts of the old limits
+        steps = [ {'Temperature (Max)':{'min':'0'}},
+                  {'Temperature (Max)':{'min':'75'}, 'Customer Type':['Customer']},
+                  {'Time of Day':{'min':'07:00','max':'10:00'}, 'Customer Type':['Customer']},
+                  {'Time of Day':{'min':'06:00','max':'20:00'}, 'Customer Type':['Customer'],
+                   'Region':['San Jose']} ]
+        for config in [(0,0,'1D','None'), (1,3,'1D','Customer Type')]:
+            BabsFunctions.STORE.clear()
+            previous = BabsClasses.PlotOptions()
+            for filters in steps:
+                NewOptions = options( *config, filters=filters )
+                self.assertSameBars( BabsFunctions.calcbars(NewOptions, previous),
+                                     BabsFunctions.cubebars(NewOptions) )
+                previous = NewOptions
+
+    def test_rangechange(self):
+        before = options( 0, 0, '1D', 'None', {'Temperature (Max)':{'min':'0'}} )
+        after = options( 0, 0, '1D', 'None', {'Temperature (Max)':{'min':'75'},
+                                               'Customer Type':['Customer']} )
+        self.assertEqual( BabsFunctions.filterchange(before, after), None )
+        before.filters['Temperature (Max)'] = {'min':'75'}
+        self.assertEqual( BabsFunctions.filterchange(before, after),
+                          ('Customer Type', ['Customer'], []) )
+
+
+class ReleaseTest(EquivalenceCase):
+    """Trips of several releases are merged as the oracle merges them."""
+
+    def setUp(self):
+        EquivalenceCase.setUp(self)
+
+        # 201408: the last 500 trips of 201402 again, as Customers, and
+        #    200 new trips, with the column names of the later releases
+        release = os.path.join(self.datadir, '201402-babs-open-data')
+        trips = pd.read_csv( os.path.join(release, '201402_trip_data.csv') )
+        stations = pd.read_csv( os.path.join(release, '201402_station_data.csv') )
+        weather = pd.read_csv( os.path.join(release, '201402_weather_data.csv') )
+        later = trips.iloc[-700:].copy()
+        later['Subscription Type'] = 'Customer'
+        later['Trip ID'].values[-200:] += len(trips)
+        later = later.rename( columns={'Subscription Type':'Subscriber Type'} )
+        writerelease( self.datadir, '201408', {'trip':later, 'station':stations,
+                                               'weather':weather} )
+
+    def test_merge(self):
+        oracle = oracletrips(self.datadir)
+        trips = BabsFunctions.loaddata('trip')
+        self.assertEqual( len(trips), 2000+200 )
+        self.assertEqual( list(trips['Trip ID']), list(oracle['Trip ID']) )
+        self.assertEqual( list(trips['Subscription Type'].astype(str)),
+                          list(oracle['Subscription Type']) )
+        for config in CONFIGS:
+            NewOptions = options( *config )
+            self.assertSameBars( BabsFunctions.calcbars(NewOptions),
+                                 oraclebars(oracle, NewOptions) )
+
+
+if __name__ == '__main__':
+    unittest.main()
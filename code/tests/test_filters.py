@@ -0,0 +1,99 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests of the filters applied to the trip data and trip cube.
+#
+########################################################################
+
+# Import modules required by these tests
+import unittest
+import BabsFunctions
+import BabsClasses
+from babsfixtures import FixtureCase, stationframe, tripframe, weatherframe, writerelease
+
+########################################################################
+
+
+class TraceRainTest(FixtureCase):
+    """A precipitation filter starting at a trace ('T') keeps the trace days."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+
+        # San Francisco (stations 2 and 3): a trace of rain on the 1st
+        #    and 4th, none on the 2nd, half an inch on the 3rd
+        weather = weatherframe( [('9/1/2013',94107,'T'), ('9/2/2013',94107,'0'),
+                                 ('9/3/2013',94107,'0.5'), ('9/4/2013',94107,'T')] )
+        perday = {'9/1/2013':3, '9/2/2013':2, '9/3/2013':4, '9/4/2013':5}
+        rows = []
+        for day in sorted(perday):
+            rows += [ ('%s %d:15' % (day,8+ii), 2+ii%2, 'Subscriber') for ii in range(perday[day]) ]
+        writerelease( self.datadir, '201402', {'station':stationframe(), 'weather':weather,
+                                               'trip':tripframe(rows)} )
+
+    def options(self, filters):
+        NewOptions = BabsClasses.PlotOptions()
+        NewOptions.setdivision('None')
+        NewOptions.dT = '1D'
+        NewOptions.filters = filters
+        return NewOptions
+
+    def test_trips(self):
+        trips = BabsFunctions.getdata( 'trip', self.options({'Precipitation':{'min':'T'}}) )
+        self.assertEqual( len(trips), 12 )
+        trips = BabsFunctions.getdata( 'trip', self.options({'Precipitation':{'max':'T'}}) )
+        self.assertEqual( len(trips), 10 )
+
+    def test_cube(self):
+        bars = BabsFunctions.calcbars( self.options({'Precipitation':{'min':'T'}}) )
+        self.assertEqual( bars['Number of Rides'].sum(), 12 )
+        self.assertEqual( list(bars['Number of Rides']), [3,0,4,5] )
+
+
+class BitmapTest(FixtureCase):
+    """Categorical filters on the bitmap index match the boolean mask."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+        rows = [ ('9/%d/2013 %d:15' % (1+ii%3, ii%24), 2+ii%10,
+                  'Subscriber' if ii%4 else 'Customer') for ii in range(60) ]
+        weather = weatherframe( [('9/%d/2013' % day,94107,'0') for day in [1,2,3]] )
+        writerelease( self.datadir, '201402', {'station':stationframe(), 'weather':weather,
+                                               'trip':tripframe(rows)} )
+
+    def options(self, filters):
+        NewOptions = BabsClasses.PlotOptions()
+        NewOptions.filters = filters
+        return NewOptions
+
+    def test_outofrange(self):
+        # Hour 24 and station 99 do not exist; filtering them out keeps
+        #    the other rows
+        NewOptions = self.options( {'Hour of Day':['24','3'], 'Station':['99','4']} )
+        trips = BabsFunctions.getdata( 'trip', self.options({}) )
+        mask = BabsFunctions.filtermask( trips, NewOptions )
+        self.assertEqual( mask.sum(), 60-6-3 )
+        index = BabsFunctions.bitmapindex( trips )
+        self.assertEqual( list(BabsFunctions.filterindex(trips, NewOptions, index)),
+                          list(mask.nonzero()[0]) )
+
+    def test_lazy(self):
+        NewOptions = self.options( {'Customer Type':['Customer']} )
+        self.assertEqual( len(BabsFunctions.getdata('trip', NewOptions)), 45 )
+        index = BabsFunctions.STORE.get( ('bitmap','trip') )
+        self.assertEqual( sorted(index.bitmaps), ['Customer Type'] )
+        size = BabsFunctions.STORE.nbytes
+
+        NewOptions = self.options( {'Customer Type':['Customer'], 'Region':['San Jose']} )
+        self.assertEqual( len(BabsFunctions.getdata('trip', NewOptions)), 36 )
+        self.assertEqual( sorted(index.bitmaps), ['Customer Type','Region'] )
+        self.assertTrue( BabsFunctions.STORE.nbytes>size )
+
+
+if __name__ == '__main__':
+    unittest.main()
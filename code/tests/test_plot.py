@@ -0,0 +1,87 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests of drawing the bar plot (see BabsPlot) on an Agg figure.
+#
+########################################################################
+
+# Import modules required by these tests
+import unittest
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+import numpy as np
+import pandas as pd
+import BabsClasses
+import BabsPlot
+
+########################################################################
+
+
+def options(typeid, binid, dT='1D'):
+    NewOptions = BabsClasses.PlotOptions()
+    NewOptions.typeid = typeid
+    NewOptions.binid = binid
+    NewOptions.dT = dT
+    NewOptions.setdivision('None')
+    return NewOptions
+
+
+class ZoomTest(unittest.TestCase):
+    """A zoom made on one x-axis does not cut the data of another."""
+
+    def setUp(self):
+        self.figure = Figure( figsize=(8,4), dpi=50 )
+        FigureCanvas(self.figure)
+        self.barplot = BabsPlot.BarPlot(self.figure)
+        index = pd.date_range('2013-09-01', periods=2000, freq='1H')
+        self.series = pd.DataFrame( {'Number of Rides': np.arange(2000.)}, index=index )
+
+    def zoom(self):
+        self.barplot.draw( options(0,0,'1H'), self.series, [] )
+        x = BabsPlot.xvalues(self.series.index)
+        self.barplot.ax.set_xlim( x[100], x[150] )
+
+    def test_histogram(self):
+        self.zoom()
+        hist = pd.DataFrame( {'Number of Rides': [5.,3.,8.]}, index=[0,1,2] )
+        self.barplot.draw( options(1,2), hist, [] )
+        self.assertEqual( len(self.barplot.bars[0].patches), 3 )
+
+    def test_sameaxis(self):
+        self.zoom()
+        self.barplot.draw( options(0,0,'1H'), self.series*2, [] )
+        self.assertTrue( len(self.barplot.bars[0].patches)<=60 )
+
+    def test_empty(self):
+        empty = pd.DataFrame( {'Number of Rides': []}, index=pd.DatetimeIndex([]) )
+        self.barplot.draw( options(0,0), empty, [] )
+        self.assertEqual( len(self.barplot.bars[0].patches), 0 )
+
+
+class RegionTest(unittest.TestCase):
+    """Bins that are labels are drawn at integer positions and named."""
+
+    def test_region(self):
+        figure = Figure( figsize=(8,4), dpi=50 )
+        FigureCanvas(figure)
+        barplot = BabsPlot.BarPlot(figure)
+        regions = ['Mountain View','Palo Alto','San Francisco']
+        hist = pd.DataFrame( {'Number of Rides': [5.,3.,8.]}, index=regions )
+        lines = [ ('Temperature (Max)', pd.Series([70.,72.,65.], index=regions)) ]
+        barplot.draw( options(1,4), hist, lines )
+        self.assertEqual( [rect.get_x() for rect in barplot.bars[0].patches], [0,1,2] )
+        self.assertEqual( [label.get_text() for label in barplot.ax.get_xticklabels()],
+                          regions )
+        self.assertEqual( list(barplot.lines[0].get_xdata()), [0.5,1.5,2.5] )
+        figure.canvas.draw()
+
+
+if __name__ == '__main__':
+    unittest.main()
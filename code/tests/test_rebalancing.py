@@ -0,0 +1,127 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests of the conversion of the rebalancing csv to compact types
+#    (see BabsRebalancing.convert), and of reading the cached data
+#    without copying it out of the memory mapped files.
+#
+########################################################################
+
+# Import modules required by these tests
+import unittest
+import os
+import numpy as np
+import pandas as pd
+import BabsCache
+import BabsFunctions
+import BabsRebalancing
+from babsfixtures import FixtureCase, writesynthetic
+
+########################################################################
+
+
+def chunk(station_id, bikes, docks):
+    return pd.DataFrame( {'station_id': station_id, 'bikes_available': bikes,
+                          'docks_available': docks,
+                          'time': '2013/08/29 12:06:01'},
+                         columns=['station_id','bikes_available','docks_available','time'] )
+
+
+class ConvertTest(unittest.TestCase):
+    """Values that do not fit the compact types are not wrapped around."""
+
+    def test_missing(self):
+        data = BabsRebalancing.convert( chunk([2,3], [5.,np.nan], [127.,np.nan]) )
+        self.assertEqual( list(data['bikes_available']), [5,-1] )
+        self.assertEqual( list(data['docks_available']), [127,-1] )
+        self.assertEqual( data['bikes_available'].dtype, np.int8 )
+
+    def test_counts(self):
+        with self.assertRaises(ValueError):
+            BabsRebalancing.convert( chunk([2], [200], [5]) )
+        with self.assertRaises(ValueError):
+            BabsRebalancing.convert( chunk([2], [5], [-1]) )
+
+    def test_station(self):
+        with self.assertRaises(ValueError):
+            BabsRebalancing.convert( chunk([40000], [5], [5]) )
+
+
+def overwrite(column, value):
+    """
+    Sets every row of column of the cached rebalancing data to value,
+    through a mapping of its own. Arrays that are views of the cached
+    files see the new values; copies do not.
+    """
+    manifest = BabsCache.readmanifest('rebalancing')
+    entry = [entry for entry in manifest['columns'] if entry['name']==column][0]
+    values = np.memmap( os.path.join(manifest['dir'], entry['file']), dtype=entry['dtype'],
+                        mode='r+' )
+    values[:] = value
+    values.flush()
+
+
+class MappedTest(FixtureCase):
+    """The rebalancing data is read as views of the mapped files."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+        writesynthetic( self.datadir, ntrips=100, nstations=3,
+                        start='2013-09-01', end='2013-09-02', rebalancing=30 )
+
+    def test_stationslice(self):
+        data = BabsFunctions.stationavailability( 3, '2013-09-01 06:00', '2013-09-01 12:00' )
+        self.assertEqual( len(data['bikes_available']), 13 )
+        self.assertTrue( (data['datetime']>=np.datetime64('2013-09-01T06:00')).all() )
+        for column in ['bikes_available','docks_available']:
+            overwrite(column, 99)
+            self.assertTrue( (data[column]==99).all() )
+
+    def test_loaddata(self):
+        data = BabsRebalancing.loaddata( BabsFunctions.csvfile('rebalancing'), progress=None )
+        self.assertEqual( len(data['station_id']), 3*2*48 )
+        self.assertEqual( list(np.unique(data['station_id'])), [2,3,4] )
+        for column in ['bikes_available','docks_available']:
+            overwrite(column, 99)
+            self.assertTrue( (data[column]==99).all() )
+
+
+class SortTest(FixtureCase):
+    """Unsorted rows are sorted in runs of one chunk that are merged."""
+
+    def test_merge(self):
+        rs = np.random.RandomState(0)
+        nrows = 500
+        status = pd.DataFrame( {'station_id': rs.randint(2, 12, nrows),
+                                'bikes_available': rs.randint(0, 20, nrows),
+                                'docks_available': rs.randint(0, 20, nrows),
+                                'time': pd.to_datetime('2013-09-01') +
+                                        pd.to_timedelta(rs.randint(0, 3*1440, nrows), unit='m')},
+                               columns=['station_id','bikes_available','docks_available','time'] )
+        status['time'] = status['time'].dt.strftime(BabsRebalancing.TIMEFORMAT)
+        filein = os.path.join(self.datadir, 'status.csv')
+        status.to_csv(filein, index=False)
+
+        BabsRebalancing.ingest( filein, [filein], progress=None, chunksize=37 )
+        data = BabsCache.readarrays('rebalancing', [filein])
+        self.assertTrue( BabsRebalancing.issorted( data['station_id'], data['datetime'].view('i8') ) )
+        self.assertFalse( os.path.exists(BabsCache.datasetdir('rebalancingruns')) )
+
+        expected = status.sort_values(['station_id','time'], kind='mergesort')
+        self.assertEqual( list(data['station_id']), list(expected['station_id']) )
+        self.assertEqual( list(pd.DatetimeIndex(data['datetime']).strftime(BabsRebalancing.TIMEFORMAT)),
+                          list(expected['time']) )
+        self.assertEqual( sorted(zip(data['station_id'], data['datetime'].view('i8'),
+                                     data['bikes_available'], data['docks_available'])),
+                          sorted(zip(status['station_id'],
+                                     pd.to_datetime(status['time']).values.view('i8'),
+                                     status['bikes_available'], status['docks_available'])) )
+
+
+if __name__ == '__main__':
+    unittest.main()
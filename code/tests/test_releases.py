@@ -0,0 +1,138 @@
+########################################################################
+#
+#        Kevin Wecht                4 November 2014
+#
+#    Bay Area Bicycle Share (BABS) Open Data Challenge
+#
+########################################################################
+#
+#    Tests of loading several BABS releases together: which directories
+#    are releases, renamed files and columns of later releases, and
+#    the rows kept when releases overlap.
+#
+########################################################################
+
+# Import modules required by these tests
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+import BabsFunctions
+import BabsReleases
+import BabsSynthetic
+from babsfixtures import FixtureCase, stationframe, tripframe, weatherframe, writerelease
+
+########################################################################
+
+# Weather columns of the 201508 release and later
+WEATHER201508 = {'Date':'PDT', 'Max_Temperature_F':'Max TemperatureF',
+                 'Mean_Temperature_F':'Mean TemperatureF', 'Min_TemperatureF':'Min TemperatureF',
+                 'Mean_Wind_Speed_MPH ':' Mean Wind SpeedMPH', 'Max_Gust_Speed_MPH':' Max Gust SpeedMPH',
+                 'Precipitation_In ':'PrecipitationIn', 'Events':' Events', 'zip':'Zip'}
+
+
+class ReleaseTest(FixtureCase):
+    """A 201402 release and a 201508 release with renamed files and columns."""
+
+    def setUp(self):
+        FixtureCase.setUp(self)
+
+        # 201402: trips 1-4 in September 2013
+        rows = [('9/1/2013 8:00',2,'Subscriber'), ('9/1/2013 9:00',4,'Customer'),
+                ('9/2/2013 8:00',6,'Subscriber'), ('9/2/2013 17:00',2,'Customer')]
+        writerelease( self.datadir, '201402',
+                      {'station':stationframe(), 'trip':tripframe(rows),
+                       'weather':weatherframe([('9/1/2013',94107,'0'), ('9/2/2013',94107,'T')])} )
+
+        # 201508: trip 4 again (kept from this release) and trips 5-6 in
+        #    August 2015, with the renamed columns of the later releases
+        rows = [('9/2/2013 17:00',2,'Subscriber'),
+                ('8/1/2015 8:00',2,'Subscriber'), ('8/2/2015 12:00',3,'Customer')]
+        trips = tripframe(rows, firstid=4).rename( columns={'Subscription Type':'Subscriber Type'} )
+        stations = stationframe()
+        stations['installation'] = '1/1/2015'
+        stations.loc[9,'landmark'] = 'San Jose'
+        weather = weatherframe( [('8/1/2015',94107,'0.25'), ('8/2/2015',94107,'0')] )
+        weather = weather.rename( columns=WEATHER201508 )
+        status = pd.DataFrame( {'station_id':[2,2], 'bikes_available':[5,6],
+                                'docks_available':[10,9],
+                                'time':['2015/08/01 08:00:00','2015/08/01 08:01:00']},
+                               columns=['station_id','bikes_available','docks_available','time'] )
+        writerelease( self.datadir, '201508',
+                      {'station':stations, 'trip':trips, 'weather':weather, 'rebalancing':status},
+                      filenames={'rebalancing':'status'} )
+
+        # Directories that are not releases
+        writerelease( self.datadir, 'synthetic', {'trip':tripframe(rows, firstid=1)} )
+        os.makedirs( os.path.join(self.datadir, 'cache-babs-open-data') )
+
+    def test_releases(self):
+        self.assertEqual( [name for name,thisdir in BabsReleases.releases()], ['201402','201508'] )
+        self.assertEqual( [os.path.basename(filein) for filein in BabsReleases.releasefiles('rebalancing')],
+                          ['201508_status_data.csv'] )
+
+    def test_trips(self):
+        trips = BabsFunctions.loaddata('trip')
+        self.assertEqual( sorted(trips['Trip ID']), [1,2,3,4,5,6] )
+        types = trips.set_index('Trip ID')['Subscription Type']
+        self.assertEqual( [str(types[val]) for val in [1,2,3,4,5,6]],
+                          ['Subscriber','Customer','Subscriber','Subscriber','Subscriber','Customer'] )
+
+    def test_weather(self):
+        weather = BabsFunctions.loaddata('weather')
+        self.assertEqual( len(weather), 4 )
+        self.assertFalse( weather['Max_Temperature_F'].isnull().any() )
+        precip = weather.set_index('dateordinal')['Precipitation_In ']
+        self.assertAlmostEqual( precip[pd.Timestamp('2015-08-01').toordinal()], 0.25 )
+        self.assertAlmostEqual( precip[pd.Timestamp('2013-09-02').toordinal()], BabsFunctions.PRECIPTRACE )
+
+        # Weather joined to the San Francisco trips of both releases
+        trips = BabsFunctions.loaddata('trip').set_index('Trip ID')
+        self.assertFalse( trips.loc[[1,4,5,6],'Max_Temperature_F'].isnull().any() )
+        self.assertEqual( str(trips.loc[5,'Events']), 'Rain' )
+
+    def test_stations(self):
+        stations = BabsFunctions.loaddata('station').set_index('station_id')
+        self.assertEqual( len(stations), 10 )
+        self.assertEqual( stations.loc[11,'landmark'], 'San Jose' )
+        self.assertEqual( stations.loc[2,'date'], pd.Timestamp('2013-08-06') )
+
+    def test_rebalancing(self):
+        self.assertEqual( os.path.basename(BabsFunctions.csvfile('rebalancing')), '201508_status_data.csv' )
+        data = BabsFunctions.readcsv('rebalancing')
+        self.assertEqual( list(data['bikes_available']), [5,6] )
+
+    def test_missingcolumn(self):
+        header = ['Trip ID','Duration','Start Date','End Date','Start Terminal','Customer Kind']
+        with self.assertRaises(ValueError):
+            BabsReleases.columnnames( 'trip', os.path.join(self.datadir,'201508-babs-open-data',
+                                                           '201508_trip_data.csv'), header )
+
+
+class SyntheticTest(FixtureCase):
+    """The synthetic data is not loaded with the real releases."""
+
+    def test_outdir(self):
+        argv = sys.argv
+        sys.argv = ['BabsSynthetic.py', '--trips', '200', '--stations', '6',
+                    '--end', '2013-09-05', '--rebalancing-minutes', '0']
+        try:
+            BabsSynthetic.main()
+        finally:
+            sys.argv = argv
+        self.assertEqual( BabsReleases.releases(), [] )
+
+        dataroot = BabsReleases.DATAROOT
+        BabsReleases.DATAROOT = '../data/synthetic/'
+        try:
+            files = BabsReleases.releasefiles('trip')
+        finally:
+            BabsReleases.DATAROOT = dataroot
+        self.assertEqual( len(files), 1 )
+        trips = pd.read_csv(files[0])
+        self.assertTrue( (trips['Trip ID']>=BabsSynthetic.FIRSTTRIPID).all() )
+
+
+if __name__ == '__main__':
+    unittest.main()